@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the manifest generation engines.
+
+Generates a reproducible synthetic image group: JPEGs and TIFFs of varied sizes and compressions,
+plus truncated images and files which are not images. Then it builds its manifest with each engine,
+each in a fresh process, and reports images/sec, bytes read, peak RSS and CPU time as JSON.
+Peak RSS is the engine process's high water mark, reset once the engine is set up (Linux only.)
+CPU time is the engine process's, from then on: it does not include imports or uploads.
+
+Engines:
+    fs-async, fs-sync:          generateManifest_a and generateManifest_s, header probing
+    fs-async-full, fs-sync-full:  the same, reading whole files
+    s3, s3-full:                S3ImageRepository, probing or downloading
+    s3async:                    AsyncS3ImageRepository. Requires aiobotocore. Its bytes read are not measured
+
+The S3 engines read from a moto server, which runs in the benchmark's own process, so that its memory
+and CPU time are not the engines'. They require moto (pip install 'moto[server]'), which is not a
+dependency of the package.
+
+usage: PYTHONPATH=. python benchmark/manifestBenchmark.py [-n 200] [-o results.json] [--baseline old.json]
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+from PIL import Image
+
+ENGINES: [str] = ['fs-async', 'fs-sync', 'fs-async-full', 'fs-sync-full', 's3', 's3-full', 's3async']
+BENCH_WORK: str = "W1BENCH"
+BENCH_IMAGE_GROUP: str = "I1BENCH"
+BENCH_BUCKET: str = "benchmark.bdrc.org"
+MOTO_PORT: int = 5199
+
+# Relative frequency of each kind of synthetic file
+FILE_KINDS: {str: int} = {'jpeg': 50, 'tiff-none': 8, 'tiff-lzw': 8, 'tiff-group4': 14, 'tiff-packbits': 5,
+                          'truncated-jpeg': 5, 'not-an-image': 5, 'text': 5}
+
+
+def synthetic_file(kind: str, rng: random.Random) -> (str, bytes):
+    """
+    :param kind: one of FILE_KINDS
+    :param rng: seeded generator
+    :return: file suffix and contents
+    """
+    width = rng.randrange(800, 3200)
+    height = rng.randrange(600, 2400)
+    # noise does not compress, so files are about as large as real scans
+    scan = Image.effect_noise((width, height), rng.randrange(16, 96))
+    out = io.BytesIO()
+    if kind == 'jpeg':
+        Image.merge('RGB', (scan, scan, scan)).save(out, format='JPEG', quality=rng.randrange(60, 95),
+                                                    dpi=(400, 400))
+        return 'jpg', out.getvalue()
+    if kind == 'tiff-group4':
+        scan.convert('1').save(out, format='TIFF', compression='group4', dpi=(600, 600))
+        return 'tif', out.getvalue()
+    if kind.startswith('tiff-'):
+        compression = kind.split('-', 1)[1]
+        scan.save(out, format='TIFF', compression=None if compression == 'none' else compression)
+        return 'tif', out.getvalue()
+    if kind == 'truncated-jpeg':
+        scan.save(out, format='JPEG')
+        return 'jpg', out.getvalue()[:rng.randrange(100, 2000)]
+    if kind == 'not-an-image':
+        size = rng.randrange(1000, 100000)
+        return 'jpg', rng.getrandbits(size * 8).to_bytes(size, 'little')
+    return 'json', json.dumps([{"filename": f"I{i:04}.jpg"} for i in range(100)]).encode()
+
+
+def generate_image_group(image_count: int, seed: int) -> [(str, bytes)]:
+    """
+    :param image_count: number of files
+    :param seed: the same seed gives the same files
+    :return: file names and contents
+    """
+    rng = random.Random(seed)
+    kinds: [str] = rng.choices(list(FILE_KINDS), weights=list(FILE_KINDS.values()), k=image_count)
+    files: [(str, bytes)] = []
+    for i, kind in enumerate(kinds):
+        suffix, data = synthetic_file(kind, rng)
+        files.append((f"{BENCH_IMAGE_GROUP}{i:04}.{suffix}", data))
+    return files
+
+
+def process_io_bytes() -> int:
+    """
+    :return: bytes this process has read through read syscalls, or 0 where /proc is not available
+    """
+    try:
+        with open('/proc/self/io') as proc_io:
+            return int(next(line for line in proc_io if line.startswith('rchar:')).split()[1])
+    except (OSError, StopIteration):
+        return 0
+
+
+def reset_peak_rss() -> bool:
+    """
+    Resets this process's peak RSS, so that it does not include the interpreter it was forked from,
+    nor the engine's setup
+    :return: True if peak_rss_kb() now measures from here, False where /proc does not allow it
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def cpu_seconds() -> float:
+    """
+    :return: this process's user and system CPU time so far
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def peak_rss_kb() -> int:
+    """
+    :return: this process's peak RSS, in kilobytes: since reset_peak_rss(), where it is supported
+    """
+    try:
+        with open('/proc/self/status') as status:
+            return int(next(line for line in status if line.startswith('VmHWM:')).split()[1])
+    except (OSError, StopIteration):
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS bytes
+        return max_rss if sys.platform != 'darwin' else max_rss // 1024
+
+
+def count_s3_bytes(client, counter: [int]):
+    """
+    Adds the body size of every GetObject response of client, ranged or whole, to counter[0]
+    """
+    def after_get(parsed, **kwargs):
+        counter[0] += parsed.get('ContentLength', 0)
+
+    client.meta.events.register('after-call.s3.GetObject', after_get)
+
+
+def run_engine(engine: str, image_group_dir: str, concurrency: int, repeat: int) -> dict:
+    """
+    Builds the manifest repeat times with one engine. Runs in its own process, so that
+    peak RSS and CPU time are the engine's own. The S3 engines need start_s3_server() first.
+    :return: measurements
+    """
+    import asyncio
+    from pathlib import Path
+
+    manifest: [] = []
+    timings: [float] = []
+    bytes_read: [int] = [0]
+
+    if engine.startswith('fs'):
+        from v_m_b.image.generateManifest import generateManifest_a, generateManifest_s
+        header_probe = not engine.endswith('-full')
+        peak_reset = reset_peak_rss()
+        cpu_start = cpu_seconds()
+        for _ in range(repeat):
+            start_bytes = process_io_bytes()
+            tick = time.perf_counter()
+            if engine.startswith('fs-async'):
+                manifest = asyncio.run(generateManifest_a(Path(image_group_dir), header_probe, concurrency))
+            else:
+                manifest = generateManifest_s(Path(image_group_dir), header_probe)
+            timings.append(time.perf_counter() - tick)
+            bytes_read[0] = process_io_bytes() - start_bytes
+    else:
+        manifest, peak_reset, cpu_start = run_s3_engine(engine, image_group_dir, concurrency, repeat, timings,
+                                                        bytes_read)
+    cpu_used: float = cpu_seconds() - cpu_start
+
+    images = len([x for x in manifest if 'error' not in x])
+    best = min(timings)
+    return {'engine': engine,
+            'files': len(os.listdir(image_group_dir)),
+            'images': images,
+            'seconds_best': round(best, 4),
+            'seconds_median': round(statistics.median(timings), 4),
+            'images_per_sec': round(images / best, 2) if best > 0 else None,
+            'bytes_read': bytes_read[0],
+            'peak_rss_kb': peak_rss_kb(),
+            'peak_rss_reset': peak_reset,
+            # of the builds only: not the imports, nor the S3 engines' upload
+            'cpu_seconds': round(cpu_used, 3)}
+
+
+def start_s3_server():
+    """
+    Starts the moto server of the S3 engines, in this process, and points the engine processes to it
+    :return: the server, to stop
+    """
+    import logging
+    from moto.server import ThreadedMotoServer
+
+    os.environ.update({'AWS_ACCESS_KEY_ID': 'benchmark', 'AWS_SECRET_ACCESS_KEY': 'benchmark',
+                       'AWS_DEFAULT_REGION': 'us-east-1', 'AWS_ENDPOINT_URL': f"http://127.0.0.1:{MOTO_PORT}"})
+    # one access log line per request otherwise
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = ThreadedMotoServer(port=MOTO_PORT, verbose=False)
+    server.start()
+    return server
+
+
+def run_s3_engine(engine: str, image_group_dir: str, concurrency: int, repeat: int, timings: [float],
+                  bytes_read: [int]) -> ([], bool, float):
+    """
+    Uploads the image group to the moto server, then builds its manifest from there
+    :return: the last manifest, whether the peak RSS was reset after the upload, and the CPU time before
+    the builds
+    """
+    import boto3
+    from botocore.config import Config
+    # manifestCommons first: the repositories import it
+    import v_m_b.manifestCommons
+    from v_m_b.ImageRepository.S3ImageRepository import S3ImageRepository
+
+    client = boto3.client('s3', region_name='us-east-1', config=Config(max_pool_connections=concurrency))
+    client.create_bucket(Bucket=BENCH_BUCKET)
+    bucket = boto3.resource('s3', region_name='us-east-1').Bucket(BENCH_BUCKET)
+    if engine == 's3async':
+        from v_m_b.ImageRepository.AsyncS3ImageRepository import AsyncS3ImageRepository
+        repo = AsyncS3ImageRepository(BENCH_BUCKET, 'images', max_concurrency=concurrency)
+        prefix: str = repo.resolve_image_group(BENCH_WORK, BENCH_IMAGE_GROUP)
+    else:
+        repo = S3ImageRepository(client, bucket, 'images', header_probe=engine == 's3',
+                                 max_concurrency=concurrency)
+        prefix: str = repo.resolve_image_group(BENCH_WORK, BENCH_IMAGE_GROUP).key
+    for file_name in sorted(os.listdir(image_group_dir)):
+        with open(os.path.join(image_group_dir, file_name), 'rb') as image_file:
+            client.put_object(Bucket=BENCH_BUCKET, Key=f"{prefix}/{file_name}", Body=image_file.read())
+
+    manifest: [] = []
+    if engine == 's3async':
+        # the repository's aiobotocore client is its own
+        bytes_read[0] = None
+    else:
+        count_s3_bytes(client, bytes_read)
+    peak_reset = reset_peak_rss()
+    cpu_start = cpu_seconds()
+    for _ in range(repeat):
+        if bytes_read[0] is not None:
+            bytes_read[0] = 0
+        tick = time.perf_counter()
+        manifest = repo.generateManifest(BENCH_WORK, BENCH_IMAGE_GROUP)
+        timings.append(time.perf_counter() - tick)
+    repo.close()
+    return manifest, peak_reset, cpu_start
+
+
+def compare(results: [dict], baseline: [dict], tolerance: float) -> [str]:
+    """
+    :param results: this run's results
+    :param baseline: an earlier run's results
+    :param tolerance: allowed relative drop of images/sec
+    :return: descriptions of the engines which regressed
+    """
+    regressions: [str] = []
+    earlier: {str: dict} = {x['engine']: x for x in baseline}
+    for result in results:
+        before = earlier.get(result['engine'])
+        if before is None or not before.get('images_per_sec') or not result.get('images_per_sec'):
+            continue
+        ratio = result['images_per_sec'] / before['images_per_sec']
+        if ratio < 1 - tolerance:
+            regressions.append(f"{result['engine']}: {before['images_per_sec']} -> {result['images_per_sec']} "
+                               f"images/sec ({ratio:.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the manifest generation engines")
+    parser.add_argument('-n', '--images', type=int, default=200, help="files in the synthetic image group")
+    parser.add_argument('-s', '--seed', type=int, default=1, help="synthetic data seed")
+    parser.add_argument('-e', '--engines', default=','.join(ENGINES),
+                        help=f"comma separated engines to run. Default: {','.join(ENGINES)}")
+    parser.add_argument('-j', '--concurrency', type=int, default=10, help="images in flight, for the engines "
+                                                                         "which run several")
+    parser.add_argument('-r', '--repeat', type=int, default=3, help="runs per engine. The best one is reported")
+    parser.add_argument('-d', '--data-dir', help="keep the synthetic image group in this directory, and reuse "
+                                                 "it if it is there")
+    parser.add_argument('-o', '--output', help="JSON results file. Default: standard output")
+    parser.add_argument('--baseline', help="earlier JSON results: exit with status 1 if an engine got slower")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed images/sec drop against "
+                                                                    "--baseline, as a fraction")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        image_group_dir = args.data_dir or os.path.join(scratch, BENCH_IMAGE_GROUP)
+        os.makedirs(image_group_dir, exist_ok=True)
+        if len(os.listdir(image_group_dir)) == 0:
+            for file_name, data in generate_image_group(args.images, args.seed):
+                with open(os.path.join(image_group_dir, file_name), 'wb') as out:
+                    out.write(data)
+
+        results: [dict] = []
+        engines: [str] = args.engines.split(',')
+        s3_server = None
+        s3_unavailable: str = None
+        if any(engine.startswith('s3') for engine in engines):
+            try:
+                s3_server = start_s3_server()
+            except ImportError as e:
+                s3_unavailable = f"{type(e).__name__} {e}"
+        # a fresh interpreter for each engine
+        spawn = multiprocessing.get_context('spawn')
+        try:
+            for engine in engines:
+                if engine.startswith('s3') and s3_unavailable:
+                    results.append({'engine': engine, 'skipped': s3_unavailable})
+                else:
+                    with spawn.Pool(1) as pool:
+                        try:
+                            results.append(pool.apply(run_engine, (engine, image_group_dir, args.concurrency,
+                                                                   args.repeat)))
+                        except ImportError as e:
+                            results.append({'engine': engine, 'skipped': f"{type(e).__name__} {e}"})
+                print(json.dumps(results[-1]), file=sys.stderr)
+        finally:
+            if s3_server is not None:
+                s3_server.stop()
+
+    report: dict = {'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                    'python': platform.python_version(),
+                    'platform': platform.platform(),
+                    'cpus': os.cpu_count(),
+                    'parameters': {'images': args.images, 'seed': args.seed, 'concurrency': args.concurrency,
+                                   'repeat': args.repeat},
+                    'results': results}
+    if args.output:
+        with open(args.output, 'w') as out:
+            json.dump(report, out, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file)['results'], args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -22,6 +22,7 @@ setup(version='1.3.2',
       entry_points={'console_scripts': console_scripts},
       install_requires=['boto3', 'requests', 'lxml', 'pillow', 'botocore', 'boto',
                         'aiofiles', 'requests', 'bdrc-util'],
+      extras_require={'async': ['aiobotocore'], 'colorclass': ['numpy']},
       python_requires='>=3.7',
       classifiers=["Programming Language :: Python :: 3", "License :: OSI Approved :: MIT License",
                    "Operating System :: OS Independent",
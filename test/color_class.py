@@ -0,0 +1,51 @@
+import io
+import unittest
+
+from PIL import Image, ImageDraw
+
+from v_m_b.image.colorClass import classify_color, COLOR, GRAYSCALE, BLACK_AND_WHITE
+from v_m_b.image.generateManifest import fillDataWithBlobImage
+
+
+def jpeg(im: Image.Image) -> io.BytesIO:
+    out = io.BytesIO()
+    im.save(out, format="JPEG", quality=90)
+    out.seek(0)
+    return out
+
+
+def page(paper: tuple, ink: tuple) -> Image.Image:
+    # blocks of ink large enough to survive the reduction
+    im = Image.new("RGB", (1600, 1200), paper)
+    draw = ImageDraw.Draw(im)
+    for y in range(0, 1200, 300):
+        draw.rectangle((0, y, 1600, y + 100), fill=ink)
+    return im
+
+
+class ColorClassTestCase(unittest.TestCase):
+    def test_color(self):
+        im = Image.merge("RGB", (Image.linear_gradient("L"), Image.new("L", (256, 256), 30),
+                                 Image.linear_gradient("L").rotate(90))).resize((1600, 1200))
+        self.assertEqual(COLOR, classify_color(Image.open(jpeg(im))))
+
+    def test_grayscale(self):
+        gradient = Image.linear_gradient("L").resize((1600, 1200)).convert("RGB")
+        self.assertEqual(GRAYSCALE, classify_color(Image.open(jpeg(gradient))))
+
+    def test_black_and_white_on_yellowed_paper(self):
+        self.assertEqual(BLACK_AND_WHITE, classify_color(Image.open(jpeg(page((255, 250, 225), (10, 8, 0))))))
+        self.assertEqual(BLACK_AND_WHITE, classify_color(Image.new("1", (100, 100))))
+
+    def test_manifest_field_is_opt_in(self):
+        blob = jpeg(page((255, 255, 255), (0, 0, 0)))
+        data = {"filename": "I0001.jpg"}
+        fillDataWithBlobImage(blob, data)
+        self.assertNotIn("colorclass", data)
+        blob.seek(0)
+        fillDataWithBlobImage(blob, data, colorclass=True)
+        self.assertEqual(BLACK_AND_WHITE, data["colorclass"])
+
+
+if __name__ == '__main__':
+    unittest.main()
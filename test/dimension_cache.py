@@ -0,0 +1,50 @@
+import os
+import tempfile
+import unittest
+
+from v_m_b.DimensionCache import DimensionCache
+
+
+class DimensionCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self._db_path = os.path.join(self._dir.name, "dims.db")
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_hit_only_when_unchanged(self):
+        cache = DimensionCache(self._db_path)
+        data = {"filename": "I0001.jpg", "width": 100, "height": 50, "dpi": []}
+        cache.put("/w/I0001.jpg", 1234, "5678", data)
+        self.assertEqual(data, cache.get("/w/I0001.jpg", 1234, "5678"))
+        self.assertIsNone(cache.get("/w/I0001.jpg", 1235, "5678"))
+        self.assertIsNone(cache.get("/w/I0001.jpg", 1234, "5679"))
+        self.assertIsNone(cache.get("/w/I0002.jpg", 1234, "5678"))
+        cache.close()
+
+    def test_persists(self):
+        cache = DimensionCache(self._db_path)
+        cache.put("s3://b/k", 1, "etag", {"filename": "k"})
+        cache.close()
+        cache = DimensionCache(self._db_path)
+        self.assertEqual({"filename": "k"}, cache.get("s3://b/k", 1, "etag"))
+        cache.close()
+
+    def test_evicts_least_recently_used(self):
+        cache = DimensionCache(self._db_path, max_entries=10)
+        for i in range(10):
+            cache.put(f"/w/{i}", i, "v", {"filename": str(i)})
+        # touch the oldest, so it survives
+        cache.get("/w/0", 0, "v")
+        for i in range(10, 12):
+            cache.put(f"/w/{i}", i, "v", {"filename": str(i)})
+        self.assertIsNotNone(cache.get("/w/0", 0, "v"))
+        self.assertIsNone(cache.get("/w/1", 1, "v"))
+        self.assertIsNone(cache.get("/w/2", 2, "v"))
+        self.assertIsNotNone(cache.get("/w/11", 11, "v"))
+        cache.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import io
+import json
+import os
+import subprocess
+import sys
+import unittest
+from unittest import mock
+
+from PIL import Image
+
+from v_m_b.image.formatSniffer import sniff_format, is_known_non_image, open_image
+from v_m_b.image.generateManifest import fillDataWithBlobImage
+
+# fills manifest entries of a JPEG, a TIFF and a PNG, in a fresh interpreter, and reports
+# how far PIL got in loading its plugins: 1 is preinit, the common plugins, 2 is init, all of them
+FRESH_PARSE = """
+import io
+import json
+from PIL import Image
+from v_m_b.image.generateManifest import fillDataWithBlobImage
+entries = []
+for image_format in ("JPEG", "TIFF"):
+    out = io.BytesIO()
+    Image.new("RGB", (30, 20)).save(out, format=image_format)
+    entries.append({"filename": "a." + image_format.lower()})
+    fillDataWithBlobImage(io.BytesIO(out.getvalue()), entries[-1])
+print(json.dumps({"entries": entries, "initialized": Image._initialized}))
+"""
+
+
+def image_bytes(image_format: str) -> bytes:
+    out = io.BytesIO()
+    Image.new("L", (30, 20)).save(out, format=image_format)
+    return out.getvalue()
+
+
+class FormatSnifferTestCase(unittest.TestCase):
+    def test_sniff_format(self):
+        self.assertEqual("JPEG", sniff_format(image_bytes("JPEG")))
+        self.assertEqual("TIFF", sniff_format(image_bytes("TIFF")))
+        self.assertEqual("TIFF", sniff_format(b"MM\x00*\x00\x00\x00\x08"))
+        self.assertIsNone(sniff_format(image_bytes("PNG")))
+        self.assertIsNone(sniff_format(b""))
+
+    def test_known_non_images(self):
+        for name in ("fileList.json", "dimensions.json", ".DS_Store", "._I0001.tif", "notes.TXT"):
+            self.assertTrue(is_known_non_image(name), name)
+        for name in ("I0001.tif", "I0001.jpg", "I0001.png"):
+            self.assertFalse(is_known_non_image(name), name)
+
+    def test_other_formats_still_open(self):
+        data = {"filename": "I0001.jpg"}
+        fillDataWithBlobImage(io.BytesIO(image_bytes("PNG")), data)
+        self.assertEqual((30, 20, "PNG"), (data["width"], data["height"], data["format"]))
+
+    def test_buffer_at_its_end_is_sniffed(self):
+        for image_format in ("JPEG", "TIFF"):
+            blob = io.BytesIO(image_bytes(image_format))
+            blob.seek(0, io.SEEK_END)
+            with mock.patch.object(Image, "open", wraps=Image.open) as pil_open:
+                image = open_image(blob)
+            self.assertEqual([image_format], pil_open.call_args.kwargs.get("formats"))
+            self.assertEqual((30, 20, image_format), image.size + (image.format,))
+
+    def test_jpeg_and_tiff_skip_plugin_init(self):
+        package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([package_root, os.environ.get('PYTHONPATH', '')]))
+        out = subprocess.run([sys.executable, '-c', FRESH_PARSE], env=env, cwd=package_root,
+                             capture_output=True, text=True, check=True)
+        parsed = json.loads(out.stdout.splitlines()[-1])
+        self.assertEqual([(30, 20), (30, 20)], [(x["width"], x["height"]) for x in parsed["entries"]])
+        self.assertLess(parsed["initialized"], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import io
+import os
+import unittest
+
+from PIL import Image
+
+from v_m_b.image.generateManifest import fillDataWithBlobImage
+from v_m_b.image.headerProbe import RangeReader
+
+try:
+    from moto import mock_aws
+except ImportError:
+    mock_aws = None
+
+
+def make_image(image_format: str, **save_args) -> bytes:
+    # noise does not compress, so the files are large compared to their headers
+    out = io.BytesIO()
+    Image.effect_noise((1200, 900), 64).convert("RGB").save(out, format=image_format, **save_args)
+    return out.getvalue()
+
+
+def probe(blob: bytes, file_name: str) -> (dict, RangeReader):
+    def fetch(start: int, end: int) -> bytes:
+        return blob[start:end + 1]
+
+    reader = RangeReader(fetch, len(blob))
+    data = {"filename": file_name}
+    fillDataWithBlobImage(reader, data, len(blob))
+    return data, reader
+
+
+def read_whole(blob: bytes, file_name: str) -> dict:
+    data = {"filename": file_name}
+    fillDataWithBlobImage(io.BytesIO(blob), data)
+    return data
+
+
+class HeaderProbeTestCase(unittest.TestCase):
+    def test_jpeg_reads_prefix_only(self):
+        blob = make_image("JPEG", dpi=(400, 400))
+        data, reader = probe(blob, "a.jpg")
+        self.assertEqual(data, read_whole(blob, "a.jpg"))
+        self.assertEqual(1, reader.fetch_count)
+        self.assertLess(reader.bytes_fetched, len(blob))
+
+    def test_jpeg_large_icc_before_sof(self):
+        blob = make_image("JPEG", icc_profile=bytes(300 * 1024))
+        data, reader = probe(blob, "a.tif")
+        self.assertEqual(data, read_whole(blob, "a.tif"))
+        self.assertLess(reader.bytes_fetched, len(blob))
+
+    def test_tiff_ifd_at_end(self):
+        blob = make_image("TIFF", compression="tiff_lzw", dpi=(300, 300))
+        # libtiff writes the IFD after the strips
+        self.assertGreater(int.from_bytes(blob[4:8], "little"), len(blob) // 2)
+        data, reader = probe(blob, "a.jpg")
+        self.assertEqual(data, read_whole(blob, "a.jpg"))
+        self.assertEqual("TIFF", data["format"])
+        self.assertLess(reader.bytes_fetched, len(blob) // 2)
+
+    def test_not_an_image(self):
+        data, reader = probe(b'{"filename": "I0001.tif"}', "I0002.jpg")
+        self.assertEqual("UnidentifiedImageError", data["error"])
+
+    def test_known_non_image_is_not_read(self):
+        data, reader = probe(b'{"filename": "I0001.tif"}', "fileList.json")
+        self.assertEqual("NotAnImage", data["error"])
+        self.assertEqual(0, reader.fetch_count)
+
+    def test_source_shorter_than_size(self):
+        # the object was replaced, or the file truncated, since its size was listed
+        source = bytes(range(100))
+        reader = RangeReader(lambda start, end: source[start:end + 1], 200, block_size=64)
+        with self.assertRaises(IOError):
+            reader.read(150)
+        blob = make_image("JPEG")
+        shrunk = blob[:100]
+        reader = RangeReader(lambda start, end: shrunk[start:end + 1], len(blob), block_size=1024)
+        data = {"filename": "a.jpg"}
+        fillDataWithBlobImage(reader, data, len(blob))
+        self.assertIn("error", data)
+
+
+@unittest.skipIf(mock_aws is None, "requires moto")
+class S3HeaderProbeTestCase(unittest.TestCase):
+    def setUp(self):
+        os.environ.update(AWS_ACCESS_KEY_ID="testing", AWS_SECRET_ACCESS_KEY="testing", AWS_DEFAULT_REGION="us-east-1")
+        self._aws = mock_aws()
+        self._aws.start()
+        self.addCleanup(self._aws.stop)
+        import boto3
+        self.client = boto3.client("s3", region_name="us-east-1")
+        self.client.create_bucket(Bucket="bkt")
+        self.bucket = boto3.resource("s3", region_name="us-east-1").Bucket("bkt")
+        self.gets: [dict] = []
+        self.client.meta.events.register('before-call.s3.GetObject',
+                                         lambda params, **kwargs: self.gets.append(dict(params)))
+        self.fetched = [0]
+        self.client.meta.events.register('after-call.s3.GetObject', self.count_bytes)
+        self.blobs = {"I10001.jpg": make_image("JPEG", dpi=(400, 400)),
+                      "I10002.tif": make_image("TIFF", compression="tiff_lzw", dpi=(300, 300))}
+
+    def count_bytes(self, parsed, **kwargs):
+        self.fetched[0] += parsed.get("ContentLength", 0)
+
+    def manifest(self, header_probe: bool) -> [dict]:
+        import v_m_b.manifestCommons as Common
+        from v_m_b.ImageRepository.S3ImageRepository import S3ImageRepository
+        with S3ImageRepository(self.client, self.bucket, Common.VMT_IMAGES, header_probe=header_probe) as repo:
+            prefix = repo.resolve_image_group("W1", "I1").key
+            for file_name, blob in self.blobs.items():
+                self.client.put_object(Bucket="bkt", Key=f"{prefix}/{file_name}", Body=blob)
+            return repo.generateManifest("W1", "I1")
+
+    def test_probe_uses_ranged_gets(self):
+        probed = self.manifest(header_probe=True)
+        # a prefix of each image, and the end of the TIFF, where PIL wrote its IFD
+        self.assertEqual(sorted(self.blobs), sorted({get["url_path"].rsplit("/", 1)[1] for get in self.gets}))
+        self.assertTrue(all(get["headers"].get("Range", "").startswith("bytes=") for get in self.gets))
+        self.assertLessEqual(len(self.gets), 2 * len(self.blobs))
+        self.assertLess(self.fetched[0], sum(len(blob) for blob in self.blobs.values()) / 4)
+        # the same entries as decoding the whole images
+        self.assertEqual(self.manifest(header_probe=False), probed)
+
+
+if __name__ == '__main__':
+    unittest.main()
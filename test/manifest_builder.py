@@ -0,0 +1,140 @@
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from PIL import Image
+
+import v_m_b.manifestCommons as Common
+from v_m_b.ImageRepository.FSImageRepository import FSImageRepository
+from v_m_b.VolumeInfo.VolumeInfoCache import VolumeInfoCache
+import v_m_b.manifestBuilder as manifestBuilder
+from v_m_b.manifestBuilder import ManifestBuilder, pipelined, with_volume_infos
+
+
+class ManifestBuilderTestCase(unittest.TestCase):
+    def setUp(self):
+        self._container = tempfile.TemporaryDirectory()
+        self.image_group_dir = os.path.join(self._container.name, "W1", "images", "W1-I1")
+        os.makedirs(self.image_group_dir)
+        for name, size in (("I10001.jpg", (120, 80)), ("I10002.jpg", (60, 90))):
+            Image.new("L", size).save(os.path.join(self.image_group_dir, name))
+        # known image groups, so that no lookup goes to BUDA
+        self.volume_infos = VolumeInfoCache()
+        self.volume_infos.put("W1", ["I1"])
+        self.repo = FSImageRepository(self._container.name, Common.VMT_IMAGES)
+
+    def tearDown(self):
+        self.repo.close()
+        self.volume_infos.close()
+        self._container.cleanup()
+
+    def test_build_reports_each_volume(self):
+        with ManifestBuilder(self.repo, volume_info_cache=self.volume_infos) as builder:
+            results = list(builder.build([("W1", None), ("W2", [])]))
+
+        self.assertEqual([("W1", "I1", True), ("W2", None, False)],
+                         [(x.work_rid, x.image_group, x.success) for x in results])
+        with gzip.open(os.path.join(self.image_group_dir, Common.VMT_DIM)) as dims:
+            manifest = json.load(dims)
+        self.assertEqual([("I10001.jpg", 120, 80), ("I10002.jpg", 60, 90)],
+                         [(x["filename"], x["width"], x["height"]) for x in manifest])
+
+    def test_warm_builder_skips_current_volumes(self):
+        with ManifestBuilder(self.repo, skip_current=True, volume_info_cache=self.volume_infos) as builder:
+            first = list(builder.build([("W1", ["I1"])]))
+            dims_mtime = os.stat(os.path.join(self.image_group_dir, Common.VMT_DIM)).st_mtime_ns
+            second = list(builder.build([("W1", ["I1"])]))
+        self.assertTrue(first[0].success and second[0].success)
+        self.assertEqual(dims_mtime, os.stat(os.path.join(self.image_group_dir, Common.VMT_DIM)).st_mtime_ns)
+
+
+class PipelinedTestCase(unittest.TestCase):
+    def test_bounded_and_in_order(self):
+        lookahead = 3
+        consumed = []
+        running = [0, 0]
+        lock = threading.Lock()
+
+        def items():
+            for i in range(12):
+                consumed.append(i)
+                yield i
+
+        def slow_square(i: int) -> int:
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            # later items finish first
+            time.sleep(0.005 * (12 - i))
+            with lock:
+                running[0] -= 1
+            return i * i
+
+        results = []
+        for i, result in pipelined(items(), slow_square, lookahead):
+            # the caller's item, and at most lookahead more, have been taken from items
+            self.assertLessEqual(len(consumed), i + 1 + lookahead)
+            results.append((i, result))
+        self.assertEqual([(i, i * i) for i in range(12)], results)
+        self.assertLessEqual(running[1], lookahead)
+
+    def test_exception_takes_the_place_of_the_result(self):
+        def inverse(i: int) -> float:
+            return 1 / i
+
+        results = list(pipelined(range(-2, 3), inverse, 2))
+        self.assertEqual([-2, -1, 0, 1, 2], [i for i, _ in results])
+        self.assertIsInstance(results[2][1], ZeroDivisionError)
+        self.assertEqual([-0.5, -1.0, 1.0, 0.5], [x for i, x in results if i != 0])
+
+
+class WithVolumeInfosTestCase(unittest.TestCase):
+    def setUp(self):
+        self.looked_up: [str] = []
+        # the lookups are patched, and need no repository
+        patcher = mock.patch.object(manifestBuilder, "image_repo", None, create=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_volume_infos(self, work_rid: str, image_repo) -> [str]:
+        self.looked_up.append(work_rid)
+        if work_rid == "W2":
+            raise ConnectionError("BUDA unreachable")
+        return [f"{work_rid}-I1"]
+
+    def test_lookups_run_ahead_in_order(self):
+        works = [("W1", None), ("W2", None), ("W3", ["I9"]), ("W4", None)]
+        results = []
+        with mock.patch.object(Common, "getVolumeInfos", self.get_volume_infos):
+            for work_rid, image_groups in with_volume_infos(works, lookahead=3):
+                if work_rid == "W1":
+                    # the next works were looked up while W1 would build
+                    time.sleep(0.1)
+                    self.assertEqual(["W1", "W2", "W4"], sorted(self.looked_up))
+                results.append((work_rid, image_groups))
+        # W2's failed lookup is None, for doOneManifest to retry and report. Named image groups are not looked up
+        self.assertEqual([("W1", ["W1-I1"]), ("W2", None), ("W3", ["I9"]), ("W4", ["W4-I1"])], results)
+        self.assertEqual(["W1", "W2", "W4"], sorted(self.looked_up))
+
+    def test_failed_lookup_does_not_stop_the_list(self):
+        built = []
+
+        def do_one_manifest(work_rid: str, image_groups: [str]) -> bool:
+            built.append((work_rid, image_groups))
+            return image_groups is not None
+
+        with mock.patch.object(Common, "getVolumeInfos", self.get_volume_infos), \
+                mock.patch.object(manifestBuilder, "doOneManifest", do_one_manifest):
+            all_well = manifestBuilder.manifestForList(io.StringIO("W1\nW2\nW3\n"))
+        self.assertFalse(all_well)
+        self.assertEqual([("W1", ["W1-I1"]), ("W2", None), ("W3", ["W3-I1"])], built)
+
+
+if __name__ == '__main__':
+    unittest.main()
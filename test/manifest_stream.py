@@ -0,0 +1,63 @@
+import gzip
+import io
+import json
+import os
+import tempfile
+import unittest
+
+import v_m_b.manifestCommons as Common
+from v_m_b.ImageRepository.FSImageRepository import FSImageRepository
+
+MANIFEST: [dict] = [{"filename": "I10001.jpg", "width": 120, "height": 80, "dpi": [400, 400]},
+                    {"filename": "I10002.tif", "width": 60, "height": 90, "pilmode": "1"},
+                    {"filename": "I10003.jpg", "width": 1, "height": 1, "size": 10000000}]
+
+
+class GzipJsonStreamTestCase(unittest.TestCase):
+    def test_same_json_as_dumps(self):
+        for manifest in ([], MANIFEST[:1], MANIFEST):
+            out = io.BytesIO()
+            Common.gzip_json_stream(manifest, out, compress_level=1)
+            self.assertFalse(out.closed)
+            self.assertEqual(json.dumps(manifest), gzip.decompress(out.getvalue()).decode())
+
+
+class FSManifestWriterTestCase(unittest.TestCase):
+    def setUp(self):
+        self._container = tempfile.TemporaryDirectory()
+        self.addCleanup(self._container.cleanup)
+        self.image_group_dir = os.path.join(self._container.name, "W1", "images", "W1-I1")
+        os.makedirs(self.image_group_dir)
+        self.repo = FSImageRepository(self._container.name, Common.VMT_IMAGES)
+
+    def write(self, manifest: [dict], fail: bool = False):
+        with self.repo.manifest_writer("W1", "I1", Common.VMT_DIM) as out:
+            Common.gzip_json_stream(manifest, out)
+            if fail:
+                raise IOError("disk full")
+
+    def read(self) -> [dict]:
+        with gzip.open(os.path.join(self.image_group_dir, Common.VMT_DIM)) as dims:
+            return json.load(dims)
+
+    def test_complete_manifest_replaces(self):
+        self.write(MANIFEST[:1])
+        self.write(MANIFEST)
+        self.assertEqual(MANIFEST, self.read())
+        self.assertEqual([Common.VMT_DIM], os.listdir(self.image_group_dir))
+
+    def test_failed_write_leaves_no_partial_file(self):
+        with self.assertRaises(IOError):
+            self.write(MANIFEST, fail=True)
+        self.assertEqual([], os.listdir(self.image_group_dir))
+
+        # nor does it touch the previous manifest
+        self.write(MANIFEST[:1])
+        with self.assertRaises(IOError):
+            self.write(MANIFEST, fail=True)
+        self.assertEqual(MANIFEST[:1], self.read())
+        self.assertEqual([Common.VMT_DIM], os.listdir(self.image_group_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import io
+import unittest
+
+from PIL import Image
+
+from v_m_b.image.generateManifest import fillDataWithBlobImage
+from v_m_b.image.headerProbe import RangeReader
+from v_m_b.image.reducedDecode import reduced_decode
+
+SCAN = Image.linear_gradient("L").resize((2400, 1600)).convert("RGB")
+
+
+def saved(image_format: str, **save_args) -> bytes:
+    out = io.BytesIO()
+    SCAN.save(out, format=image_format, **save_args)
+    return out.getvalue()
+
+
+class ReducedDecodeTestCase(unittest.TestCase):
+    def test_jpeg_dct_scaling(self):
+        im = Image.open(io.BytesIO(saved("JPEG")))
+        reduced = reduced_decode(im, (100, 100))
+        # 1/8 scale is 300x200, then halved
+        self.assertEqual((150, 100), reduced.size)
+
+    def test_tiff_reduced_resolution_frame(self):
+        pyramid = [SCAN.resize((600, 400)), SCAN.resize((150, 100)), SCAN.resize((75, 50))]
+        # Pillow writes the same tags in every frame: all are flagged reduced resolution
+        im = Image.open(io.BytesIO(saved("TIFF", save_all=True, append_images=pyramid, tiffinfo={254: 1})))
+        self.assertEqual((150, 100), reduced_decode(im, (100, 100)).size)
+
+    def test_tiff_pages_are_not_levels(self):
+        pages = [SCAN.resize((600, 400))]
+        im = Image.open(io.BytesIO(saved("TIFF", save_all=True, append_images=pages)))
+        self.assertEqual((2400 // 16, 1600 // 16), reduced_decode(im, (100, 100)).size)
+
+    def test_header_path_does_not_decode(self):
+        blob = saved("JPEG")
+
+        def fetch(start: int, end: int) -> bytes:
+            return blob[start:end + 1]
+
+        reader = RangeReader(fetch, len(blob), block_size=4096)
+        data = {"filename": "I0001.jpg"}
+        fillDataWithBlobImage(reader, data, len(blob))
+        self.assertEqual(2400, data["width"])
+        self.assertLess(reader.bytes_fetched, len(blob) // 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+import io
+import os
+import tempfile
+import time
+import unittest
+from concurrent.futures import Future
+from unittest import mock
+
+from PIL import Image
+
+import v_m_b.manifestCommons as Common
+import v_m_b.ImageRepository.FSImageRepository as FSModule
+from v_m_b.image.generateManifest import fillDataWithBlobImage
+
+try:
+    from moto import mock_aws
+except ImportError:
+    mock_aws = None
+
+IMAGE_SIZES: {str: [(int, int)]} = {"I1": [(120, 80), (60, 90), (30, 40)], "I2": [(10, 20), (200, 100)]}
+
+
+def jpeg(size: (int, int)) -> bytes:
+    out = io.BytesIO()
+    Image.new("L", size).save(out, format="JPEG")
+    return out.getvalue()
+
+
+def dimensions(manifest: [dict]) -> [(int, int)]:
+    return [(x["width"], x["height"]) for x in sorted(manifest, key=lambda x: x["filename"])]
+
+
+class FSRepositoryReuseTestCase(unittest.TestCase):
+    def setUp(self):
+        self._container = tempfile.TemporaryDirectory()
+        self.addCleanup(self._container.cleanup)
+        for image_group, sizes in IMAGE_SIZES.items():
+            image_group_dir = os.path.join(self._container.name, "W1", "images", f"W1-{image_group}")
+            os.makedirs(image_group_dir)
+            for i, size in enumerate(sizes):
+                Image.new("L", size).save(os.path.join(image_group_dir, f"{image_group}{i:04}.jpg"))
+        self.repo = FSModule.FSImageRepository(self._container.name, Common.VMT_IMAGES)
+
+    def test_volumes_share_loop_and_pool(self):
+        used = []
+        generate = FSModule.generateManifest_a
+
+        async def spy(*args, **kwargs):
+            import asyncio
+            used.append((asyncio.get_running_loop(), kwargs["pool"]))
+            return await generate(*args, **kwargs)
+
+        with mock.patch.object(FSModule, "generateManifest_a", spy):
+            for image_group, sizes in IMAGE_SIZES.items():
+                self.assertEqual(sizes, dimensions(self.repo.generateManifest("W1", image_group)))
+        self.assertIsNotNone(used[0][1])
+        self.assertEqual(used[0], used[1])
+
+    def test_close_is_idempotent(self):
+        self.repo.close()
+        self.repo.generateManifest("W1", "I1")
+        loop = self.repo._loop
+        self.repo.close()
+        self.repo.close()
+        self.assertTrue(loop.is_closed())
+        # a closed repository starts over
+        self.assertEqual(IMAGE_SIZES["I2"], dimensions(self.repo.generateManifest("W1", "I2")))
+        self.repo.close()
+
+
+class DoneCallbackTestCase(unittest.TestCase):
+    def test_parsed_after_image_data(self):
+        from v_m_b.ImageRepository.S3ImageRepository import DoneCallback
+        imgdata = {"filename": "I0001.jpg"}
+        callback = DoneCallback(io.BytesIO(jpeg((30, 20))), imgdata)
+        transfer = Future()
+        transfer.set_result(None)
+        self.assertFalse(callback.parsed.done())
+        callback(transfer)
+        self.assertIsNone(callback.parsed.result())
+        self.assertEqual((30, 20), (imgdata["width"], imgdata["height"]))
+
+    def test_parsed_raises_transfer_error(self):
+        from v_m_b.ImageRepository.S3ImageRepository import DoneCallback
+        callback = DoneCallback(io.BytesIO(), {"filename": "I0001.jpg"})
+        transfer = Future()
+        transfer.set_exception(ConnectionError("connection reset"))
+        callback(transfer)
+        with self.assertRaises(ConnectionError):
+            callback.parsed.result()
+
+
+@unittest.skipIf(mock_aws is None, "requires moto")
+class S3RepositoryReuseTestCase(unittest.TestCase):
+    def setUp(self):
+        os.environ.update(AWS_ACCESS_KEY_ID="testing", AWS_SECRET_ACCESS_KEY="testing", AWS_DEFAULT_REGION="us-east-1")
+        self._aws = mock_aws()
+        self._aws.start()
+        self.addCleanup(self._aws.stop)
+        import boto3
+        self.client = boto3.client("s3", region_name="us-east-1")
+        self.client.create_bucket(Bucket="bkt")
+        self.bucket = boto3.resource("s3", region_name="us-east-1").Bucket("bkt")
+
+    def repository(self, header_probe: bool):
+        from v_m_b.ImageRepository.S3ImageRepository import S3ImageRepository
+        repo = S3ImageRepository(self.client, self.bucket, Common.VMT_IMAGES, header_probe=header_probe)
+        for image_group, sizes in IMAGE_SIZES.items():
+            prefix = repo.resolve_image_group("W1", image_group).key
+            for i, size in enumerate(sizes):
+                self.client.put_object(Bucket="bkt", Key=f"{prefix}/{image_group}{i:04}.jpg", Body=jpeg(size))
+        return repo
+
+    def assertVolumesShareExecutor(self, repo):
+        executors = []
+        for image_group, sizes in IMAGE_SIZES.items():
+            self.assertEqual(sizes, dimensions(repo.generateManifest("W1", image_group)))
+            executors.append(repo._executor)
+        self.assertIsNotNone(executors[0])
+        self.assertIs(executors[0], executors[1])
+
+    def test_probes_share_executor(self):
+        repo = self.repository(header_probe=True)
+        self.assertVolumesShareExecutor(repo)
+        repo.close()
+        repo.close()
+        self.assertIsNone(repo._executor)
+
+    def test_downloads_share_executor(self):
+        repo = self.repository(header_probe=False)
+
+        def slow_parse(*args, **kwargs):
+            # the transfer is done long before its image data is
+            time.sleep(0.05)
+            fillDataWithBlobImage(*args, **kwargs)
+
+        with mock.patch("v_m_b.ImageRepository.S3ImageRepository.fillDataWithBlobImage", slow_parse):
+            self.assertVolumesShareExecutor(repo)
+            repo.close()
+            repo.close()
+            # a closed repository starts over
+            self.assertEqual(IMAGE_SIZES["I1"], dimensions(repo.generateManifest("W1", "I1")))
+        repo.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+import argparse
+import logging
+import os
+import threading
+import unittest
+from concurrent.futures.process import BrokenProcessPool
+from unittest import mock
+
+import v_m_b.manifestCommons as Common
+import v_m_b.manifestBuilder as manifestBuilder
+
+try:
+    from moto import mock_aws
+except ImportError:
+    mock_aws = None
+
+
+class RecordedStop(threading.Event):
+    """
+    Stop event which records the waits between polls instead of sleeping
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.waits: [float] = []
+
+    def wait(self, timeout=None):
+        self.waits.append(timeout)
+        return self.is_set()
+
+
+class PollS3WorkListsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.args = argparse.Namespace(jobs=1, poll_interval=10, parallel_works=False, metrics_json=None,
+                                       prometheus_textfile=None)
+        manifestBuilder.shell_logger = Common.shell_logger = logging.getLogger('local_v_m_b')
+        self.stop = RecordedStop()
+        self.built: [str] = []
+        self.pools: [] = []
+
+    def poll(self, polls: []):
+        """
+        :param polls: the successive results of listing the todo folder. An exception is raised. Polling
+        stops after the last one.
+        """
+        polls = list(polls)
+
+        def list_work_lists(client):
+            result = polls.pop(0)
+            if not polls:
+                self.stop.set()
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        def build_work_list(client, work_list_name, pool, by_work=False):
+            if work_list_name.startswith("bad"):
+                raise RuntimeError(f"{work_list_name} unreadable")
+            if work_list_name.startswith("crash"):
+                raise BrokenProcessPool("a worker died")
+            self.built.append((work_list_name, pool))
+            return True
+
+        def worker_pool(repo_settings, jobs):
+            self.pools.append(mock.Mock(name=f"pool {len(self.pools)}"))
+            return self.pools[-1]
+
+        with mock.patch.object(Common, 'buildWorkListFromS3', list_work_lists), \
+                mock.patch.object(Common, 'repository_settings', lambda args: {}), \
+                mock.patch.object(manifestBuilder, 'worker_pool', worker_pool), \
+                mock.patch.object(manifestBuilder, 'manifestForS3WorkList', build_work_list), \
+                self.assertLogs('local_v_m_b', logging.ERROR) as errors:
+            manifestBuilder.pollS3WorkLists(None, self.args, self.stop)
+        return errors.output
+
+    def test_failed_polls_back_off(self):
+        errors = self.poll([ConnectionError("S3 unreachable"), ConnectionError("S3 unreachable"), ["w1.txt"], [],
+                            ConnectionError("S3 unreachable")])
+        self.assertEqual([("w1.txt", None)], self.built)
+        self.assertEqual(3, len(errors))
+        # failures double the wait, success resets it
+        self.assertEqual([20, 40, 10, 20], self.stop.waits)
+
+    def test_failed_work_list_does_not_stop_polling(self):
+        errors = self.poll([["bad.txt", "w1.txt"], ["w2.txt"]])
+        self.assertEqual([("w1.txt", None), ("w2.txt", None)], self.built)
+        self.assertIn("bad.txt", errors[0])
+        self.assertEqual([20], self.stop.waits)
+
+    def test_broken_pool_is_replaced(self):
+        self.args.jobs = 2
+        self.poll([["crash.txt"], ["w1.txt"]])
+        self.assertEqual(2, len(self.pools))
+        self.pools[0].shutdown.assert_called_once_with(wait=False)
+        self.assertEqual([("w1.txt", self.pools[1])], self.built)
+        self.pools[1].shutdown.assert_called_once_with()
+
+
+@unittest.skipIf(mock_aws is None, "requires moto")
+class S3WorkListTestCase(unittest.TestCase):
+    """
+    A claimed work list goes to done only when all its builds succeed
+    """
+
+    def setUp(self):
+        os.environ.update(AWS_ACCESS_KEY_ID="testing", AWS_SECRET_ACCESS_KEY="testing", AWS_DEFAULT_REGION="us-east-1")
+        self._aws = mock_aws()
+        self._aws.start()
+        self.addCleanup(self._aws.stop)
+        import boto3
+        from v_m_b.S3WorkFileManager import S3WorkFileManager
+        self.client = boto3.client("s3", region_name="us-east-1")
+        self.client.create_bucket(Bucket=Common.S3_MANIFEST_WORK_LIST_BUCKET)
+        self.client.put_object(Bucket=Common.S3_MANIFEST_WORK_LIST_BUCKET, Key=f"{Common.todo_prefix}list1.txt",
+                               Body=b"W1\nW2\n")
+        with mock.patch.object(S3WorkFileManager, "me_instance", return_value="node1"):
+            manager = S3WorkFileManager(Common.S3_MANIFEST_WORK_LIST_BUCKET, Common.todo_prefix,
+                                        Common.processing_prefix, Common.done_prefix)
+        patcher = mock.patch.object(Common, "s3_work_manager", manager)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        logger = logging.getLogger('s3_work_list_test')
+        logger.log_file_name = "test.log"
+        manifestBuilder.shell_logger = Common.shell_logger = logger
+        self.work_list_names = Common.buildWorkListFromS3(self.client)
+
+    def folder(self, prefix: str) -> [str]:
+        return sorted(x["Key"].replace(prefix, "") for x in self.client.list_objects_v2(
+            Bucket=Common.S3_MANIFEST_WORK_LIST_BUCKET, Prefix=prefix).get("Contents", []))
+
+    def build(self, do_one_manifest):
+        with mock.patch.object(manifestBuilder, "with_volume_infos", lambda works: [(w, ["I1"]) for w, _ in works]), \
+                mock.patch.object(manifestBuilder, "doOneManifest", do_one_manifest):
+            return manifestBuilder.manifestForS3WorkList(self.client, self.work_list_names[0], None)
+
+    def test_succeeded_list_is_done(self):
+        self.assertEqual(["list1.txt-node1"], self.work_list_names)
+        self.assertTrue(self.build(lambda work_rid, image_groups: True))
+        self.assertEqual(["list1.txt-node1"], self.folder(Common.done_prefix))
+        self.assertEqual([], self.folder(Common.todo_prefix) + self.folder(Common.processing_prefix))
+
+    def test_failed_build_returns_list_to_todo(self):
+        with self.assertLogs('s3_work_list_test', logging.ERROR):
+            self.assertFalse(self.build(lambda work_rid, image_groups: work_rid != "W2"))
+        self.assertEqual(["list1.txt"], self.folder(Common.todo_prefix))
+        self.assertEqual([], self.folder(Common.done_prefix) + self.folder(Common.processing_prefix))
+        # claimable again
+        self.assertEqual(["list1.txt-node1"], Common.buildWorkListFromS3(self.client))
+
+    def test_failed_list_returns_to_todo(self):
+        def crash(work_rid, image_groups):
+            raise RuntimeError("worker died")
+
+        with self.assertRaises(RuntimeError):
+            self.build(crash)
+        self.assertEqual(["list1.txt"], self.folder(Common.todo_prefix))
+        self.assertEqual([], self.folder(Common.done_prefix) + self.folder(Common.processing_prefix))
+
+
+if __name__ == '__main__':
+    unittest.main()
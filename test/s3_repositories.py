@@ -0,0 +1,199 @@
+import gzip
+import io
+import json
+import logging
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+from PIL import Image
+
+import v_m_b.manifestCommons as Common
+import v_m_b.ImageRepository.S3ImageRepository as S3Module
+from v_m_b.manifestBuilder import upload_volume
+from v_m_b.stageMetrics import metrics
+
+try:
+    from moto.server import ThreadedMotoServer
+except ImportError:
+    ThreadedMotoServer = None
+try:
+    # it requires aiobotocore
+    import v_m_b.ImageRepository.AsyncS3ImageRepository as AsyncS3Module
+except ImportError:
+    AsyncS3Module = None
+
+MOTO_PORT: int = 5198
+BUCKET: str = "test.bdrc.org"
+
+
+def next_second():
+    """
+    S3 listings give LastModified to the second: objects put after this are newer than those put before
+    """
+    time.sleep(1.01 - time.time() % 1)
+
+
+def jpeg(size: (int, int)) -> bytes:
+    out = io.BytesIO()
+    Image.new("L", size).save(out, format="JPEG")
+    return out.getvalue()
+
+
+@unittest.skipIf(ThreadedMotoServer is None, "requires moto[server]")
+class S3RepositoryTests:
+    """
+    Tests of both S3 engines, on a moto server. Subclasses build the repository.
+    """
+    ttl_module = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls._environ = mock.patch.dict(os.environ, {"AWS_ACCESS_KEY_ID": "testing",
+                                                    "AWS_SECRET_ACCESS_KEY": "testing",
+                                                    "AWS_DEFAULT_REGION": "us-east-1",
+                                                    "AWS_ENDPOINT_URL": f"http://127.0.0.1:{MOTO_PORT}"})
+        cls._environ.start()
+        cls._server = ThreadedMotoServer(port=MOTO_PORT, verbose=False)
+        cls._server.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._server.stop()
+        cls._environ.stop()
+
+    def setUp(self):
+        import boto3
+        self.client = boto3.client("s3", region_name="us-east-1")
+        self.client.create_bucket(Bucket=BUCKET)
+        self.repo = self.make_repository()
+        self.addCleanup(self.repo.close)
+        self.addCleanup(self.empty_bucket)
+        self.prefixes = {ig: self.image_group_prefix(ig) for ig in ("I1", "I2")}
+        self.put("I1", "I10001.jpg", jpeg((120, 80)))
+        self.put("I1", "I10002.jpg", jpeg((60, 90)))
+        self.put("I2", "I20001.jpg", jpeg((30, 40)))
+        # folder markers, as the S3 console creates them
+        self.client.put_object(Bucket=BUCKET, Key=self.prefixes["I1"] + "/", Body=b"")
+        self.client.put_object(Bucket=BUCKET, Key=self.prefixes["I1"].rsplit("/", 1)[0] + "/", Body=b"")
+        metrics.drain()
+
+    def empty_bucket(self):
+        for s3_object in self.client.list_objects_v2(Bucket=BUCKET).get("Contents", []):
+            self.client.delete_object(Bucket=BUCKET, Key=s3_object["Key"])
+        self.client.delete_bucket(Bucket=BUCKET)
+
+    def put(self, image_group: str, file_name: str, body: bytes):
+        self.client.put_object(Bucket=BUCKET, Key=f"{self.prefixes[image_group]}/{file_name}", Body=body)
+
+    def listings(self) -> int:
+        return metrics.summary()["stages"].get("listing", {}).get("count", 0)
+
+    def builds(self) -> int:
+        return metrics.summary()["stages"].get("volume", {}).get("count", 0)
+
+    def build(self, skip_if_current: bool):
+        # the index would hide the others' writes: list again, as a later run would
+        with mock.patch.object(self.ttl_module, "WORK_INDEX_TTL_SECONDS", 0):
+            upload_volume("W1", "I1", self.repo, logging.getLogger(__name__), skip_if_current)
+
+    def manifest(self) -> [str]:
+        dims = self.client.get_object(Bucket=BUCKET, Key=f"{self.prefixes['I1']}/{Common.VMT_DIM}")
+        return [x["filename"] for x in json.loads(gzip.decompress(dims["Body"].read()))]
+
+    def test_one_listing_serves_the_work(self):
+        manifests = {ig: self.repo.generateManifest("W1", ig) for ig in ("I1", "I2")}
+        self.assertEqual([("I10001.jpg", 120, 80), ("I10002.jpg", 60, 90)],
+                         [(x["filename"], x["width"], x["height"]) for x in manifests["I1"]])
+        self.assertEqual(["I20001.jpg"], [x["filename"] for x in manifests["I2"]])
+        self.assertEqual(2, self.repo.image_group_stats("W1", "I1")[0])
+        self.assertFalse(self.repo.manifest_exists("W1", "I1"))
+        self.assertEqual(1, self.listings())
+
+    def test_index_expires(self):
+        self.assertEqual(2, self.repo.image_group_stats("W1", "I1")[0])
+        self.put("I1", "I10003.jpg", jpeg((10, 10)))
+        # within the TTL, the index is reused, and does not see the new image
+        self.assertEqual(2, self.repo.image_group_stats("W1", "I1")[0])
+        with mock.patch.object(self.ttl_module, "WORK_INDEX_TTL_SECONDS", 0):
+            self.assertEqual(3, self.repo.image_group_stats("W1", "I1")[0])
+        self.assertEqual(2, self.listings())
+
+    def test_folder_markers_are_not_images(self):
+        self.assertEqual(["I10001.jpg", "I10002.jpg"],
+                         sorted(x["filename"] for x in self.repo.generateManifest("W1", "I1")))
+        self.assertEqual(2, self.repo.image_group_stats("W1", "I1")[0])
+
+    def test_spooled_manifest_upload(self):
+        manifest = [{"filename": f"I1{i:04}.jpg", "width": i, "height": 2 * i} for i in range(1, 2000)]
+        # past the spool's memory, onto disk
+        with mock.patch.object(S3Module, "MANIFEST_SPOOL_BYTES", 1024), \
+                mock.patch.object(self.ttl_module, "MANIFEST_SPOOL_BYTES", 1024):
+            with self.repo.manifest_writer("W1", "I1", Common.VMT_DIM) as out:
+                Common.gzip_json_stream(manifest, out)
+        written = io.BytesIO()
+        Common.gzip_json_stream(manifest, written)
+        uploaded = self.client.get_object(Bucket=BUCKET, Key=f"{self.prefixes['I1']}/{Common.VMT_DIM}")["Body"].read()
+        # but for the gzip header's timestamp
+        self.assertEqual(written.getvalue()[:4] + written.getvalue()[8:], uploaded[:4] + uploaded[8:])
+        self.assertEqual(json.dumps(manifest), gzip.decompress(uploaded).decode())
+
+    def test_current_manifest_is_skipped(self):
+        self.assertFalse(self.repo.manifest_is_current("W1", "I1"))
+        next_second()
+        self.build(skip_if_current=True)
+        self.assertTrue(self.repo.manifest_is_current("W1", "I1"))
+        self.build(skip_if_current=True)
+        self.assertEqual(1, self.builds())
+        # --force
+        self.build(skip_if_current=False)
+        self.assertEqual(2, self.builds())
+
+    def test_newer_image_forces_rebuild(self):
+        next_second()
+        self.build(skip_if_current=True)
+        next_second()
+        self.put("I1", "I10003.jpg", jpeg((10, 10)))
+        with mock.patch.object(self.ttl_module, "WORK_INDEX_TTL_SECONDS", 0):
+            self.assertFalse(self.repo.manifest_is_current("W1", "I1"))
+        self.build(skip_if_current=True)
+        self.assertEqual(2, self.builds())
+        self.assertEqual(["I10001.jpg", "I10002.jpg", "I10003.jpg"], self.manifest())
+
+
+class ForceTestCase(unittest.TestCase):
+    def test_force_overrides_incremental(self):
+        for argv, skips in ((["--incremental"], True), (["--incremental", "--force"], False), ([], False)):
+            args = Common.VMBArgs()
+            with mock.patch.object(sys, "argv", ["manifestforwork", *argv, "s3"]):
+                Common.parse_args(args)
+            self.assertEqual(skips, Common.skips_current(args), argv)
+
+
+class S3ImageRepositoryTestCase(S3RepositoryTests, unittest.TestCase):
+    ttl_module = S3Module
+
+    def make_repository(self):
+        import boto3
+        return S3Module.S3ImageRepository(self.client, boto3.resource("s3", region_name="us-east-1").Bucket(BUCKET),
+                                          Common.VMT_IMAGES)
+
+    def image_group_prefix(self, image_group: str) -> str:
+        return self.repo.resolve_image_group("W1", image_group).key
+
+
+@unittest.skipIf(AsyncS3Module is None, "requires aiobotocore")
+class AsyncS3ImageRepositoryTestCase(S3RepositoryTests, unittest.TestCase):
+    ttl_module = AsyncS3Module
+
+    def make_repository(self):
+        return AsyncS3Module.AsyncS3ImageRepository(BUCKET, Common.VMT_IMAGES)
+
+    def image_group_prefix(self, image_group: str) -> str:
+        return self.repo.resolve_image_group("W1", image_group)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import logging
+import os
+import threading
+import unittest
+from unittest import mock
+
+try:
+    from moto import mock_aws
+except ImportError:
+    mock_aws = None
+
+TODO: str = "processing/todo/"
+UNDERWAY: str = "processing/inprocess/"
+DONE: str = "processing/done/"
+
+
+@unittest.skipIf(mock_aws is None, "requires moto")
+class S3WorkFileManagerTestCase(unittest.TestCase):
+    def setUp(self):
+        os.environ.update(AWS_ACCESS_KEY_ID="testing", AWS_SECRET_ACCESS_KEY="testing", AWS_DEFAULT_REGION="us-east-1")
+        self._aws = mock_aws()
+        self._aws.start()
+        import boto3
+        self.client = boto3.client("s3", region_name="us-east-1")
+        self.client.create_bucket(Bucket="bkt")
+        for i in range(20):
+            self.client.put_object(Bucket="bkt", Key=f"{TODO}w{i}.txt", Body=f"W{i}".encode())
+
+    def tearDown(self):
+        self._aws.stop()
+
+    def manager(self, name: str, **kwargs):
+        from v_m_b.S3WorkFileManager import S3WorkFileManager
+        # me_instance() asks EC2 for the instance id
+        with mock.patch.object(S3WorkFileManager, "me_instance", return_value=name):
+            return S3WorkFileManager("bkt", TODO, UNDERWAY, DONE, **kwargs)
+
+    def keys(self, prefix: str) -> [str]:
+        return sorted(x["Key"].replace(prefix, "") for x in
+                      self.client.list_objects_v2(Bucket="bkt", Prefix=prefix).get("Contents", []))
+
+    def claim_all(self, manager) -> [str]:
+        listed = self.client.list_objects_v2(Bucket="bkt", Prefix=TODO)["Contents"]
+        names = [x["Key"].replace(TODO, "") for x in listed]
+        return manager.mark_underway(names, [manager.local_name_work_file(x) for x in names],
+                                     [x["ETag"] for x in listed])
+
+    def test_racing_claimers_split_the_list(self):
+        managers = [self.manager("a"), self.manager("b")]
+        claims = {}
+        # both list before either claims
+        barrier = threading.Barrier(2)
+
+        def claim(manager):
+            listed = self.client.list_objects_v2(Bucket="bkt", Prefix=TODO)["Contents"]
+            names = [x["Key"].replace(TODO, "") for x in listed]
+            barrier.wait()
+            claims[manager] = manager.mark_underway(names, [manager.local_name_work_file(x) for x in names],
+                                                    [x["ETag"] for x in listed])
+
+        threads = [threading.Thread(target=claim, args=(x,)) for x in managers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        claimed = [x.rsplit("-", 1)[0] for manager in managers for x in claims[manager]]
+        self.assertEqual(sorted(f"w{i}.txt" for i in range(20)), sorted(claimed))
+        self.assertEqual(sorted(claims[managers[0]] + claims[managers[1]]), self.keys(UNDERWAY))
+        self.assertEqual([], self.keys(TODO))
+        self.assertEqual([], self.keys("processing/leases/"))
+
+    def test_stale_lease_is_taken_over(self):
+        # a claimer died holding w3's lease
+        self.client.put_object(Bucket="bkt", Key="processing/leases/w3.txt", Body=b"{}")
+        self.assertNotIn("w3.txt-a", self.claim_all(self.manager("a")))
+        self.assertEqual(["w3.txt"], self.keys(TODO))
+
+        self.assertEqual(["w3.txt-b"], self.claim_all(self.manager("b", lease_seconds=0)))
+        self.assertEqual([], self.keys(TODO))
+        self.assertEqual([], self.keys("processing/leases/"))
+
+    def test_failed_claim_keeps_the_others(self):
+        manager = self.manager("a")
+        claim = manager.claim
+
+        def failing_claim(file_name, dest_name, etag):
+            if file_name == "w7.txt":
+                raise ConnectionError("connection reset")
+            return claim(file_name, dest_name, etag)
+
+        with mock.patch.object(manager, "claim", failing_claim), \
+                self.assertLogs("v_m_b.S3WorkFileManager", logging.ERROR) as errors:
+            claimed = self.claim_all(manager)
+
+        self.assertIn("w7.txt", errors.output[0])
+        self.assertEqual(sorted(f"w{i}.txt-a" for i in range(20) if i != 7), sorted(claimed))
+        self.assertEqual(sorted(claimed), self.keys(UNDERWAY))
+        self.assertEqual(["w7.txt"], self.keys(TODO))
+        self.assertEqual([], self.keys("processing/leases/"))
+
+
+if __name__ == '__main__':
+    unittest.main()
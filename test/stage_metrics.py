@@ -0,0 +1,38 @@
+import os
+import tempfile
+import unittest
+
+from v_m_b.stageMetrics import StageMetrics
+
+
+class StageMetricsTestCase(unittest.TestCase):
+    def test_merge_worker_metrics(self):
+        parent = StageMetrics()
+        worker = StageMetrics()
+        parent.record('fetch', 0.002, 1000)
+        worker.record('fetch', 2.0, 5000)
+        worker.record('parse', 0.0005)
+        parent.merge(worker.drain())
+        stages = parent.summary()['stages']
+        self.assertEqual(2, stages['fetch']['count'])
+        self.assertEqual(6000, stages['fetch']['bytes'])
+        self.assertEqual(1, stages['parse']['buckets'][0])
+        self.assertEqual({}, worker.summary()['stages'])
+
+    def test_prometheus_histogram_is_cumulative(self):
+        metrics = StageMetrics()
+        for seconds in (0.0001, 0.02, 0.02, 100):
+            metrics.record('upload', seconds, 10)
+        with tempfile.TemporaryDirectory() as out_dir:
+            path = os.path.join(out_dir, "vmb.prom")
+            metrics.write_prometheus(path)
+            with open(path) as prom:
+                lines = prom.read().splitlines()
+        self.assertIn('vmb_stage_seconds_bucket{stage="upload",le="0.001"} 1', lines)
+        self.assertIn('vmb_stage_seconds_bucket{stage="upload",le="0.05"} 3', lines)
+        self.assertIn('vmb_stage_seconds_bucket{stage="upload",le="+Inf"} 4', lines)
+        self.assertIn('vmb_stage_bytes_total{stage="upload"} 40', lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+# Slow imports which a manifestforwork run in fs mode never needs
+DEFERRED_MODULES = ['boto3', 'botocore', 's3pathlib', 's3transfer', 'lxml', 'archive_ops', 'aiobotocore', 'numpy']
+
+STARTUP = """
+import json
+import sys
+import v_m_b.manifestBuilder
+import v_m_b.manifestCommons as Common
+repo = Common.build_repository({'channel': 'fs', 'container': '.', 'image_folder_name': 'images', 'concurrency': 2})
+repo.close()
+print(json.dumps({'modules': sorted(m for m in sys.modules if m.split('.')[0] in %r),
+                  'work_manager': Common.s3_work_manager is not None}))
+"""
+
+
+class StartupImportsTestCase(unittest.TestCase):
+    def test_fs_startup_defers_s3_imports(self):
+        """
+        Each CLI run pays for its imports. A fresh interpreter shows what importing the builder,
+        and building an fs repository, loads
+        """
+        package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([package_root, os.environ.get('PYTHONPATH', '')]))
+        out = subprocess.run([sys.executable, '-c', STARTUP % DEFERRED_MODULES], env=env, cwd=package_root,
+                             capture_output=True, text=True, check=True)
+        startup = json.loads(out.stdout.splitlines()[-1])
+        self.assertEqual([], startup['modules'])
+        # building the work list manager probes the EC2 metadata endpoint
+        self.assertFalse(startup['work_manager'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+from archive_ops.api import get_disk_ig_from_buda
+from lxml import etree
+
+import v_m_b.manifestCommons as Common
+import v_m_b.VolumeInfo.VolumeInfoBuda as VolumeInfoBuda
+from v_m_b.ImageRepository.FSImageRepository import FSImageRepository
+from v_m_b.VolumeInfo.VolumeInfoCache import VolumeInfoCache
+
+# volumesForInstance answers, in the SPARQL XML results format
+VOLUMES: {str: [str]} = {"W1": ["I1KG1", "I0886"], "W2": [], "W3": ["I3"]}
+
+
+def sparql_results(image_groups: [str]) -> bytes:
+    results = "".join(f'<result><binding name="volid"><uri>http://purl.bdrc.io/resource/{ig}</uri></binding></result>'
+                      for ig in image_groups)
+    return (f'<?xml version="1.0"?><sparql xmlns="http://www.w3.org/2005/sparql-results#"><head>'
+            f'<variable name="volid"/></head><results>{results}</results></sparql>').encode()
+
+
+class BudaHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        work_rid: str = parse_qs(urlparse(self.path).query)["R_RES"][0].replace("bdr:", "")
+        self.server.queries.append(work_rid)
+        if work_rid == "W404":
+            self.send_error(404)
+            return
+        body: bytes = b"<html><body>Not a SPARQL result" if work_rid == "WBAD" else sparql_results(VOLUMES[work_rid])
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class VolumeInfoBudaTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), BudaHandler)
+        self.server.queries = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        patcher = mock.patch.object(VolumeInfoBuda, "VOLUMES_FOR_INSTANCE_URL",
+                                    f"http://127.0.0.1:{self.server.server_address[1]}/query/table/volumesForInstance")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = VolumeInfoCache()
+        self.addCleanup(self.cache.close)
+        self.volume_info = VolumeInfoBuda.VolumeInfoBUDA(FSImageRepository(".", Common.VMT_IMAGES), self.cache)
+
+    def test_image_groups(self):
+        expected = [get_disk_ig_from_buda(x) for x in VOLUMES["W1"]]
+        self.assertEqual(expected, self.volume_info.get_image_group_disk_paths("W1"))
+        # cached
+        self.assertEqual(expected, self.volume_info.get_image_group_disk_paths("W1"))
+        self.assertEqual(["W1"], self.server.queries)
+
+    def test_empty_answer_is_not_cached(self):
+        self.assertEqual([], self.volume_info.get_image_group_disk_paths("W2"))
+        self.assertEqual([], self.volume_info.get_image_group_disk_paths("W2"))
+        self.assertEqual(["W2", "W2"], self.server.queries)
+        self.assertIsNone(self.cache.get("W2"))
+
+    def test_failures_raise(self):
+        import requests
+        with self.assertRaises(requests.HTTPError):
+            self.volume_info.get_image_group_disk_paths("W404")
+        with self.assertRaises(etree.XMLSyntaxError):
+            self.volume_info.get_image_group_disk_paths("WBAD")
+        self.assertIsNone(self.cache.get("W404"))
+        self.assertIsNone(self.cache.get("WBAD"))
+
+    def test_bulk(self):
+        self.cache.put("W3", ["cached"])
+        with self.assertLogs(self.volume_info.logger.name, "WARNING"):
+            vol_infos = self.volume_info.get_image_group_disk_paths_bulk(["W1", "W404", "W2", "W3", "W1"])
+        self.assertEqual({"W1": [get_disk_ig_from_buda(x) for x in VOLUMES["W1"]], "W2": [], "W3": ["cached"]},
+                         vol_infos)
+        # one query per work, none for cached ones
+        self.assertEqual(["W1", "W2", "W404"], sorted(self.server.queries))
+        self.assertEqual(vol_infos["W1"], self.cache.get("W1"))
+
+    def test_prefetch_needs_a_cache(self):
+        with mock.patch.object(Common, "volume_info_cache", None):
+            Common.prefetchVolumeInfos(["W1", "W2"], FSImageRepository(".", Common.VMT_IMAGES))
+        self.assertEqual([], self.server.queries)
+
+
+if __name__ == '__main__':
+    unittest.main()
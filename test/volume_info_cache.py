@@ -0,0 +1,30 @@
+import os
+import tempfile
+import unittest
+
+from v_m_b.VolumeInfo.VolumeInfoCache import VolumeInfoCache
+
+
+class VolumeInfoCacheTestCase(unittest.TestCase):
+    def test_expires(self):
+        cache = VolumeInfoCache(ttl_seconds=-1)
+        cache.put("W1", ["I1", "I2"])
+        self.assertIsNone(cache.get("W1"))
+        cache.close()
+
+    def test_persists(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            db_path = os.path.join(cache_dir, "volumes.db")
+            cache = VolumeInfoCache(db_path)
+            cache.put("W1", ["I1", "I2"])
+            cache.put("W2", [])
+            cache.close()
+            cache = VolumeInfoCache(db_path)
+            self.assertEqual(["I1", "I2"], cache.get("W1"))
+            self.assertEqual([], cache.get("W2"))
+            self.assertIsNone(cache.get("W3"))
+            cache.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+from v_m_b.volumeProfiler import SamplingProfiler
+
+
+def busy(seconds: float):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class VolumeProfilerTestCase(unittest.TestCase):
+    def test_samples_other_threads(self):
+        with SamplingProfiler(interval=0.002, sections={'busy': [('volume_profiler.py', 'busy')]}) as profiler:
+            worker = threading.Thread(target=busy, args=(0.2,), name='worker_1')
+            worker.start()
+            worker.join()
+        summary = profiler.summary()
+        self.assertGreater(summary['busy']['wall'], 0.1)
+        self.assertLessEqual(summary['busy']['wall'], summary['total']['wall'])
+        self.assertTrue(any(stack.startswith('worker;') and stack.endswith('busy (volume_profiler.py)')
+                            for stack in profiler.stacks))
+
+    def test_folded_lines_end_in_counts(self):
+        with SamplingProfiler(interval=0.002) as profiler:
+            busy(0.05)
+        with tempfile.TemporaryDirectory() as out_dir:
+            folded_path = profiler.write_folded(Path(out_dir) / "W1.folded")
+            with open(folded_path) as folded:
+                lines = folded.read().splitlines()
+        self.assertGreater(len(lines), 0)
+        for line in lines:
+            stack, count = line.rsplit(' ', 1)
+            self.assertTrue(stack.startswith('MainThread;'))
+            self.assertGreater(int(count), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
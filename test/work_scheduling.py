@@ -0,0 +1,169 @@
+import argparse
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import v_m_b.manifestCommons as Common
+import v_m_b.manifestBuilder as manifestBuilder
+from v_m_b.ImageRepository.FSImageRepository import FSImageRepository
+from v_m_b.workScheduling import parse_shard, stable_shard, balanced_shards, largest_first
+
+# stable_shard(f"W{i}", 7) for i in 0..5
+SHARDS_OF_7 = [3, 2, 5, 2, 4, 5]
+
+
+class WorkSchedulingTestCase(unittest.TestCase):
+    def test_parse_shard(self):
+        self.assertEqual((0, 4), parse_shard("0/4"))
+        self.assertEqual((3, 4), parse_shard("3/4"))
+        for bad in ("4/4", "-1/4", "0/0", "1", "a/b"):
+            with self.assertRaises(argparse.ArgumentTypeError):
+                parse_shard(bad)
+
+    def test_stable_shards_partition(self):
+        works = [f"W{i}" for i in range(1000)]
+        shards = [[w for w in works if stable_shard(w, 4) == i] for i in range(4)]
+        self.assertEqual(sorted(works), sorted(w for shard in shards for w in shard))
+        # every node must compute the same shards: no dependency on the process's hash seed
+        self.assertEqual(SHARDS_OF_7, [stable_shard(f"W{i}", 7) for i in range(6)])
+        self.assertTrue(all(200 < len(shard) < 300 for shard in shards))
+
+    def test_balanced_shards(self):
+        weights = {"W1": 3000, "W2": 1000, "W3": 1000, "W4": 900, "W5": 100, "W6": 100}
+        assignment = balanced_shards(weights, 2)
+        loads = [sum(w for k, w in weights.items() if assignment[k] == shard) for shard in range(2)]
+        self.assertEqual([3000, 3100], sorted(loads))
+        self.assertEqual(assignment, balanced_shards(dict(reversed(list(weights.items()))), 2))
+
+    def test_largest_first(self):
+        weights = {("W1", "I1"): (10, 500), ("W1", "I2"): (300, 9000), ("W2", "I1"): (10, 800),
+                   ("W3", "I1"): (0, 0), ("W3", "I2"): (10, 500)}
+        self.assertEqual([("W1", "I2"), ("W2", "I1"), ("W1", "I1"), ("W3", "I2"), ("W3", "I1")],
+                         largest_first(weights))
+
+
+
+class ShardWorksTestCase(unittest.TestCase):
+    """
+    Two nodes sharding the same work list, as --shard 0/2 and --shard 1/2
+    """
+
+    def setUp(self):
+        self._container = tempfile.TemporaryDirectory()
+        self.volume_infos = {f"W{i}": [f"I{j}" for j in range(1, 1 + i % 3 + 1)] for i in range(12)}
+        for work_rid, image_groups in self.volume_infos.items():
+            for image_group in image_groups:
+                image_group_dir = os.path.join(self._container.name, work_rid, "images", f"{work_rid}-{image_group}")
+                os.makedirs(image_group_dir)
+                for n in range(len(work_rid) + len(image_group)):
+                    open(os.path.join(image_group_dir, f"{image_group}{n:04}.jpg"), "wb").close()
+        manifestBuilder.image_repo = FSImageRepository(self._container.name, Common.VMT_IMAGES)
+        self.failing_work = None
+
+    def tearDown(self):
+        manifestBuilder.image_repo.close()
+        manifestBuilder.image_repo = None
+        self._container.cleanup()
+
+    def get_volume_infos(self, work_rid, image_repo, cache=None):
+        if work_rid == self.failing_work:
+            raise ConnectionError("BUDA unreachable")
+        return self.volume_infos[work_rid]
+
+    def shard(self, shard_index: int, by_image_group: bool, balance: bool) -> [(str, [str])]:
+        with mock.patch.object(Common, 'prefetchVolumeInfos'), \
+                mock.patch.object(Common, 'getVolumeInfos', self.get_volume_infos):
+            return manifestBuilder.shard_works(list(self.volume_infos), None, (shard_index, 2),
+                                               by_image_group, balance)
+
+    def assertPartition(self, by_image_group: bool, balance: bool):
+        nodes = [self.shard(i, by_image_group, balance) for i in range(2)]
+        built = [(work_rid, image_group) for node in nodes for work_rid, image_groups in node
+                 for image_group in image_groups]
+        self.assertEqual(len(built), len(set(built)))
+        self.assertEqual({(work_rid, image_group) for work_rid, image_groups in self.volume_infos.items()
+                          for image_group in image_groups}, set(built))
+        self.assertTrue(all(nodes))
+
+    def test_shards_partition(self):
+        for by_image_group, balance in ((True, False), (False, True), (True, True)):
+            with self.subTest(by_image_group=by_image_group, balance=balance):
+                self.assertPartition(by_image_group, balance)
+
+    def test_failed_lookup_aborts(self):
+        # Node 0's lookup succeeds, node 1's fails: node 1 must not build a share of its own making
+        node_0 = self.shard(0, True, False)
+        self.failing_work = "W4"
+        for by_image_group, balance in ((True, False), (False, True)):
+            with self.subTest(by_image_group=by_image_group, balance=balance):
+                with self.assertRaisesRegex(Exception, "W4"):
+                    self.shard(1, by_image_group, balance)
+        self.assertTrue(node_0)
+        # work level shares need no lookup
+        self.assertEqual([(w, None) for w in self.volume_infos if stable_shard(w, 2) == 1],
+                         self.shard(1, False, False))
+
+    def test_empty_entries_are_shared_out(self):
+        # the same on every node: a work without image groups, and an image group without images
+        self.volume_infos["W12"] = []
+        self.volume_infos["W5"].append("I9")
+        for by_image_group, balance in ((True, False), (False, True), (True, True)):
+            with self.subTest(by_image_group=by_image_group, balance=balance):
+                self.assertPartition(by_image_group, balance)
+                nodes = [dict(self.shard(i, by_image_group, balance)) for i in range(2)]
+                # exactly one node builds W12, and reports it
+                self.assertEqual([[]], [node["W12"] for node in nodes if "W12" in node])
+
+
+class ManifestInPoolTestCase(unittest.TestCase):
+    """
+    manifestInPool's listing pass, and its largest first order. The pool is one thread, so that
+    the build order is the submission order.
+    """
+
+    def setUp(self):
+        self._container = tempfile.TemporaryDirectory()
+        self.image_counts = {("W1", "I1"): 2, ("W1", "I2"): 7, ("W2", "I1"): 4, ("W2", "I2"): 1}
+        for (work_rid, image_group), count in self.image_counts.items():
+            image_group_dir = os.path.join(self._container.name, work_rid, "images", f"{work_rid}-{image_group}")
+            os.makedirs(image_group_dir)
+            for n in range(count):
+                open(os.path.join(image_group_dir, f"{image_group}{n:04}.jpg"), "wb").close()
+        manifestBuilder.image_repo = FSImageRepository(self._container.name, Common.VMT_IMAGES)
+        manifestBuilder.shell_logger = mock.Mock()
+        self.built: [(str, str)] = []
+
+    def tearDown(self):
+        manifestBuilder.image_repo.close()
+        manifestBuilder.image_repo = None
+        self._container.cleanup()
+
+    def volume_job(self, work_rid: str, image_group: str) -> [manifestBuilder.VolumeResult]:
+        self.built.append((work_rid, image_group))
+        return [manifestBuilder.VolumeResult(work_rid, image_group, True)]
+
+    def run_pool(self, works: [(str, [str])]) -> bool:
+        stats = manifestBuilder.image_repo.image_group_stats
+        with ThreadPoolExecutor(max_workers=1) as pool, \
+                mock.patch.object(manifestBuilder, "volume_job", self.volume_job), \
+                mock.patch.object(manifestBuilder.image_repo, "image_group_stats",
+                                  side_effect=lambda w, ig: self.listed(stats, w, ig)):
+            return manifestBuilder.manifestInPool(pool, works)
+
+    def listed(self, stats, work_rid: str, image_group: str) -> (int, int):
+        if work_rid == "W2" and image_group == "I2":
+            raise ConnectionError("listing failed")
+        # the listing pass is over before any build starts
+        self.assertEqual([], self.built)
+        return stats(work_rid, image_group)
+
+    def test_largest_first(self):
+        self.assertTrue(self.run_pool([("W1", ["I1", "I2"]), ("W2", ["I1", "I2"])]))
+        # W2-I2 could not be listed: it comes last, and its build reports the error
+        self.assertEqual([("W1", "I2"), ("W2", "I1"), ("W1", "I1"), ("W2", "I2")], self.built)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import json
+import sqlite3
+import threading
+import time
+
+# Entries kept before the least recently used ones are evicted
+DEFAULT_MAX_ENTRIES: int = 1000000
+
+
+class DimensionCache:
+    """
+    Persistent cache of the per image data which fillDataWithBlobImage produces.
+    Entries are keyed by the image's location (path or S3 key) and only hit when the image's size
+    and version (mtime or ETag) are unchanged, so a rebuild after a small re-sync only opens the
+    images which changed. The store is a SQLite file, which several processes can share.
+    """
+
+    def __init__(self, db_path: str, max_entries: int = DEFAULT_MAX_ENTRIES):
+        """
+        :param db_path: SQLite file. Created if it does not exist
+        :param max_entries: size bound. Past it, the least recently used entries are evicted
+        """
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        # repositories look up images from their worker threads
+        self._db = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS dims (location TEXT PRIMARY KEY, size INTEGER, "
+                         "version TEXT, data TEXT, used REAL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS dims_used ON dims (used)")
+        self._db.commit()
+        self._entries: int = self._db.execute("SELECT COUNT(*) FROM dims").fetchone()[0]
+
+    def get(self, location: str, size: int, version: str, fields: [str] = ()) -> dict:
+        """
+        :param location: path or S3 key of the image
+        :param size: image size in bytes
+        :param version: mtime or ETag of the image
+        :param fields: optional entries, such as "colorclass", which the caller needs
+        :return: the cached image data, or None if absent, stale, or lacking one of fields
+        """
+        with self._lock:
+            row = self._db.execute("SELECT size, version, data FROM dims WHERE location = ?",
+                                   (location,)).fetchone()
+            if row is None or row[0] != size or row[1] != str(version):
+                return None
+            data: dict = json.loads(row[2])
+            if any(field not in data for field in fields):
+                return None
+            self._db.execute("UPDATE dims SET used = ? WHERE location = ?", (time.time(), location))
+            self._db.commit()
+        return data
+
+    def put(self, location: str, size: int, version: str, data: dict):
+        """
+        Stores an image's data. Only data without errors should be stored: errors can be transient.
+        :param location: path or S3 key of the image
+        :param size: image size in bytes
+        :param version: mtime or ETag of the image
+        :param data: image data, as fillDataWithBlobImage produces it
+        """
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO dims (location, size, version, data, used) "
+                             "VALUES (?, ?, ?, ?, ?)",
+                             (location, size, str(version), json.dumps(data), time.time()))
+            # over counts replaced entries, so recount before evicting.
+            self._entries += 1
+            # Evict in batches of a tenth of the bound, not on every put
+            if self._entries > self._max_entries * 1.1:
+                self._entries = self._db.execute("SELECT COUNT(*) FROM dims").fetchone()[0]
+                if self._entries > self._max_entries:
+                    self._db.execute("DELETE FROM dims WHERE location IN "
+                                     "(SELECT location FROM dims ORDER BY used LIMIT ?)",
+                                     (self._entries - self._max_entries,))
+                    self._entries = self._max_entries
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,298 @@
+import asyncio
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import BinaryIO
+
+# aiobotocore is optional: only this repository needs it
+from aiobotocore.config import AioConfig
+from aiobotocore.session import get_session
+from botocore.exceptions import ClientError
+
+import v_m_b.manifestCommons as Common
+from v_m_b.ImageRepository.ImageRepositoryBase import ImageRepositoryBase, DEFAULT_CONCURRENCY
+from v_m_b.ImageRepository.S3ImageRepository import MANIFEST_SPOOL_BYTES, WORK_INDEX_TTL_SECONDS, WORK_INDEX_WORKS
+from v_m_b.image.generateManifest import fillDataWithBlobImage, cached_fields, skipNonImage
+from v_m_b.image.headerProbe import RangeReader, HEADER_PROBE_BYTES
+from v_m_b.stageMetrics import metrics
+
+
+class AsyncS3ImageRepository(ImageRepositoryBase):
+    """
+    S3 repository which lists, probes and puts through one event loop and one pooled
+    aiobotocore client, so hundreds of image probes can be in flight without a thread each.
+    Only PIL header parsing runs in threads. The loop and the client live as long as the
+    repository: call close() when done.
+    """
+
+    def __init__(self, bucket_name: str, images_name: str, max_concurrency: int = DEFAULT_CONCURRENCY,
+                 dimension_cache=None, region_name: str = 'us-east-1', colorclass: bool = False):
+        """
+        :param bucket_name: source and destination bucket
+        :param images_name: subfolder of the work which contains the image group folders
+        :param max_concurrency: number of images of one image group in flight together
+        :param dimension_cache: DimensionCache of per image data
+        :param region_name: AWS region
+        :param colorclass: add each image's "colorclass" to the manifest. Fetches whole objects
+        """
+        super(AsyncS3ImageRepository, self).__init__(images_name, dimension_cache, colorclass)
+        self._bucket_name = bucket_name
+        self._max_concurrency = max_concurrency
+        self._region_name = region_name
+        self._loop = asyncio.new_event_loop()
+        self._client_context = None
+        self._client = None
+        # work RID to the key prefix of its image groups
+        self._work_prefixes: {str: str} = {}
+        # work RID to (listing time, image group folder to its objects), as in S3ImageRepository
+        self._work_indexes: OrderedDict = OrderedDict()
+        # header parsing is CPU work, there is no point in more threads than CPUs
+        self._parsers = ThreadPoolExecutor(max_workers=os.cpu_count())
+
+    def _run(self, coroutine):
+        """
+        Runs a coroutine to completion on the repository's event loop
+        """
+        return self._loop.run_until_complete(coroutine)
+
+    async def _get_client(self):
+        if self._client is None:
+            self._client_context = get_session().create_client(
+                's3', region_name=self._region_name, config=AioConfig(max_pool_connections=self._max_concurrency))
+            self._client = await self._client_context.__aenter__()
+        return self._client
+
+    def close(self):
+        """
+        Releases the client's connections, the event loop and the parser threads
+        """
+        if self._client_context is not None:
+            self._run(self._client_context.__aexit__(None, None, None))
+            self._client_context = None
+            self._client = None
+        self._parsers.shutdown()
+        self._loop.close()
+
+    async def _list(self, prefix: str) -> [dict]:
+        """
+        :param prefix: key prefix
+        :return: list_objects_v2 Contents of every object under prefix
+        """
+        client = await self._get_client()
+        contents: [dict] = []
+        tick = time.perf_counter()
+        async for page in client.get_paginator('list_objects_v2').paginate(Bucket=self._bucket_name,
+                                                                           Prefix=prefix):
+            contents.extend(page.get('Contents', []))
+        metrics.record('listing', time.perf_counter() - tick)
+        return contents
+
+    async def _work_index(self, work_rid: str) -> {str: [dict]}:
+        """
+        Lists all the image groups of a work in one paginated pass, and keeps the listing for
+        WORK_INDEX_TTL_SECONDS, like S3ImageRepository.work_index
+        :param work_rid: work identifier
+        :return: image group folder name to the list_objects_v2 entries of its objects. Folder markers,
+        keys ending in '/', are left out.
+        """
+        listed = self._work_indexes.get(work_rid)
+        if listed is not None and time.monotonic() - listed[0] < WORK_INDEX_TTL_SECONDS:
+            self._work_indexes.move_to_end(work_rid)
+            return listed[1]
+
+        prefix: str = self.work_prefix(work_rid)
+        index: {str: [dict]} = {}
+        for s3_object in await self._list(prefix):
+            if not s3_object['Key'].endswith('/'):
+                index.setdefault(s3_object['Key'][len(prefix):].split('/', 1)[0], []).append(s3_object)
+        self._work_indexes[work_rid] = (time.monotonic(), index)
+        self._work_indexes.move_to_end(work_rid)
+        while len(self._work_indexes) > WORK_INDEX_WORKS:
+            self._work_indexes.popitem(last=False)
+        return index
+
+    def image_group_objects(self, work_rid: str, image_group_disk: str) -> [dict]:
+        """
+        :param work_rid: work identifier
+        :param image_group_disk: Image group folder name
+        :return: list_objects_v2 entries of the image group's objects, from the work's index
+        """
+        return self._run(self._work_index(work_rid)).get(f"{work_rid}-{image_group_disk}", [])
+
+    def index_written(self, work_rid: str, image_group_disk: str, key: str, size: int):
+        """
+        Records an object this repository wrote in the work's index, if the work is indexed.
+        See S3ImageRepository.index_written
+        """
+        listed = self._work_indexes.get(work_rid)
+        if listed is None:
+            return
+        objects: [dict] = [x for x in listed[1].get(f"{work_rid}-{image_group_disk}", []) if x['Key'] != key]
+        objects.append({'Key': key, 'Size': size, 'ETag': '', 'LastModified': datetime.now(timezone.utc)})
+        listed[1][f"{work_rid}-{image_group_disk}"] = objects
+
+    async def _range_get(self, key: str, start: int, end: int) -> bytes:
+        client = await self._get_client()
+        response = await client.get_object(Bucket=self._bucket_name, Key=key, Range=f"bytes={start}-{end}")
+        async with response['Body'] as stream:
+            return await stream.read()
+
+    async def _probe(self, s3_object: dict, imgdata: dict, throttle: asyncio.Semaphore):
+        """
+        Fetches the header prefix on the loop, then parses it in a thread. When the header
+        extends past the prefix, the parsing thread fetches the rest through the loop.
+        """
+        key: str = s3_object['Key']
+        size: int = s3_object['Size']
+
+        def fetch(start: int, end: int) -> bytes:
+            return asyncio.run_coroutine_threadsafe(self._range_get(key, start, end), self._loop).result()
+
+        # classifying reads all the pixels: fetch them in one request
+        prefix_size: int = size if self.colorclass else min(size, HEADER_PROBE_BYTES)
+        async with throttle:
+            tick = time.perf_counter()
+            prefix: bytes = await self._range_get(key, 0, prefix_size - 1) if size > 0 else b''
+            metrics.record('fetch', time.perf_counter() - tick, len(prefix))
+            await self._loop.run_in_executor(self._parsers, fillDataWithBlobImage,
+                                             RangeReader(fetch, size, prefix=prefix), imgdata, size, self.colorclass)
+
+    async def _generate_manifest(self, work_Rid: str, vol_info: str) -> []:
+        cache = self.dimension_cache
+        throttle = asyncio.Semaphore(self._max_concurrency)
+        res: [] = []
+        probes: [] = []
+        index: {str: [dict]} = await self._work_index(work_Rid)
+        for s3_object in index.get(f"{work_Rid}-{vol_info}", []):
+            imgdata = {"filename": s3_object['Key'].split('/')[-1]}
+            res.append(imgdata)
+            if skipNonImage(imgdata):
+                continue
+            if cache is not None:
+                cached: dict = cache.get(self.cache_location(s3_object['Key']), s3_object['Size'],
+                                         s3_object['ETag'].strip('"'), cached_fields(self.colorclass))
+                if cached is not None:
+                    imgdata.update(cached)
+                    continue
+            probes.append((s3_object, imgdata))
+
+        results = await asyncio.gather(*[self._probe(s3_object, imgdata, throttle) for s3_object, imgdata in probes],
+                                       return_exceptions=True)
+        for (s3_object, imgdata), result in zip(probes, results):
+            if isinstance(result, Exception):
+                self.repo_log.error(f"S3 object {s3_object['Key']} failed: {type(result).__name__} {result}")
+                imgdata["error"] = f"Exception {result}"
+            if cache is not None and "error" not in imgdata:
+                cache.put(self.cache_location(s3_object['Key']), s3_object['Size'], s3_object['ETag'].strip('"'),
+                          imgdata)
+        return res
+
+    def generateManifest(self, work_Rid: str, vol_info: str) -> []:
+        self.repo_log.debug(vol_info)
+        return self.clean_manifest(self._run(self._generate_manifest(work_Rid, vol_info)))
+
+    def cache_location(self, image_key: str) -> str:
+        """
+        :param image_key: object key
+        :return: the object's DimensionCache location. The same as S3ImageRepository's
+        """
+        return f"s3://{self._bucket_name}/{image_key}"
+
+    async def _put(self, key: str, body):
+        client = await self._get_client()
+        await client.put_object(Bucket=self._bucket_name, Key=key, Body=body,
+                                Metadata={'ContentType': 'application/json', 'ContentEncoding': 'gzip'})
+
+    def uploadManifest(self, work_rid: str, image_group: str, bom_name: str, manifest_zip: bytes):
+        """
+        Same object and metadata as S3ImageRepository.uploadManifest
+        """
+        key: str = f"{self.resolve_image_group(work_rid, image_group)}/{bom_name}"
+        self.repo_log.debug("writing " + key)
+        try:
+            self._run(self._put(key, manifest_zip))
+            self.index_written(work_rid, image_group, key, len(manifest_zip))
+            self.repo_log.info("wrote " + key)
+        except ClientError:
+            self.repo_log.warn(f"Couldn't write json s3://{self._bucket_name}/{key}")
+
+    @contextmanager
+    def manifest_writer(self, work_rid: str, image_group: str, bom_name: str) -> BinaryIO:
+        """
+        The stream spools in memory, and to disk past MANIFEST_SPOOL_BYTES, then is put in one request
+        """
+        key: str = f"{self.resolve_image_group(work_rid, image_group)}/{bom_name}"
+        with tempfile.SpooledTemporaryFile(max_size=MANIFEST_SPOOL_BYTES) as spool:
+            yield spool
+            size: int = spool.tell()
+            spool.seek(0)
+            self.repo_log.debug("writing " + key)
+            try:
+                self._run(self._put(key, spool))
+                self.index_written(work_rid, image_group, key, size)
+                self.repo_log.info("wrote " + key)
+            except ClientError:
+                self.repo_log.warn(f"Couldn't write json s3://{self._bucket_name}/{key}")
+
+    def work_prefix(self, work_rid: str) -> str:
+        """
+        :param work_rid: work identifier
+        :return: key prefix of the work's image group folders, with a trailing '/'
+        """
+        prefix: str = self._work_prefixes.get(work_rid)
+        if prefix is None:
+            from archive_ops.api import get_s3_location
+            from pathlib import PurePath
+
+            # '/' is the separator per the AWS S3 object naming spec
+            prefix = '/'.join(PurePath(get_s3_location(Common.VMT_WORK_PARENT, work_rid)).parts
+                              + PurePath(self.images_folder_name).parts) + '/'
+            self._work_prefixes[work_rid] = prefix
+        return prefix
+
+    def resolve_image_group(self, work_rid: str, image_group_disk: str) -> str:
+        """
+        Fully qualifies a RID and a Path
+        :param work_rid:
+        :param image_group_disk: Image group folder name
+        :return: key prefix of the image group, without a trailing '/'
+        """
+        return f"{self.work_prefix(work_rid)}{work_rid}-{image_group_disk}"
+
+    def manifest_exists(self, work_Rid: str, image_group_name: str) -> bool:
+        dims_key: str = f"{self.resolve_image_group(work_Rid, image_group_name)}/{Common.VMT_DIM}"
+        return any(x['Key'] == dims_key for x in self.image_group_objects(work_Rid, image_group_name))
+
+    def manifest_is_current(self, work_Rid: str, image_group_name: str) -> bool:
+        """
+        Compares LastModified values, all taken from the listing of the work
+        """
+        prefix: str = self.resolve_image_group(work_Rid, image_group_name) + '/'
+        dims_modified = None
+        newest_image = None
+        for s3_object in self.image_group_objects(work_Rid, image_group_name):
+            if s3_object['Key'] == prefix + Common.VMT_DIM:
+                dims_modified = s3_object['LastModified']
+            elif newest_image is None or s3_object['LastModified'] > newest_image:
+                newest_image = s3_object['LastModified']
+        if dims_modified is None:
+            return False
+        return newest_image is None or dims_modified > newest_image
+
+    def image_group_stats(self, work_Rid: str, image_group_name: str) -> (int, int):
+        prefix: str = self.resolve_image_group(work_Rid, image_group_name) + '/'
+        sizes: [int] = [x['Size'] for x in self.image_group_objects(work_Rid, image_group_name)
+                        if x['Key'] != prefix + Common.VMT_DIM]
+        return len(sizes), sum(sizes)
+
+    def resolve_work(self, work_rid: str) -> (object, str):
+        """
+        Resolve a work RID to a path and identifier
+        :param work_rid: work identifier
+        :return: bucket name and work
+        """
+        return self._bucket_name, work_rid
@@ -1,13 +1,15 @@
 import asyncio
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Tuple
+from typing import BinaryIO, Tuple
 from util_lib.utils import reallypath
 
 
 import v_m_b.manifestCommons as Common
-from v_m_b.ImageRepository.ImageRepositoryBase import ImageRepositoryBase
+from v_m_b.ImageRepository.ImageRepositoryBase import ImageRepositoryBase, DEFAULT_CONCURRENCY
 # You only use onf generateManifest_a or _s
 from v_m_b.image.generateManifest import generateManifest_s, generateManifest_a
 
@@ -23,25 +25,55 @@ class FSImageRepository(ImageRepositoryBase):
             self.repo_log.info(f"manifest exists for work {work_Rid} image group {vol_info}")
         manifest: [] = []
         if full_path.exists():
-            manifest = asyncio.run(generateManifest_a(full_path),)
+            manifest = self._event_loop().run_until_complete(
+                generateManifest_a(full_path, max_concurrency=self._max_concurrency, cache=self.dimension_cache,
+                                   colorclass=self.colorclass, pool=self._pool))
             # manifest = generateManifest_s(full_path)
         else:
             self.repo_log.error(f"image group path {str(full_path)} not found")
         return self.clean_manifest(manifest)
 
-    def __init__(self, source_root: str, images_name: str):
+    def __init__(self, source_root: str, images_name: str, max_concurrency: int = DEFAULT_CONCURRENCY,
+                 dimension_cache=None, colorclass: bool = False):
         """
         Creation.
         :param source_root: parent of all works in the repository. Existing directory name
         :param images_name: subfolder of the work which contains the image group folders
+        :param max_concurrency: number of files of one image group read together
+        :param dimension_cache: DimensionCache of per image data
+        :param colorclass: add each image's "colorclass" to the manifest
         """
-        super(FSImageRepository, self).__init__(images_name)
+        super(FSImageRepository, self).__init__(images_name, dimension_cache, colorclass)
+        self._max_concurrency = max_concurrency
         # This insures _container is always absolute. You need this so that
         # you can pass a path in the --work-rid argument
         self._container = reallypath(source_root)
         self._image_folder_name = images_name
+        # created by the first image group, and shared by all the others until close()
+        self._loop: asyncio.AbstractEventLoop = None
+        self._pool: ThreadPoolExecutor = None
 #        self._IGResolver = ImageGroupResolver(source_root, images_name)
 
+    def _event_loop(self) -> asyncio.AbstractEventLoop:
+        """
+        :return: the repository's event loop, whose thread pool reads and parses the images
+        """
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            self._pool = ThreadPoolExecutor(max_workers=self._max_concurrency)
+        return self._loop
+
+    def close(self):
+        """
+        Closes the event loop and its thread pool
+        """
+        if self._loop is not None:
+            self._loop.run_until_complete(self._loop.shutdown_asyncgens())
+            self._loop.close()
+            self._pool.shutdown()
+            self._loop = None
+            self._pool = None
+
 
     def uploadManifest(self, work_rid: str, image_group: str, bom_name: str, manifest_zip: bytes):
         """
@@ -56,6 +88,22 @@ class FSImageRepository(ImageRepositoryBase):
         with open(bom_path, "wb") as upl:
             upl.write(manifest_zip)
 
+    @contextmanager
+    def manifest_writer(self, work_rid: str, image_group: str, bom_name: str) -> BinaryIO:
+        """
+        FS implementation: streams into a temporary file, which replaces bom_name when complete,
+        so that readers never see a partial manifest.
+        """
+        bom_path = Path(self.resolve_image_group(work_rid, image_group), bom_name)
+        tmp_path = bom_path.with_name(bom_path.name + ".tmp")
+        try:
+            with open(tmp_path, "wb") as upl:
+                yield upl
+            os.replace(tmp_path, bom_path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
     def resolve_image_group(self, work_rid: str, image_group_disk: str) -> Path:
         """
         Fully qualifies a RID and a Path
@@ -72,6 +120,26 @@ class FSImageRepository(ImageRepositoryBase):
         dims_path: Path =  Path(self.resolve_image_group(work_Rid, image_group_name), Common.VMT_DIM)
         return dims_path.exists()
 
+    def manifest_is_current(self, work_Rid: str, image_group_name: str) -> bool:
+        ig_path: Path = self.resolve_image_group(work_Rid, image_group_name)
+        dims_path: Path = ig_path / Common.VMT_DIM
+        if not dims_path.exists():
+            return False
+        dims_mtime = dims_path.stat().st_mtime
+        for image_file in os.scandir(ig_path):
+            if image_file.is_file() and image_file.name != Common.VMT_DIM \
+                    and image_file.stat().st_mtime >= dims_mtime:
+                return False
+        return True
+
+    def image_group_stats(self, work_Rid: str, image_group_name: str) -> (int, int):
+        ig_path: Path = self.resolve_image_group(work_Rid, image_group_name)
+        if not ig_path.exists():
+            return 0, 0
+        sizes: [int] = [image_file.stat().st_size for image_file in os.scandir(ig_path)
+                        if image_file.is_file() and image_file.name != Common.VMT_DIM]
+        return len(sizes), sum(sizes)
+
     def resolve_work(self, work_rid: str) -> (object, str):
         """
         Resolve a work RID to a path and identifier
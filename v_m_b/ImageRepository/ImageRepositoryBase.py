@@ -3,10 +3,16 @@ Base class for image repositories
 """
 
 from abc import ABCMeta, abstractmethod
+from contextlib import contextmanager
+from typing import BinaryIO
+import io
 import logging
 
 import v_m_b.manifestCommons as Common
 
+# How many images of one image group are in flight together
+DEFAULT_CONCURRENCY: int = 10
+
 
 class ImageRepositoryBase(metaclass=ABCMeta):
 
@@ -20,6 +26,24 @@ class ImageRepositoryBase(metaclass=ABCMeta):
         :return: true if the args point to a path containing a 'dimensions.json' object
         """
     @abstractmethod
+    def manifest_is_current(self, work_Rid: str, image_group_name: str) -> bool:
+        """
+        Test if a manifest exists, and is newer than every image it describes
+        :param work_Rid: work identifier
+        :param image_group_name: which image group (volume)
+        :return: true if the image group's 'dimensions.json' is newer than all the other objects in it
+        """
+
+    @abstractmethod
+    def image_group_stats(self, work_Rid: str, image_group_name: str) -> (int, int):
+        """
+        Cheap listing of an image group, which reads no image
+        :param work_Rid: work identifier
+        :param image_group_name: which image group (volume)
+        :return: number of files and their total size in bytes, not counting 'dimensions.json'
+        """
+
+    @abstractmethod
     def resolve_work(self, work_rid: str) -> (object, str):
         """
         Resolve a work RID to a path and identifier
@@ -57,6 +81,34 @@ class ImageRepositoryBase(metaclass=ABCMeta):
         """
 
 
+    @contextmanager
+    def manifest_writer(self, work_rid: str, image_group: str, bom_name: str) -> BinaryIO:
+        """
+        Writable stream of a zipped manifest. The manifest is stored when the context exits without error.
+        This default buffers the stream for uploadManifest. Subclasses stream it to their storage.
+        :param work_rid: locator
+        :param image_group: locator
+        :param bom_name: filename of target
+        :return: binary stream
+        """
+        buffer = io.BytesIO()
+        yield buffer
+        self.uploadManifest(work_rid, image_group, bom_name, buffer.getvalue())
+
+    def close(self):
+        """
+        Releases what the repository keeps for the whole process, such as thread pools and event loops,
+        which all its image groups share. The repository must not be used afterwards.
+        Closing twice is harmless.
+        """
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
     def clean_manifest(self, manifest: [dict]):
         """
         :param manifest: file list
@@ -75,10 +127,28 @@ class ImageRepositoryBase(metaclass=ABCMeta):
     def images_folder_name(self):
         return self._image_parent_name
 
-    def __init__(self, images_name: str):
+    @property
+    def dimension_cache(self):
+        """
+        DimensionCache consulted before opening an image, or None
+        """
+        return self._dimension_cache
+
+    @property
+    def colorclass(self) -> bool:
+        """
+        True if manifest entries get a "colorclass". See fillDataWithBlobImage
+        """
+        return self._colorclass
+
+    def __init__(self, images_name: str, dimension_cache=None, colorclass: bool = False):
         """
         :param bom: key to bill of materials
         :type bom: str
+        :param dimension_cache: DimensionCache of per image data
+        :param colorclass: add each image's "colorclass" to the manifest. Reads whole images
         """
         self._log = logging.getLogger(__name__)
         self._image_parent_name = images_name
+        self._dimension_cache = dimension_cache
+        self._colorclass = colorclass
@@ -1,4 +1,4 @@
-from v_m_b.ImageRepository.S3ImageRepository import S3ImageRepository
+from v_m_b.ImageRepository.ImageRepositoryBase import DEFAULT_CONCURRENCY
 from v_m_b.ImageRepository.FSImageRepository import FSImageRepository
 
 
@@ -12,21 +12,42 @@ class ImageRepositoryFactory(object):
         """
         Construct a repository for the desired channel: s3 or file system
         See v_m_b.manifestCommons.prolog for calling sequence
-        :param source: 's3' or 'fs' (case insensitive)
+        :param source: 's3', 's3async' or 'fs' (case insensitive). 's3async' requires aiobotocore
         :type source: str
         :type kwargs: object
         :keyword object client: boto client session
         :keyword object dest_bucket: object of destination
+        :keyword str bucket_name: name of destination, for 's3async'
         :keyword str source_container: directory name of parent of works
         :keyword str image_classifier: directory name of parent of image groups
+        :keyword int max_concurrency: number of images of one image group in flight together
+        :keyword DimensionCache dimension_cache: per image data cache
+        :keyword bool colorclass: add each image's "colorclass" to the manifest
         :return:
         """
         # S3 calling args.s3, client=client, bucket=dest_bucket
         if source.lower() == "s3":
+            # boto3 and s3pathlib take a while to import, and fs mode never needs them
+            from v_m_b.ImageRepository.S3ImageRepository import S3ImageRepository
             return S3ImageRepository( client=kwargs['client'],
                                       dest_bucket=kwargs['bucket'],
-                                      images_name=kwargs['image_classifier'])
+                                      images_name=kwargs['image_classifier'],
+                                      max_concurrency=kwargs.get('max_concurrency', DEFAULT_CONCURRENCY),
+                                      dimension_cache=kwargs.get('dimension_cache'),
+                                      colorclass=kwargs.get('colorclass', False))
+
+        if source.lower() == "s3async":
+            # aiobotocore is optional, so only import it when asked
+            from v_m_b.ImageRepository.AsyncS3ImageRepository import AsyncS3ImageRepository
+            return AsyncS3ImageRepository(bucket_name=kwargs['bucket_name'],
+                                          images_name=kwargs['image_classifier'],
+                                          max_concurrency=kwargs.get('max_concurrency', DEFAULT_CONCURRENCY),
+                                          dimension_cache=kwargs.get('dimension_cache'),
+                                          colorclass=kwargs.get('colorclass', False))
 
         if source.lower() == "fs":
             return FSImageRepository(source_root=kwargs['source_container'],
-                                     images_name=kwargs['image_classifier'])
+                                     images_name=kwargs['image_classifier'],
+                                     max_concurrency=kwargs.get('max_concurrency', DEFAULT_CONCURRENCY),
+                                     dimension_cache=kwargs.get('dimension_cache'),
+                                     colorclass=kwargs.get('colorclass', False))
@@ -1,18 +1,34 @@
 import hashlib
 import io
-import sys
-from typing import Tuple
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import PurePath
+from typing import BinaryIO, Tuple
 
 import boto3
-import botocore
 from boto.s3.bucket import Bucket
 from s3pathlib import S3Path
 
 # from manifestCommons import *
 import v_m_b.manifestCommons as Common
-from v_m_b.ImageRepository.ImageRepositoryBase import ImageRepositoryBase
-from v_m_b.image.generateManifest import fillDataWithBlobImage
-from v_m_b.s3customtransfer import S3CustomTransfer
+from v_m_b.ImageRepository.ImageRepositoryBase import ImageRepositoryBase, DEFAULT_CONCURRENCY
+from v_m_b.image.generateManifest import fillDataWithBlobImage, cached_fields, skipNonImage
+from v_m_b.image.headerProbe import RangeReader
+from v_m_b.s3customtransfer import S3CustomTransfer, TransferConfig
+from v_m_b.stageMetrics import metrics
+
+# manifests larger than this spool to disk on their way to S3
+MANIFEST_SPOOL_BYTES: int = 8 * 1024 * 1024
+
+# A work's listing serves all its image groups for this long, then the work is listed again.
+# Short, because objects added by others in the meantime are not seen
+WORK_INDEX_TTL_SECONDS: int = 60
+# Number of works whose listings are kept
+WORK_INDEX_WORKS: int = 16
 
 
 class S3ImageRepository(ImageRepositoryBase):
@@ -21,54 +37,195 @@ class S3ImageRepository(ImageRepositoryBase):
         pass
 
 
-    def __init__(self, client: boto3.client, dest_bucket: Bucket, images_name: str):
+    def __init__(self, client: boto3.client, dest_bucket: Bucket, images_name: str, header_probe: bool = True,
+                 max_concurrency: int = DEFAULT_CONCURRENCY, dimension_cache=None, colorclass: bool = False):
         """
         Initialize
         :param bom:name of Bill of Materials
+        :param header_probe: fetch only the image headers, using ranged GETs, instead of whole objects
+        :param max_concurrency: number of images of one image group in flight together
+        :param dimension_cache: DimensionCache of per image data
+        :param colorclass: add each image's "colorclass" to the manifest. Fetches whole objects
         """
-        super(S3ImageRepository, self).__init__(images_name)
+        super(S3ImageRepository, self).__init__(images_name, dimension_cache, colorclass)
         self._client = client
         self._bucket = dest_bucket
         self._boto_paginator = self._client.get_paginator('list_objects_v2')
+        # classifying reads all the pixels, so header probing would only add requests
+        self._header_probe = header_probe and not colorclass
+        self._max_concurrency = max_concurrency
+        # work RID to the key prefix of its image groups
+        self._work_prefixes: {str: str} = {}
+        # work RID to (listing time, image group folder to its objects)
+        self._work_indexes: OrderedDict = OrderedDict()
+        # header probe threads, or whole object transfers, shared by all image groups until close()
+        self._executor = None
+
+    def _image_executor(self):
+        """
+        :return: the header probe thread pool, or the whole object S3CustomTransfer, created on first use
+        """
+        if self._executor is None:
+            if self._header_probe:
+                self._executor = ThreadPoolExecutor(max_workers=self._max_concurrency)
+            else:
+                self._executor = S3CustomTransfer(self._client, TransferConfig(max_concurrency=self._max_concurrency))
+        return self._executor
+
+    def close(self):
+        """
+        Stops the header probe threads or the transfer manager's threads
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
 
 
-    def fillData(self, transfer, s3imageKey, imgdata):
+    def fillData(self, transfer, s3imageKey, imgdata) -> Future:
         """
         Launch async transfer with callback
+        :return: a future which is done when the callback has filled imgdata, and raises the transfer's error.
+        Not the transfer's own future, which is done before its callbacks run.
         """
         buffer = io.BytesIO()
-        try:
-            transfer.download_file(self._bucket.name, s3imageKey, buffer,
-                                   callback=DoneCallback(buffer, imgdata))
-        except botocore.exceptions.ClientError as e:
-            if e.response['Error']['Code'] == '404':
-                self.repo_log.error(f"S3 object {s3imageKey} not found.")
-            else:
-                ee = sys.exc_info()
-                self.repo_log.error(f"S3 Exception ei[0]:{ee[0]} ei[1]:{ee[1]}")
-                raise
-        finally:
-            # self.repo_log.debug(imgdata)
-            pass
+        callback = DoneCallback(buffer, imgdata, self.colorclass)
+        transfer.submit_download(self._bucket.name, s3imageKey, buffer, callback=callback)
+        return callback.parsed
+
+    def probeData(self, s3imageKey: str, size: int, imgdata: dict):
+        """
+        Fills imgdata from the image header, which is fetched with ranged GETs.
+        :param s3imageKey: object key
+        :param size: object ContentLength, from its listing
+        :param imgdata: image data to fill in
+        """
+
+        def fetch(start: int, end: int) -> bytes:
+            response = self._client.get_object(Bucket=self._bucket.name, Key=s3imageKey, Range=f"bytes={start}-{end}")
+            return response['Body'].read()
+
+        # S3 errors during the fetches land in imgdata["error"], like any unreadable image
+        fillDataWithBlobImage(RangeReader(fetch, size), imgdata, size)
 
     def generateManifest(self, work_Rid: str, vol_info: str) -> []:
+        """
+        Submits every image of the image group, keeping up to max_concurrency of them in flight,
+        then gathers the results. An image whose fetch fails gets an "error" entry, and so
+        is dropped by clean_manifest, without failing the rest of the image group.
+        """
         res = []
-        transfer = S3CustomTransfer(self._client)
-        parent: S3Path = self.resolve_image_group(work_Rid, vol_info)
+        in_flight: [(Future, str, int, str, dict)] = []
+        cache = self.dimension_cache
         #
         self.repo_log.debug(vol_info)
-        for image_s3 in parent.iter_objects():
-            if image_s3.is_file():
-                image_file_name: str = image_s3.basename
-                image_key:str = image_s3.key
-                imgdata = {"filename": image_file_name}
-                res.append(imgdata)
-                self.fillData(transfer, image_key, imgdata)
-
-        transfer.wait()
+        executor = self._image_executor()
+        for s3_object in self.image_group_objects(work_Rid, vol_info):
+            image_key: str = s3_object['Key']
+            size: int = s3_object['Size']
+            etag: str = s3_object['ETag'].strip('"')
+            imgdata = {"filename": image_key.split('/')[-1]}
+            res.append(imgdata)
+            if skipNonImage(imgdata):
+                continue
+            if cache is not None:
+                cached: dict = cache.get(self.cache_location(image_key), size, etag,
+                                         cached_fields(self.colorclass))
+                if cached is not None:
+                    imgdata.update(cached)
+                    continue
+            if self._header_probe:
+                # the listing gives the object ContentLength, for the size entry
+                future = executor.submit(self.probeData, image_key, size, imgdata)
+            else:
+                future = self.fillData(executor, image_key, imgdata)
+            in_flight.append((future, image_key, size, etag, imgdata))
+
+        for future, image_key, size, etag, imgdata in in_flight:
+            try:
+                future.result()
+            except Exception as e:
+                self.repo_log.error(f"S3 object {image_key} failed: {type(e).__name__} {e}")
+                imgdata["error"] = f"Exception {e}"
+            if cache is not None and "error" not in imgdata:
+                cache.put(self.cache_location(image_key), size, etag, imgdata)
+
         return self.clean_manifest(res)
 
 
+    def work_prefix(self, work_rid: str) -> str:
+        """
+        :param work_rid: work identifier
+        :return: key prefix of the work's image group folders, with a trailing '/'
+        """
+        prefix: str = self._work_prefixes.get(work_rid)
+        if prefix is None:
+            from archive_ops.api import get_s3_location
+
+            # '/' is the separator per the AWS S3 object naming spec
+            prefix = '/'.join(PurePath(get_s3_location(Common.VMT_WORK_PARENT, work_rid)).parts
+                              + PurePath(self.images_folder_name).parts) + '/'
+            self._work_prefixes[work_rid] = prefix
+        return prefix
+
+    def work_index(self, work_rid: str) -> {str: [dict]}:
+        """
+        Lists all the image groups of a work in one paginated pass. The listing is kept for
+        WORK_INDEX_TTL_SECONDS, for the work's other image groups.
+        :param work_rid: work identifier
+        :return: image group folder name to the list_objects_v2 entries (Key, Size, ETag, LastModified)
+        of its objects. Folder markers, keys ending in '/', are left out.
+        """
+        listed = self._work_indexes.get(work_rid)
+        if listed is not None and time.monotonic() - listed[0] < WORK_INDEX_TTL_SECONDS:
+            self._work_indexes.move_to_end(work_rid)
+            return listed[1]
+
+        prefix: str = self.work_prefix(work_rid)
+        index: {str: [dict]} = {}
+        with metrics.timed('listing'):
+            for page in self._boto_paginator.paginate(Bucket=self._bucket.name, Prefix=prefix):
+                for s3_object in page.get('Contents', []):
+                    if s3_object['Key'].endswith('/'):
+                        continue
+                    image_group_folder: str = s3_object['Key'][len(prefix):].split('/', 1)[0]
+                    index.setdefault(image_group_folder, []).append(s3_object)
+        self._work_indexes[work_rid] = (time.monotonic(), index)
+        self._work_indexes.move_to_end(work_rid)
+        while len(self._work_indexes) > WORK_INDEX_WORKS:
+            self._work_indexes.popitem(last=False)
+        return index
+
+    def image_group_objects(self, work_rid: str, image_group_disk: str) -> [dict]:
+        """
+        :param work_rid: work identifier
+        :param image_group_disk: Image group folder name
+        :return: list_objects_v2 entries of the image group's objects, from the work's index
+        """
+        return self.work_index(work_rid).get(f"{work_rid}-{image_group_disk}", [])
+
+    def index_written(self, work_rid: str, image_group_disk: str, key: str, size: int):
+        """
+        Records an object this repository wrote in the work's index, if the work is indexed,
+        so that the index does not go stale on our own writes
+        :param work_rid: work identifier
+        :param image_group_disk: Image group folder name
+        :param key: the object's key
+        :param size: the object's size
+        """
+        listed = self._work_indexes.get(work_rid)
+        if listed is None:
+            return
+        objects: [dict] = [x for x in listed[1].get(f"{work_rid}-{image_group_disk}", []) if x['Key'] != key]
+        objects.append({'Key': key, 'Size': size, 'ETag': '', 'LastModified': datetime.now(timezone.utc)})
+        listed[1][f"{work_rid}-{image_group_disk}"] = objects
+
+    def cache_location(self, image_key: str) -> str:
+        """
+        :param image_key: object key
+        :return: the object's DimensionCache location
+        """
+        return f"s3://{self._bucket.name}/{image_key}"
+
     def uploadManifest(self, work_rid: str, image_group: str, bom_name: str, manifest_zip: bytes):
         """
          - upload on s3 with the right metadata:
@@ -88,10 +245,33 @@ class S3ImageRepository(ImageRepositoryBase):
             self._client.put_object(Key=key.key, Body=manifest_zip,
                                     Metadata={'ContentType': 'application/json', 'ContentEncoding': 'gzip'},
                                     Bucket=self._bucket.name)
+            self.index_written(work_rid, image_group, key.key, len(manifest_zip))
             self.repo_log.info("wrote " + key.fname)
         except ClientError:
             self.repo_log.warn(f"Couldn't write json {key.abspath}")
 
+    @contextmanager
+    def manifest_writer(self, work_rid: str, image_group: str, bom_name: str) -> BinaryIO:
+        """
+        S3 implementation: the stream spools in memory, and to disk past MANIFEST_SPOOL_BYTES.
+        upload_fileobj then sends it, in parts if it is large. Metadata is as in uploadManifest.
+        """
+        key: S3Path = S3Path(self.resolve_image_group(work_rid, image_group), bom_name)
+        from botocore.exceptions import ClientError
+        with tempfile.SpooledTemporaryFile(max_size=MANIFEST_SPOOL_BYTES) as spool:
+            yield spool
+            size: int = spool.tell()
+            spool.seek(0)
+            self.repo_log.debug("writing " + key.fname)
+            try:
+                self._client.upload_fileobj(spool, self._bucket.name, key.key,
+                                            ExtraArgs={'Metadata': {'ContentType': 'application/json',
+                                                                    'ContentEncoding': 'gzip'}})
+                self.index_written(work_rid, image_group, key.key, size)
+                self.repo_log.info("wrote " + key.fname)
+            except ClientError:
+                self.repo_log.warn(f"Couldn't write json {key.abspath}")
+
     def resolve_image_group(self, work_rid: str, image_group_disk: str) -> S3Path:
         """
         Fully qualifies a RID and a Path
@@ -99,19 +279,33 @@ class S3ImageRepository(ImageRepositoryBase):
         :param image_group_disk: Image group folder name
         :return: fully qualified path to image group on disk.
         """
-        from archive_ops.api import get_s3_location
-        from pathlib import PurePath
+        return S3Path(self._bucket.name, f"{self.work_prefix(work_rid)}{work_rid}-{image_group_disk}")
 
-        # '/' is the separator per the AWS S3 object naming spec
-        locator: str = '/'.join(
-            PurePath(get_s3_location(Common.VMT_WORK_PARENT, work_rid)).parts
-            + PurePath( self.images_folder_name, f"{work_rid}-{image_group_disk}").parts)
+    def manifest_exists(self, work_Rid: str, image_group_name: str) -> bool:
+        dims_key: str = f"{self.resolve_image_group(work_Rid, image_group_name).key}/{Common.VMT_DIM}"
+        return any(x['Key'] == dims_key for x in self.image_group_objects(work_Rid, image_group_name))
 
-        return S3Path(self._bucket.name, locator)
+    def manifest_is_current(self, work_Rid: str, image_group_name: str) -> bool:
+        """
+        Compares LastModified values, all taken from the listing of the work
+        """
+        dims_key: str = f"{self.resolve_image_group(work_Rid, image_group_name).key}/{Common.VMT_DIM}"
+        dims_modified = None
+        newest_image = None
+        for s3_object in self.image_group_objects(work_Rid, image_group_name):
+            if s3_object['Key'] == dims_key:
+                dims_modified = s3_object['LastModified']
+            elif newest_image is None or s3_object['LastModified'] > newest_image:
+                newest_image = s3_object['LastModified']
+        if dims_modified is None:
+            return False
+        return newest_image is None or dims_modified > newest_image
 
-    def manifest_exists(self, work_Rid: str, image_group_name: str) -> bool:
-            dims_path:S3Path = S3Path(self.resolve_image_group(work_Rid, image_group_name), Common.VMT_DIM)
-            return dims_path.exists()
+    def image_group_stats(self, work_Rid: str, image_group_name: str) -> (int, int):
+        dims_key: str = f"{self.resolve_image_group(work_Rid, image_group_name).key}/{Common.VMT_DIM}"
+        sizes: [int] = [x['Size'] for x in self.image_group_objects(work_Rid, image_group_name)
+                        if x['Key'] != dims_key]
+        return len(sizes), sum(sizes)
 
     def resolve_work(self, work_rid: str) -> (object, str):
         """
@@ -122,9 +316,21 @@ class S3ImageRepository(ImageRepositoryBase):
         return (self._bucket, work_rid)
 
 class DoneCallback(object):
-    def __init__(self, buffer, imgdata):
+    def __init__(self, buffer, imgdata, colorclass: bool = False):
         self._buffer = buffer
         self._imgdata = imgdata
+        self._colorclass = colorclass
+        self._submitted = time.perf_counter()
+        # done when imgdata is filled in, or with the transfer's error
+        self.parsed: Future = Future()
 
-    def __call__(self):
-        fillDataWithBlobImage(self._buffer, self._imgdata)
+    def __call__(self, transfer_future=None):
+        try:
+            if transfer_future is not None:
+                transfer_future.result()
+            # includes the wait for a transfer thread
+            metrics.record('fetch', time.perf_counter() - self._submitted, self._buffer.getbuffer().nbytes)
+            fillDataWithBlobImage(self._buffer, self._imgdata, colorclass=self._colorclass)
+            self.parsed.set_result(None)
+        except Exception as e:
+            self.parsed.set_exception(e)
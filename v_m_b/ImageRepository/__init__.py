@@ -1 +1,2 @@
+# AsyncS3ImageRepository is not listed: it needs the optional aiobotocore. Import it by name.
 __all__: object = ['ImageRepositoryBase', 'S3ImageRepository', 'FSImageRepository', 'ImageRepositoryFactory']
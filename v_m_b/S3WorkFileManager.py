@@ -1,4 +1,18 @@
-import boto3
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import PurePosixPath
+
+
+# delete_objects takes at most this many keys
+DELETE_BATCH_SIZE: int = 1000
+
+# A lease older than this belongs to a worker which died while claiming. Another worker can take it over.
+DEFAULT_LEASE_SECONDS: int = 6 * 60 * 60
+
+# parallel copies
+MOVE_CONCURRENCY: int = 16
 
 
 class S3WorkFileManager:
@@ -56,8 +70,101 @@ class S3WorkFileManager:
         self.s3.Object(self._bucket_name, src_object).delete()
 
     def s3_move_list(self, src_list: [], dest_list: [], src_path: str, dest_path: str):
-        for src, dest in zip(src_list, dest_list):
-            self.s3_move(src, dest, src_path, dest_path)
+        """
+        Moves a list of objects: copies them all in parallel, then deletes the sources in batches.
+        Throws on error, after the copies which succeeded are complete. The sources of copies
+        which failed are not deleted.
+        """
+        client = self.s3.meta.client
+        with ThreadPoolExecutor(max_workers=MOVE_CONCURRENCY) as copiers:
+            copies = [copiers.submit(client.copy_object, Bucket=self._bucket_name, Key=f'{dest_path}{dest}',
+                                     CopySource={'Bucket': self._bucket_name, 'Key': f'{src_path}{src}'})
+                      for src, dest in zip(src_list, dest_list)]
+        copied: [str] = [f'{src_path}{src}' for src, copy in zip(src_list, copies) if copy.exception() is None]
+        self.s3_delete_keys(copied)
+        for copy in copies:
+            if copy.exception() is not None:
+                raise copy.exception()
+
+    def s3_delete_keys(self, keys: [str]):
+        """
+        Deletes objects, DELETE_BATCH_SIZE per request. Throws if any delete fails
+        :param keys: full keys in the bucket
+        """
+        client = self.s3.meta.client
+        for i in range(0, len(keys), DELETE_BATCH_SIZE):
+            response = client.delete_objects(Bucket=self._bucket_name,
+                                             Delete={'Objects': [{'Key': x} for x in keys[i:i + DELETE_BATCH_SIZE]],
+                                                     'Quiet': True})
+            if response.get('Errors'):
+                raise IOError(f"Could not delete {response['Errors']}")
+
+    def lease_key(self, file_name: str) -> str:
+        """
+        :param file_name: work list file in the source folder
+        :return: key of its lease marker
+        """
+        return f'{self._lease_folder}{file_name}'
+
+    def claim(self, file_name: str, dest_name: str, etag: str) -> bool:
+        """
+        Claims one work list file for this instance:
+        1. Creates the file's lease marker, with If-None-Match: *. Only one worker can succeed,
+           unless the existing lease has expired, see take_over_lease.
+        2. Copies the file to the underway folder, only if it is still the version we listed (its etag.)
+        The caller then deletes the source, and only then the lease, see mark_underway.
+        :param file_name: file in the source folder
+        :param dest_name: its name in the underway folder
+        :param etag: ETag of the file, as listed
+        :return: true if this instance owns the file
+        """
+        from botocore.exceptions import ClientError
+
+        client = self.s3.meta.client
+        lease_key = self.lease_key(file_name)
+        lease: bytes = json.dumps({'owner': self._hostname, 'claimed': time.time(), 'dest': dest_name}).encode()
+        try:
+            client.put_object(Bucket=self._bucket_name, Key=lease_key, Body=lease, IfNoneMatch='*')
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                raise
+            if not self.take_over_lease(lease_key, lease):
+                return False
+        try:
+            client.copy_object(Bucket=self._bucket_name, Key=f'{self._underway_folder}{dest_name}',
+                               CopySource={'Bucket': self._bucket_name, 'Key': f'{self._src_folder}{file_name}'},
+                               CopySourceIfMatch=etag)
+        except ClientError as e:
+            # Someone else moved or changed the source since we listed it
+            client.delete_object(Bucket=self._bucket_name, Key=lease_key)
+            if e.response['Error']['Code'] in ('PreconditionFailed', 'NoSuchKey', '404'):
+                return False
+            raise
+        return True
+
+    def take_over_lease(self, lease_key: str, lease: bytes) -> bool:
+        """
+        Replaces an expired lease, with If-Match on the expired lease's ETag, so that only one
+        worker can take it over.
+        :param lease_key: lease marker key
+        :param lease: new lease contents
+        :return: true if this instance now holds the lease
+        """
+        from botocore.exceptions import ClientError
+
+        client = self.s3.meta.client
+        try:
+            held = client.head_object(Bucket=self._bucket_name, Key=lease_key)
+            if time.time() - held['LastModified'].timestamp() < self._lease_seconds:
+                return False
+            client.put_object(Bucket=self._bucket_name, Key=lease_key, Body=lease, IfMatch=held['ETag'])
+            return True
+        except ClientError as e:
+            # the lease was released or taken over since we tried to create it
+            if e.response['Error']['Code'] in ('PreconditionFailed', 'ConditionalRequestConflict', 'NoSuchKey',
+                                               '404'):
+                return False
+            raise
 
     def local_name_work_file(self, file_name: str):
         """
@@ -67,15 +174,43 @@ class S3WorkFileManager:
         """
         return f'{file_name}-{self._hostname}'
 
-    def mark_underway(self, object_list: [], dest_name_list: []):
+    def claimed_name(self, local_name: str) -> str:
         """
-        Moves a set of files from the instance's to do into underway.
+        :param local_name: a name from local_name_work_file()
+        :return: the file name it was claimed under
+        """
+        suffix: str = f'-{self._hostname}'
+        return local_name[:-len(suffix)] if local_name.endswith(suffix) else local_name
+
+    def mark_underway(self, object_list: [], dest_name_list: [], etag_list: [] = None) -> []:
+        """
+        Claims a set of files from the instance's to do into underway. Several instances can
+        claim from the same to do folder: each file goes to exactly one of them.
         Caller can use local_name_work_file() to rename
         :param object_list:
         :param dest_name_list:
-        :return:
+        :param etag_list: ETags of the objects, as listed. Claims only succeed if the objects are unchanged.
+        :return: the dest names of the files this instance claimed. Claims which fail are logged, and do
+        not prevent the others.
         """
-        self.s3_move_list(object_list, dest_name_list, self._src_folder, self._underway_folder)
+        if etag_list is None:
+            client = self.s3.meta.client
+            etag_list = [client.head_object(Bucket=self._bucket_name, Key=f'{self._src_folder}{x}')['ETag']
+                         for x in object_list]
+        with ThreadPoolExecutor(max_workers=MOVE_CONCURRENCY) as claimers:
+            claims = [claimers.submit(self.claim, src, dest, etag)
+                      for src, dest, etag in zip(object_list, dest_name_list, etag_list)]
+        # A claim which failed leaves its file in the source folder, for a later claim, once its lease, if
+        # any, expires. The others are ours, whatever happened to it.
+        for src, claim in zip(object_list, claims):
+            if claim.exception() is not None:
+                self._log.error(f"Could not claim {self._src_folder}{src}: {claim.exception()}")
+        claimed: [bool] = [claim.exception() is None and claim.result() for claim in claims]
+        claimed_sources: [str] = [src for src, x in zip(object_list, claimed) if x]
+        # sources must be gone before their leases are, or another instance could claim them again
+        self.s3_delete_keys([f'{self._src_folder}{x}' for x in claimed_sources])
+        self.s3_delete_keys([self.lease_key(x) for x in claimed_sources])
+        return [dest for dest, x in zip(dest_name_list, claimed) if x]
 
     def mark_done(self, object_list: [], dest_name_list: []):
         """
@@ -86,18 +221,37 @@ class S3WorkFileManager:
         """
         self.s3_move_list(object_list, dest_name_list, self._underway_folder, self._done_folder, )
 
-    def __init__(self, bucket_name: str, src_folder: str, underway_folder: str, done_folder: str):
+    def mark_failed(self, object_list: []):
+        """
+        Moves a set of files from the instance's underway folder back to the to do folder, under the
+        names they were claimed under, for any instance to claim again
+        :param object_list: names from local_name_work_file()
+        """
+        self.s3_move_list(object_list, [self.claimed_name(x) for x in object_list], self._underway_folder,
+                          self._src_folder)
+
+    def __init__(self, bucket_name: str, src_folder: str, underway_folder: str, done_folder: str,
+                 lease_folder: str = None, lease_seconds: int = DEFAULT_LEASE_SECONDS):
         """
         Initializer:
         :param bucket_name: scope of all operations
         :param src_folder: location of work list
         :param underway_folder: folder inside bucket where in progress files go
         :param done_folder:  folder inside bucket where completed files go
+        :param lease_folder: folder inside bucket for claim lease markers. Defaults to a "leases" sibling of src_folder
+        :param lease_seconds: age after which a lease is considered abandoned
         """
         self._bucket_name = bucket_name
         self._hostname = self.me_instance()
         self._src_folder = src_folder
         self._underway_folder = underway_folder
         self._done_folder = done_folder
+        if lease_folder is None:
+            src_parent = str(PurePosixPath(src_folder).parent)
+            lease_folder = "leases/" if src_parent == '.' else f"{src_parent}/leases/"
+        self._lease_folder = lease_folder
+        self._lease_seconds = lease_seconds
+        self._log = logging.getLogger(__name__)
 
+        import boto3
         self.s3 = boto3.resource('s3')
@@ -1,9 +1,43 @@
-from urllib import request
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from v_m_b.ImageRepository import ImageRepositoryBase
 from v_m_b.VolumeInfo.VolumeInfoBase import VolumeInfoBase
+from v_m_b.VolumeInfo.VolumeInfoCache import VolumeInfoCache
+
+VOLUMES_FOR_INSTANCE_URL: str = 'http://purl.bdrc.io/query/table/volumesForInstance'
+
+# (connect, read) seconds
+REQUEST_TIMEOUT: (int, int) = (10, 60)
+
+# Retries of failed connections and of 429 and 5xx responses, with exponential backoff
+REQUEST_RETRIES: int = 3
+
+# BUDA has no multi work query, so bulk lookups are this many concurrent requests on pooled connections
+BULK_CONCURRENCY: int = 8
+
+_session: requests.Session = None
+_session_pid: int = None
 
 
+def buda_session() -> requests.Session:
+    """
+    :return: this process's keep alive session to BUDA. Worker processes must not share their parent's
+    connections, so each process gets its own.
+    """
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        _session = requests.Session()
+        retries = Retry(total=REQUEST_RETRIES, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+        _session.mount('http://', HTTPAdapter(pool_maxsize=BULK_CONCURRENCY, max_retries=retries))
+        _session.mount('https://', HTTPAdapter(pool_maxsize=BULK_CONCURRENCY, max_retries=retries))
+        _session_pid = os.getpid()
+    return _session
+
 
 # TODO: Extend to support a named image group
 class VolumeInfoBUDA(VolumeInfoBase):
@@ -11,45 +45,91 @@ class VolumeInfoBUDA(VolumeInfoBase):
     Gets the Volume list from BUDA. BUDA decided it did not want to support
     the get image list, so we have to turn to the repository provider to get the list from the VMT_BUDABOM
     """
-    def __init__(self, repo: ImageRepositoryBase):
+    def __init__(self, repo: ImageRepositoryBase, cache: VolumeInfoCache = None):
+        """
+        :param repo: image repository
+        :param cache: results of earlier lookups. When None, every lookup queries BUDA
+        """
         super(VolumeInfoBUDA, self).__init__(repo)
+        self._cache = cache
 
     def get_image_group_disk_paths(self, work_rid: str) -> object:
         """
         BUDA LDS-PDI implementation
         :param: work_rid
-        :return: VolInfo[]
+        :return: VolInfo[]. Throws if BUDA cannot be reached or its response cannot be read, so that
+        a failure is not mistaken for a work without image groups. An empty answer is not cached:
+        it can be a transient one, which must not last as long as the cache's entries.
         """
+        if self._cache is not None:
+            vol_info = self._cache.get(work_rid)
+            if vol_info is not None:
+                return vol_info
 
+        vol_info = self.query_buda(work_rid)
+        if self._cache is not None and len(vol_info) > 0:
+            self._cache.put(work_rid, vol_info)
+        return vol_info
+
+    def get_image_group_disk_paths_bulk(self, work_rids: [str]) -> {str: []}:
+        """
+        Looks up many works, BULK_CONCURRENCY at a time, on pooled connections, and caches the results.
+        :param work_rids: work identifiers
+        :return: the VolInfo[] of each work which could be looked up. Failures are only logged:
+        get_image_group_disk_paths throws them again when their work is processed.
+        """
+        vol_infos: {str: []} = {}
+        missing: [str] = []
+        for work_rid in dict.fromkeys(work_rids):
+            vol_info = self._cache.get(work_rid) if self._cache is not None else None
+            if vol_info is None:
+                missing.append(work_rid)
+            else:
+                vol_infos[work_rid] = vol_info
+
+        def lookup(work_rid: str):
+            try:
+                return self.get_image_group_disk_paths(work_rid)
+            except Exception as eek:
+                self.logger.warning(f"{work_rid}: BUDA volume lookup failed {type(eek).__name__} {eek}")
+                return None
+
+        with ThreadPoolExecutor(max_workers=BULK_CONCURRENCY) as lookups:
+            for work_rid, vol_info in zip(missing, lookups.map(lookup, missing)):
+                if vol_info is not None:
+                    vol_infos[work_rid] = vol_info
+        return vol_infos
+
+    @staticmethod
+    def query_buda(work_rid: str) -> []:
+        """
+        :param work_rid: work identifier
+        :return: the disk image group names of the work's volumes
+        """
         from lxml import etree
         from archive_ops.api import get_disk_ig_from_buda
+
         vol_info = []
+        response = buda_session().get(VOLUMES_FOR_INSTANCE_URL,
+                                      params={'R_RES': f'bdr:{work_rid}', 'format': 'xml'},
+                                      timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        rTree = etree.fromstring(response.content).getroottree()
+        rtRoot = rTree.getroot()
+
+        # There's a lot of churn about namespaces and xml, including discussion of lxml vs xml,
+        # but this works, using lxml
+        # Thanks to: https://izziswift.com/parsing-xml-with-namespace-in-python-via-elementtree/
+        for uri in rTree.findall('results/result/binding[@name="volid"]/uri', rtRoot.nsmap):
+            # the XML format returns the URI, not the bdr:Image group name, so that needs to be
+            # split out
+            uri_path: [] = uri.text.split(':')
+
+            # take the last thing
+            uri_path_nodes: str = uri_path[-1]
 
-        req = f'http://purl.bdrc.io/query/table/volumesForInstance?R_RES=bdr:{work_rid}&format=xml'
-        try:
-            with request.urlopen(req) as response:
-                rTree = etree.parse(response)
-                rtRoot = rTree.getroot()
-
-                # There's a lot of churn about namespaces and xml, including discussion of lxml vs xml,
-                # but this works, using lxml
-                # Thanks to: https://izziswift.com/parsing-xml-with-namespace-in-python-via-elementtree/
-                for uri in rTree.findall('results/result/binding[@name="volid"]/uri',rtRoot.nsmap):
-                    # the XML format returns the URI, not the bdr:Image group name, so that needs to be
-                    # split out
-                    uri_path:[] = uri.text.split(':')
-
-                    # take the last thing
-                    uri_path_nodes: str = uri_path[-1]
-
-                    # find the last node on the path
-                    image_group_name = uri_path_nodes.split('/')[-1]
-
-                    vol_info.append(get_disk_ig_from_buda(image_group_name))
-        # Swallow all exceptions.
-        except Exception as eek:
-            pass
-        finally:
-            pass
+            # find the last node on the path
+            image_group_name = uri_path_nodes.split('/')[-1]
 
+            vol_info.append(get_disk_ig_from_buda(image_group_name))
         return vol_info
@@ -0,0 +1,54 @@
+import json
+import sqlite3
+import threading
+import time
+
+# BUDA catalogs change rarely, and a stale entry only costs a rebuild with the previous image group list
+DEFAULT_TTL_SECONDS: int = 24 * 60 * 60
+
+
+class VolumeInfoCache:
+    """
+    Cache of each work's image group list, as VolumeInfoBUDA resolves it. Entries expire after
+    a time to live. The store is a SQLite file, which several processes and runs can share,
+    or, with the default ":memory:", a per process store.
+    """
+
+    def __init__(self, db_path: str = ":memory:", ttl_seconds: int = DEFAULT_TTL_SECONDS):
+        """
+        :param db_path: SQLite file. Created if it does not exist
+        :param ttl_seconds: age after which an entry is refetched
+        """
+        self._ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        # bulk lookups store from their worker threads
+        self._db = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        if db_path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS volumes (work TEXT PRIMARY KEY, data TEXT, fetched REAL)")
+        self._db.commit()
+
+    def get(self, work_rid: str) -> []:
+        """
+        :param work_rid: work identifier
+        :return: the work's image groups, or None if absent or expired
+        """
+        with self._lock:
+            row = self._db.execute("SELECT data, fetched FROM volumes WHERE work = ?", (work_rid,)).fetchone()
+        if row is None or time.time() - row[1] > self._ttl_seconds:
+            return None
+        return json.loads(row[0])
+
+    def put(self, work_rid: str, vol_info: []):
+        """
+        :param work_rid: work identifier
+        :param vol_info: the work's image groups
+        """
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO volumes (work, data, fetched) VALUES (?, ?, ?)",
+                             (work_rid, json.dumps(vol_info), time.time()))
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
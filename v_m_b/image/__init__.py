@@ -1,3 +1,8 @@
-from v_m_b.image.generateManifest import generateManifest_a, generateManifest_s, fillDataWithBlobImage
+from v_m_b.image.generateManifest import generateManifest_a, generateManifest_s, fillDataWithBlobImage, \
+    fillDataWithImageFile
+from v_m_b.image.formatSniffer import sniff_format, is_known_non_image, open_image
+from v_m_b.image.headerProbe import RangeReader, HEADER_PROBE_BYTES
+from v_m_b.image.reducedDecode import reduced_decode
 
-__all__ = ['fillDataWithBlobImage', 'generateManifest_a', 'generateManifest_s']
+__all__ = ['fillDataWithBlobImage', 'fillDataWithImageFile', 'generateManifest_a', 'generateManifest_s',
+           'RangeReader', 'HEADER_PROBE_BYTES', 'reduced_decode', 'sniff_format', 'is_known_non_image', 'open_image']
@@ -0,0 +1,63 @@
+"""
+Classifies scans as color, grayscale or black and white, from a small reduced decode of the image.
+The thresholds are those of the original detectgraynb experiment.
+"""
+from PIL import Image
+
+from v_m_b.image.reducedDecode import reduced_decode
+
+COLOR: str = "color"
+GRAYSCALE: str = "grayscale"
+BLACK_AND_WHITE: str = "blackandwhite"
+
+# side of the square thumbnail which is classified
+THUMB_SIZE: int = 100
+# mean squared distance of the pixels to gray, below which the image is not color
+MSE_CUTOFF: float = 50
+# mean distance of the pixels' value to black or white, below which a gray image is black and white
+MSE_BW_CUTOFF: float = 30
+
+
+def reduced_rgb(im: Image.Image, thumb_size: int = THUMB_SIZE) -> Image.Image:
+    """
+    :param im: open image, not yet loaded
+    :param thumb_size: side of the result
+    :return: thumb_size square RGB thumbnail, from a reduced decode
+    """
+    im = reduced_decode(im, (thumb_size, thumb_size), 'RGB')
+    if im.mode != 'RGB':
+        im = im.convert('RGB')
+    return im.resize((thumb_size, thumb_size))
+
+
+def classify_color(im: Image.Image, thumb_size: int = THUMB_SIZE, mse_cutoff: float = MSE_CUTOFF,
+                   mse_bw_cutoff: float = MSE_BW_CUTOFF, adjust_color_bias: bool = True) -> str:
+    """
+    :param im: open image. Decodes its pixels
+    :param thumb_size: side of the thumbnail which is classified
+    :param mse_cutoff: see MSE_CUTOFF
+    :param mse_bw_cutoff: see MSE_BW_CUTOFF
+    :param adjust_color_bias: discount a uniform color cast, such as yellowed paper, before measuring color
+    :return: COLOR, GRAYSCALE or BLACK_AND_WHITE
+    """
+    # numpy is only needed by this optional analysis
+    import numpy as np
+
+    if im.mode == '1':
+        return BLACK_AND_WHITE
+    pixels = np.asarray(reduced_rgb(im, thumb_size), dtype=np.float32).reshape(-1, 3)
+
+    bias = np.zeros(3, dtype=np.float32)
+    if adjust_color_bias:
+        channel_means = pixels.mean(axis=0)
+        bias = channel_means - channel_means.mean()
+    # distance of each pixel to its own gray level
+    deviation = pixels - pixels.mean(axis=1, keepdims=True) - bias
+    mse_gs = float(np.square(deviation).sum()) / len(pixels)
+    if mse_gs > mse_cutoff:
+        return COLOR
+
+    # HSV value is the largest channel
+    value = pixels.max(axis=1)
+    mse_bw = float(np.minimum(255 - value, value).sum()) / len(pixels)
+    return BLACK_AND_WHITE if mse_bw <= mse_bw_cutoff else GRAYSCALE
@@ -0,0 +1,75 @@
+"""
+Identifies images from their first bytes, so that PIL does not try its registered plugins one by one,
+and the first image does not pay for Image.init(), which imports all of them. Files known not to be
+images are recognized by their names, and never reach PIL.
+"""
+import os
+from typing import BinaryIO, Optional
+
+from PIL import Image
+
+IMG_JPG: str = 'JPEG'
+IMG_TIF: str = 'TIFF'
+
+# (magic bytes, PIL format) of the formats of BUDA_supported_file_exts
+MAGIC_BYTES: [(bytes, str)] = [(b'\xff\xd8\xff', IMG_JPG),
+                               (b'II*\x00', IMG_TIF),
+                               (b'MM\x00*', IMG_TIF),
+                               # BigTIFF
+                               (b'II+\x00', IMG_TIF),
+                               (b'MM\x00+', IMG_TIF)]
+SNIFF_BYTES: int = max(len(magic) for magic, _ in MAGIC_BYTES)
+
+# Files which image groups hold besides images: BUDA's file list, our manifests and desktop litter
+NON_IMAGE_FILE_NAMES: {str} = {'fileList.json', 'dimensions.json', '.DS_Store', 'Thumbs.db', 'desktop.ini'}
+NON_IMAGE_EXTENSIONS: {str} = {'.json', '.txt', '.xml', '.md5', '.csv', '.log', '.tmp'}
+
+# the "error" of manifest entries of known non-images
+NOT_AN_IMAGE: str = "NotAnImage"
+
+_plugins_loaded: bool = False
+
+
+def is_known_non_image(file_name: str) -> bool:
+    """
+    :param file_name: name of a file in an image group
+    :return: True if the name alone shows it is not an image
+    """
+    return file_name in NON_IMAGE_FILE_NAMES or file_name.startswith('._') \
+        or os.path.splitext(file_name)[1].lower() in NON_IMAGE_EXTENSIONS
+
+
+def sniff_format(head: bytes) -> Optional[str]:
+    """
+    :param head: the first SNIFF_BYTES of a file, or more
+    :return: PIL format name, if the file is one of the formats of MAGIC_BYTES, else None
+    """
+    return next((image_format for magic, image_format in MAGIC_BYTES if head.startswith(magic)), None)
+
+
+def load_plugins():
+    """
+    Imports only the plugins of the sniffed formats, the first time an image is opened rather than
+    at startup. Once they are registered, Image.open never needs Image.init()
+    """
+    global _plugins_loaded
+    if not _plugins_loaded:
+        from PIL import JpegImagePlugin, TiffImagePlugin
+        _plugins_loaded = True
+
+
+def open_image(blob: BinaryIO) -> Image.Image:
+    """
+    Image.open, restricted to the sniffed format's plugin. Files of other formats go through all of
+    PIL's plugins, as before.
+    :param blob: seekable binary file object, at any position: buffers filled by a download are at their end
+    :return: the open image
+    :raises PIL.UnidentifiedImageError: when the file cannot be read
+    """
+    blob.seek(0)
+    image_format: Optional[str] = sniff_format(blob.read(SNIFF_BYTES))
+    blob.seek(0)
+    if image_format is None:
+        return Image.open(blob)
+    load_plugins()
+    return Image.open(blob, formats=[image_format])
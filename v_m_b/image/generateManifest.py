@@ -1,16 +1,22 @@
 # downloading region
+import asyncio
 import io
 import logging
+import os
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from pathlib import PurePath, Path
 
 import PIL
 import aiofiles
-from PIL import Image
 
+from v_m_b.image.colorClass import classify_color
+from v_m_b.image.formatSniffer import IMG_JPG, IMG_TIF, NOT_AN_IMAGE, is_known_non_image, open_image
+from v_m_b.image.headerProbe import RangeReader, file_range_fetcher
+from v_m_b.stageMetrics import metrics
 
-IMG_JPG='JPEG'
-IMG_TIF='TIFF'
 JPG_EXT= 'JPG'
 TIF_EXT= 'TIF'
 
@@ -20,6 +26,9 @@ TIF_EXT= 'TIF'
 # to those lists
 BUDA_supported_file_exts: {} = {IMG_JPG : [IMG_JPG, JPG_EXT], IMG_TIF :[IMG_TIF, TIF_EXT]}
 
+# How many files generateManifest_a reads together
+DEFAULT_FS_CONCURRENCY: int = 10
+
 
 def is_BUDA_Matching_file_ext(file_name: str, image_data_format: str) -> bool:
     """
@@ -44,53 +53,138 @@ def is_BUDA_Matching_file_ext(file_name: str, image_data_format: str) -> bool:
     return len(matches) > 0
 
 
-async def generateManifest_a(ig_container: PurePath) -> []:
+def fillDataFromCache(cache, image_file: os.DirEntry, imgdata: dict, colorclass: bool = False) -> bool:
+    """
+    :param cache: DimensionCache, or None
+    :param image_file: image
+    :param imgdata: filled in on a cache hit
+    :param colorclass: only hit entries which have a "colorclass"
+    :return: true on a cache hit
+    """
+    if cache is None:
+        return False
+    image_stat = image_file.stat()
+    cached: dict = cache.get(image_file.path, image_stat.st_size, str(image_stat.st_mtime_ns),
+                             cached_fields(colorclass))
+    if cached is None:
+        return False
+    imgdata.update(cached)
+    return True
+
+
+def skipNonImage(imgdata: dict) -> bool:
+    """
+    Marks a file which its name shows is not an image, before anything reads it
+    :param imgdata: manifest entry. Must have a "filename" entry
+    :return: True if the file is not an image. Its entry then has an "error", and clean_manifest drops it
+    """
+    if is_known_non_image(imgdata["filename"]):
+        imgdata["error"] = NOT_AN_IMAGE
+        return True
+    return False
+
+
+def cached_fields(colorclass: bool) -> [str]:
+    """
+    :param colorclass: the "colorclass" entry is wanted
+    :return: the optional entries a cached image data must have
+    """
+    return ["colorclass"] if colorclass else []
+
+
+def storeDataInCache(cache, image_file: os.DirEntry, imgdata: dict):
+    """
+    Caches an image's data, unless there is no cache, or the image had an error
+    """
+    if cache is None or "error" in imgdata:
+        return
+    image_stat = image_file.stat()
+    cache.put(image_file.path, image_stat.st_size, str(image_stat.st_mtime_ns), imgdata)
+
+
+async def generateManifest_a(ig_container: PurePath, header_probe: bool = True,
+                             max_concurrency: int = DEFAULT_FS_CONCURRENCY, cache=None,
+                             colorclass: bool = False, pool: ThreadPoolExecutor = None) -> []:
     """
     this actually generates the manifest. See example in the repo. The example corresponds to W22084, image group I0886.
+    Up to max_concurrency files are read together. All the blocking work, opening and reading files
+    and PIL parsing, runs in a thread pool, so the event loop only schedules.
     :param ig_container: path of parent of image group
-    :param image_list: list of image names
+    :param header_probe: read only the image headers, not the whole file
+    :param max_concurrency: number of files in flight together
+    :param cache: DimensionCache to consult before opening an image
+    :param colorclass: add each image's "colorclass". See fillDataWithBlobImage
+    :param pool: thread pool for the blocking work, with at least max_concurrency threads. When None,
+    one is created for this image group
     :returns: list of  internal data for each file in image_list
     """
+    loop = asyncio.get_running_loop()
+    throttle = asyncio.Semaphore(max_concurrency)
+
+    async def one_image(image_file: os.DirEntry, imgdata: dict, pool: ThreadPoolExecutor):
+        async with throttle:
+            try:
+                if skipNonImage(imgdata) \
+                        or await loop.run_in_executor(pool, fillDataFromCache, cache, image_file, imgdata, colorclass):
+                    return
+                if header_probe:
+                    await loop.run_in_executor(pool, fillDataWithImageFile, image_file.path, imgdata, None,
+                                               colorclass)
+                else:
+                    # extracted from fillData
+                    with metrics.timed('fetch') as fetched:
+                        async with aiofiles.open(image_file.path, "rb", executor=pool) as image_io:
+                            image_buffer: bytes = await image_io.read()
+                        fetched['bytes'] = len(image_buffer)
+                    await loop.run_in_executor(pool, fillDataWithBlobImage, io.BytesIO(image_buffer), imgdata, None,
+                                               colorclass)
+                await loop.run_in_executor(pool, storeDataInCache, cache, image_file, imgdata)
+            except:
+                si = sys.exc_info()
+                logging.error(f"processing {image_file.path} async file processing {si[0]} {si[1]} ")
+
     res: [] = []
-    import os
-    for image_file in os.scandir(ig_container):
-        if not image_file.is_file():
-            continue
-        try:
+    tasks: [] = []
+    with (ThreadPoolExecutor(max_workers=max_concurrency) if pool is None else nullcontext(pool)) as pool:
+        with metrics.timed('listing'):
+            image_files: [os.DirEntry] = await loop.run_in_executor(pool, list_image_files, ig_container)
+        for image_file in image_files:
             imgdata = {"filename": image_file.name}
             res.append(imgdata)
-            # extracted from fillData
-            async with aiofiles.open(image_file.path, "rb") as image_io:
-                image_buffer: bytes = await image_io.read()
-                bio: io.BytesIO = io.BytesIO(image_buffer)
-                fillDataWithBlobImage(bio, imgdata)
-        except:
-            si = sys.exc_info()
-            logging.error(f"processing {image_file.path} async file processing {si[0]} {si[1]} ")
+            tasks.append(one_image(image_file, imgdata, pool))
+        await asyncio.gather(*tasks)
     return res
 
 
-def generateManifest_s(ig_container: PurePath) -> []:
+def generateManifest_s(ig_container: PurePath, header_probe: bool = True, cache=None, colorclass: bool = False) -> []:
     """
     this actually generates the manifest. See example in the repo. The example corresponds to W22084, image group I0886.
     :param ig_container: path of parent of image group
-    :param image_list: list of image names
+    :param header_probe: read only the image headers, not the whole file
+    :param cache: DimensionCache to consult before opening an image
+    :param colorclass: add each image's "colorclass". See fillDataWithBlobImage
     :returns: list of  internal data for each file in image_list
     """
 
     res: [] = []
-    import os
-    for image_file in os.scandir(ig_container):
-        if not image_file.is_file():
-            continue
+    with metrics.timed('listing'):
+        image_files: [os.DirEntry] = list_image_files(ig_container)
+    for image_file in image_files:
         try:
             imgdata = {"filename": image_file.name}
             res.append(imgdata)
-            # extracted from fillData
-            with open(str(image_file.path), "rb") as image_io:
-                image_buffer = image_io.read()
-                # image_buffer = io.BytesIO(image_io.read())
-                fillDataWithBlobImage(io.BytesIO(image_buffer), imgdata)
+            if skipNonImage(imgdata) or fillDataFromCache(cache, image_file, imgdata, colorclass):
+                continue
+            if header_probe:
+                fillDataWithImageFile(image_file.path, imgdata, image_file.stat().st_size, colorclass)
+            else:
+                # extracted from fillData
+                with metrics.timed('fetch') as fetched, open(str(image_file.path), "rb") as image_io:
+                    image_buffer = image_io.read()
+                    fetched['bytes'] = len(image_buffer)
+                    # image_buffer = io.BytesIO(image_io.read())
+                    fillDataWithBlobImage(io.BytesIO(image_buffer), imgdata, colorclass=colorclass)
+            storeDataInCache(cache, image_file, imgdata)
         except:
             si = sys.exc_info()
             logging.error(f"processing {image_file.path} async file processing {si[0]} {si[1]} ")
@@ -98,7 +192,43 @@ def generateManifest_s(ig_container: PurePath) -> []:
 
 
 
-def fillDataWithBlobImage(blob: io.BytesIO, data: dict):
+def list_image_files(ig_container: PurePath) -> [os.DirEntry]:
+    """
+    :param ig_container: path of parent of image group
+    :return: the files of the image group
+    """
+    return [x for x in os.scandir(ig_container) if x.is_file()]
+
+
+def fillDataWithImageFile(image_path: str, data: dict, size: int = None, colorclass: bool = False):
+    """
+    Header probing version of reading an image file into fillDataWithBlobImage:
+    only the blocks PIL reads to identify the image are read from disk.
+    :param image_path: path to the image file
+    :param data: dict to populate. Must have a "filename" entry
+    :param size: file size, in bytes. When None, the open file's
+    :param colorclass: see fillDataWithBlobImage
+    """
+    with open(image_path, "rb", buffering=0) as image_io:
+        if size is None:
+            size = os.fstat(image_io.fileno()).st_size
+        fillDataWithBlobImage(RangeReader(file_range_fetcher(image_io), size), data, size, colorclass)
+
+
+def blob_size(blob) -> int:
+    """
+    :param blob: seekable binary file object
+    :return: its size, in bytes
+    """
+    if isinstance(blob, io.BytesIO):
+        return blob.getbuffer().nbytes
+    here = blob.tell()
+    size = blob.seek(0, io.SEEK_END)
+    blob.seek(here)
+    return size
+
+
+def fillDataWithBlobImage(blob: io.BytesIO, data: dict, size: int = None, colorclass: bool = False):
     """
     This function populates a dict containing image data about an image
     the image is the binary blob returned by s3, an image library should be used to treat it
@@ -111,10 +241,22 @@ def fillDataWithBlobImage(blob: io.BytesIO, data: dict):
     https://docs.oracle.com/javase/8/docs/api/java/awt/image/BufferedImage.html
 
     but they should be enough. Note that there's no 16 bit
+
+    blob need not hold the whole image: any seekable binary file object will do, such as a
+    headerProbe.RangeReader, since only the image header is read.
+    :param size: size of the whole image, when blob does not hold it all
+    :param colorclass: also decode a reduced version of the image, to add its "colorclass":
+    "color", "grayscale" or "blackandwhite". Reads the whole image. Requires numpy
     """
-    size = blob.getbuffer().nbytes
+    if skipNonImage(data):
+        return
+    if size is None:
+        size = blob_size(blob)
+    # fetches PIL triggers through a RangeReader are the fetch stage's
+    tick = time.perf_counter()
+    fetch_seconds: float = getattr(blob, 'fetch_seconds', 0.0)
     try:
-        im = Image.open(blob)
+        im = open_image(blob)
         data["width"] = im.width
         data["height"] = im.height
 
@@ -132,8 +274,16 @@ def fillDataWithBlobImage(blob: io.BytesIO, data: dict):
         # we indicate sizes of the more than 1MB
         if size > 1000000:
             data["size"] = size
+
+        if colorclass:
+            try:
+                data["colorclass"] = classify_color(im)
+            except Exception as e:
+                # the dimensions are still good
+                logging.warning(f"{data['filename']}: no colorclass {type(e).__name__} {e}")
     except PIL.UnidentifiedImageError:
         data["error"] = "UnidentifiedImageError"
     except Exception as e:
         data["error"] = f"Exception {e}"
+    metrics.record('parse', time.perf_counter() - tick - (getattr(blob, 'fetch_seconds', 0.0) - fetch_seconds))
 # end region
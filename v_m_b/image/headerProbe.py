@@ -0,0 +1,140 @@
+"""
+Header probing support. Image dimensions, format, compression and resolution all
+live in the first few KB of a JPEG or TIFF, so instead of fetching the whole image,
+we hand PIL a file object which only fetches the byte ranges PIL actually reads.
+"""
+import io
+import time
+from typing import Callable
+
+from v_m_b.stageMetrics import metrics
+
+KB = 1024
+
+# Size of the first fetch, and of each later one. Large enough to hold the header
+# of almost every JPEG and TIFF we have, small enough to be cheap.
+HEADER_PROBE_BYTES: int = 64 * KB
+
+
+class RangeReader(io.RawIOBase):
+    """
+    Read only, seekable file object over a source which is read in byte ranges.
+    The first read fetches a prefix of the source. Reads which fall outside what has
+    already been fetched (a TIFF whose IFD sits at the end of the file, a JPEG with a large
+    EXIF or ICC block before its SOF) fetch only the blocks they need.
+    """
+
+    def __init__(self, fetch: Callable[[int, int], bytes], size: int, block_size: int = HEADER_PROBE_BYTES,
+                 prefix: bytes = None):
+        """
+        :param fetch: fetch(start, end) returns the bytes from start to end, inclusive
+        :param size: total size of the source, in bytes. Reads raise IOError if the source turns out shorter
+        :param block_size: unit of fetching
+        :param prefix: the first bytes of the source, when the caller has already fetched them
+        """
+        super(RangeReader, self).__init__()
+        self._fetch = fetch
+        self._size = size
+        self._block_size = block_size
+        self._blocks: {} = {}
+        self._pos = 0
+        self.bytes_fetched = 0
+        self.fetch_count = 0
+        self.fetch_seconds = 0.0
+        if prefix:
+            # only whole blocks, or the whole source, are usable
+            usable = len(prefix) if len(prefix) >= size else len(prefix) - len(prefix) % block_size
+            for block_no in range(usable // block_size + (1 if usable % block_size else 0)):
+                self._blocks[block_no] = prefix[block_no * block_size:min((block_no + 1) * block_size, usable)]
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            new_pos = offset
+        elif whence == io.SEEK_CUR:
+            new_pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            new_pos = self._size + offset
+        else:
+            raise ValueError(f"invalid whence {whence}")
+        if new_pos < 0:
+            raise ValueError(f"negative seek position {new_pos}")
+        self._pos = new_pos
+        return self._pos
+
+    def readinto(self, b) -> int:
+        want = min(len(b), self._size - self._pos)
+        if want <= 0:
+            return 0
+        first_block: int = self._pos // self._block_size
+        last_block: int = (self._pos + want - 1) // self._block_size
+        self._load_blocks(first_block, last_block)
+
+        view = memoryview(b)
+        copied = 0
+        while copied < want:
+            block_no, block_offset = divmod(self._pos, self._block_size)
+            block: bytes = self._blocks[block_no]
+            n = min(want - copied, len(block) - block_offset)
+            if n <= 0:
+                raise IOError(f"source ends at {self._pos}, before its size {self._size}")
+            view[copied:copied + n] = block[block_offset:block_offset + n]
+            copied += n
+            self._pos += n
+        return copied
+
+    def _load_blocks(self, first_block: int, last_block: int):
+        """
+        Fetch the missing blocks in [first_block, last_block], coalescing each run of
+        adjacent missing blocks into one fetch
+        """
+        block_no = first_block
+        while block_no <= last_block:
+            if block_no in self._blocks:
+                block_no += 1
+                continue
+            run_end = block_no
+            while run_end + 1 <= last_block and run_end + 1 not in self._blocks:
+                run_end += 1
+            start = block_no * self._block_size
+            end = min((run_end + 1) * self._block_size, self._size) - 1
+            tick = time.perf_counter()
+            data: bytes = self._fetch(start, end)
+            elapsed = time.perf_counter() - tick
+            metrics.record('fetch', elapsed, len(data))
+            self.fetch_count += 1
+            self.bytes_fetched += len(data)
+            self.fetch_seconds += elapsed
+            if len(data) < end - start + 1:
+                # the source changed since its size was taken: a listing or a stat
+                raise IOError(f"fetching bytes {start}-{end} returned {len(data)} bytes: the source is shorter "
+                              f"than its size {self._size}")
+            for i in range(block_no, run_end + 1):
+                offset = (i - block_no) * self._block_size
+                self._blocks[i] = data[offset:offset + self._block_size]
+            block_no = run_end + 1
+
+
+def file_range_fetcher(file_io) -> Callable[[int, int], bytes]:
+    """
+    :param file_io: open, seekable binary file
+    :return: a RangeReader fetch function over the file
+    """
+
+    def fetch(start: int, end: int) -> bytes:
+        file_io.seek(start)
+        return file_io.read(end - start + 1)
+
+    return fetch
@@ -0,0 +1,52 @@
+"""
+Reduced decoding, for pixel level analyses (gray detection, blank page detection, thumbnail hashes)
+which only need a small raster. Decoding a full multi megapixel scan for these costs far more than
+the analysis. Dimensions and the other manifest entries come from the header alone, and must never
+go through here.
+"""
+from PIL import Image
+
+# NewSubfileType bit of a TIFF reduced resolution version of another image in the file
+TIFF_REDUCED_RESOLUTION: int = 1
+TIFF_NEW_SUBFILE_TYPE: int = 254
+
+
+def reduced_decode(im: Image.Image, min_size: (int, int), mode: str = None) -> Image.Image:
+    """
+    Decodes an image at the smallest scale its format makes cheap, which is still at least min_size:
+    - JPEG: DCT scaling, which decodes at 1/2, 1/4 or 1/8 scale
+    - TIFF: the smallest reduced resolution subfile (pyramid level) the file contains, if any
+    The result is then reduced by an integer factor, to at most about twice min_size.
+    :param im: open image, not yet loaded. Its frame may change
+    :param min_size: (width, height) the analysis needs. Images smaller than this are decoded whole
+    :param mode: JPEG only: decode straight into this mode, such as 'L' or 'RGB'
+    :return: the decoded image. Its size is not im's original size
+    """
+    if im.format == 'JPEG':
+        im.draft(mode, min_size)
+    elif im.format == 'TIFF' and getattr(im, 'n_frames', 1) > 1:
+        seek_reduced_tiff_frame(im, min_size)
+
+    factor = min(im.width // min_size[0], im.height // min_size[1])
+    if factor > 1:
+        return im.reduce(factor)
+    im.load()
+    return im
+
+
+def seek_reduced_tiff_frame(im: Image.Image, min_size: (int, int)):
+    """
+    Moves a TIFF to its smallest reduced resolution frame of at least min_size, or back to its first frame.
+    Only IFDs are read.
+    :param im: open TIFF
+    :param min_size: (width, height)
+    """
+    best_frame: int = 0
+    best_area: int = im.width * im.height
+    for frame in range(1, im.n_frames):
+        im.seek(frame)
+        if not im.tag_v2.get(TIFF_NEW_SUBFILE_TYPE, 0) & TIFF_REDUCED_RESOLUTION:
+            continue
+        if min_size[0] <= im.width and min_size[1] <= im.height and im.width * im.height < best_area:
+            best_frame, best_area = frame, im.width * im.height
+    im.seek(best_frame)
@@ -1,16 +1,31 @@
 """
-shell for manifest builder
+shell for manifest builder, and ManifestBuilder, its interface for programs
 """
-import json
-
+import logging
+import os
+import signal
 import sys
+import threading
 import time
 import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.util import Finalize
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, NamedTuple, Optional, TYPE_CHECKING
 
 # from manifestCommons import prolog, getVolumeInfos, gzip_str, VMT_BUDABOM
 import v_m_b.manifestCommons as Common
-from util_lib.AOLogger import AOLogger
 from v_m_b.ImageRepository.ImageRepositoryBase import ImageRepositoryBase
+from v_m_b.VolumeInfo.VolumeInfoCache import VolumeInfoCache
+from v_m_b.stageMetrics import metrics
+from v_m_b.volumeProfiler import SamplingProfiler
+from v_m_b.workScheduling import stable_shard, balanced_shards, largest_first
+
+if TYPE_CHECKING:
+    # it imports boto3. Common.prolog imports it when it is needed
+    from util_lib.AOLogger import AOLogger
 
 MANIFEST_OBJECT_ = """
     inspire from:
@@ -32,11 +47,122 @@ USE_RETURN_ = """
     :param image_group: Specific image group to process
     :param repo: Repository to use
     :param logger: logger to use
+    :param skip_if_current: do nothing if the image group's manifest is newer than all its images
+    :param gzip_level: gzip compression level of the manifest
     :return:
     """
 
 image_repo: ImageRepositoryBase
-shell_logger: AOLogger
+shell_logger: 'AOLogger'
+# incremental mode: skip image groups whose manifest is newer than all their images
+skip_current: bool = False
+# gzip level of the manifests
+compress_level: int = Common.DEFAULT_COMPRESS_LEVEL
+# number of works whose image groups are looked up while an earlier work builds
+VOLUME_INFO_LOOKAHEAD: int = 8
+# longest wait, in seconds, between polls of manifestFromS3 after failures
+MAX_POLL_BACKOFF: int = 3600
+
+
+class VolumeResult(NamedTuple):
+    """
+    Outcome of building one image group's manifest. Worker processes send these back
+    to the parent, which decides if all went well.
+    """
+    work_rid: str
+    image_group: Optional[str]
+    success: bool
+    message: str = ""
+    # the worker's stage metrics since its previous result
+    metrics: Optional[dict] = None
+    # time spent on the image group, including its upload
+    seconds: float = 0.0
+
+
+class ManifestBuilder:
+    """
+    Entry point for programs which build many works in one long running process, such as workflow
+    orchestrators. Unlike manifestShell and doOneManifest, it reads no command line and no module
+    global: one warm builder, with its repository and its image group lookups, serves every call.
+    Stage metrics still go to the process's stageMetrics.metrics.
+    """
+
+    def __init__(self, repo: ImageRepositoryBase, logger=None, skip_current: bool = False,
+                 compress_level: int = Common.DEFAULT_COMPRESS_LEVEL, volume_info_cache: VolumeInfoCache = None,
+                 lookahead: int = VOLUME_INFO_LOOKAHEAD):
+        """
+        :param repo: source of the images, and destination of the manifests. The caller closes it
+        :param logger: logging.Logger or AOLogger. Defaults to this module's logger
+        :param skip_current: skip image groups whose manifest is newer than all their images
+        :param compress_level: gzip level of the manifests
+        :param volume_info_cache: image group lookups. Defaults to one in memory, which lives as long as the builder
+        :param lookahead: number of works whose image groups are looked up while an earlier work builds
+        """
+        self._repo = repo
+        self._logger = logger if logger is not None else logging.getLogger(__name__)
+        self._skip_current = skip_current
+        self._compress_level = compress_level
+        self._owns_cache = volume_info_cache is None
+        self._volume_info_cache = volume_info_cache if volume_info_cache is not None else VolumeInfoCache()
+        self._lookahead = lookahead
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        Releases the image group lookups, unless the caller gave them
+        """
+        if self._owns_cache:
+            self._volume_info_cache.close()
+
+    def image_groups(self, work_rid: str) -> [str]:
+        """
+        :param work_rid: work identifier
+        :return: the work's image groups. Throws if they cannot be looked up
+        """
+        return Common.getVolumeInfos(work_rid, self._repo, self._volume_info_cache)
+
+    def build_volume(self, work_rid: str, image_group: str) -> VolumeResult:
+        """
+        Builds and uploads one image group's manifest
+        :return: its outcome. Never throws
+        """
+        tick = time.monotonic()
+        try:
+            upload_volume(work_rid, image_group, self._repo, self._logger, self._skip_current, self._compress_level)
+            return VolumeResult(work_rid, image_group, True, seconds=time.monotonic() - tick)
+        except Exception as inst:
+            self._logger.error(f"{work_rid} failed to build manifest {exception_summary(inst)}")
+            return VolumeResult(work_rid, image_group, False, exception_summary(inst),
+                                seconds=time.monotonic() - tick)
+
+    def build(self, works: Iterable) -> Iterator[VolumeResult]:
+        """
+        Builds the manifests of works, one image group at a time, looking up the image groups of the
+        next works meanwhile
+        :param works: (work, image groups) pairs. Image groups None means all of the work's. Can be a generator
+        :return: generator of one VolumeResult per image group, in order. A work whose image groups cannot
+        be found gets one failed VolumeResult, whose image_group is None. Never throws
+        """
+
+        def lookup(work: (str, [str])) -> []:
+            work_rid, named_image_groups = work
+            return named_image_groups if named_image_groups is not None else self.image_groups(work_rid)
+
+        for (work_rid, named_image_groups), vol_infos in pipelined(works, lookup, self._lookahead):
+            if isinstance(vol_infos, Exception):
+                self._logger.error(f"{work_rid} image groups not found {vol_infos}")
+                yield VolumeResult(work_rid, None, False, f"{type(vol_infos)} {vol_infos}")
+            elif len(vol_infos) == 0:
+                self._logger.error(f"Could not find image groups for {work_rid}")
+                yield VolumeResult(work_rid, None, False, "Could not find image groups")
+            else:
+                for vi in vol_infos:
+                    yield self.build_volume(work_rid, vi)
 
 
 def manifestShell():
@@ -44,17 +170,39 @@ def manifestShell():
     Prepares args for running using command line or file system input
     :return:
     """
-    global image_repo, shell_logger
+    global image_repo, shell_logger, skip_current, compress_level
     args, image_repo, shell_logger = Common.prolog()
+    skip_current = Common.skips_current(args)
+    compress_level = args.compress_level
 
 
     # sanity check specific to fs args: -w or -f has to be given
     if args.work_list_file is None and args.work_rid is None:
         raise ValueError("Error: in fs mode, one of -w/--work_rid or -f/--work_list_file must be given")
 
-    all_well = manifestForList(args.work_list_file) \
-        if args.work_list_file is not None \
-        else doOneManifest(args.work_rid, args.image_group)
+    if args.profile and (args.work_rid is None or args.jobs > 1 or args.shard is not None):
+        raise ValueError("Error: --profile builds one work in this process: give -w/--work_rid, without -j or --shard")
+
+    work_rids: [str] = read_work_list(args.work_list_file) if args.work_list_file is not None else [args.work_rid]
+    if args.shard is not None:
+        works: [(str, [str])] = shard_works(work_rids, args.image_group, args.shard,
+                                            args.shard_by == 'image-group', args.shard_balance)
+        shell_logger.info(f"shard {args.shard[0]}/{args.shard[1]}: {len(works)} of {len(work_rids)} works")
+    else:
+        works: [(str, [str])] = [(work_rid, args.image_group) for work_rid in work_rids]
+
+    try:
+        if args.profile:
+            all_well = profileOneManifest(args.work_rid, args.image_group)
+        elif args.jobs > 1:
+            all_well = manifestInParallel(works, Common.repository_settings(args), args.jobs, args.parallel_works)
+        else:
+            all_well = True
+            for work_rid, image_groups in with_volume_infos(works):
+                all_well &= doOneManifest(work_rid, image_groups)
+    finally:
+        image_repo.close()
+    Common.write_metrics(args)
     if not all_well:
         error_string = f"Some builds failed. See log file {shell_logger.log_file_name}"
         print(error_string)
@@ -62,6 +210,140 @@ def manifestShell():
         raise Exception(error_string)
 
 
+def profileOneManifest(work_rid: str, named_image_groups: [str] = None) -> bool:
+    """
+    doOneManifest, under a SamplingProfiler. Logs the time spent in each profile section, and writes
+    the sampled stacks, for a flame graph, in the log's folder.
+    :param work_rid: work, or path to the work in fs mode
+    :param named_image_groups: image groups to process. When None, all the work's image groups.
+    :return: doOneManifest's result
+    """
+    global shell_logger
+
+    with SamplingProfiler() as profiler:
+        all_well: bool = doOneManifest(work_rid, named_image_groups)
+
+    label: str = "-".join([os.path.basename(work_rid)] + (named_image_groups or []))
+    folded_path: Path = profiler.write_folded(Path(shell_logger.log_file_name).parent /
+                                              f"profile-{label}-{time.strftime('%Y%m%d-%H%M%S')}.folded")
+    shell_logger.info(f"profile {label}: {profiler.one_line()}")
+    shell_logger.info(f"profile {label}: flame graph stacks in {folded_path}")
+    return all_well
+
+
+def manifestFromS3():
+    """
+    Resident service: polls the S3 todo folder for work list files, claims them, builds
+    the manifests of their works, and marks them done. One process, one repository and,
+    with -j/--jobs, one worker pool serve every poll. SIGTERM stops polling after the current work list.
+    :return:
+    """
+    global image_repo, shell_logger, skip_current, compress_level
+    args, image_repo, shell_logger = Common.prolog()
+    skip_current = Common.skips_current(args)
+    compress_level = args.compress_level
+
+    if args.REPO_CHOICE != 's3':
+        raise ValueError("Error: manifestFromS3 only supports s3 mode")
+
+    stop_polling = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_polling.set())
+
+    import boto3
+    list_client = boto3.session.Session(region_name='us-east-1').client('s3')
+    try:
+        pollS3WorkLists(list_client, args, stop_polling)
+    finally:
+        image_repo.close()
+    shell_logger.info("manifestFromS3 stopped")
+
+
+def pollS3WorkLists(list_client, args: object, stop_polling: threading.Event):
+    """
+    manifestFromS3's loop: builds the work lists of each poll, and waits poll_interval when there are none.
+    A failed poll or work list is logged, and the next poll waits twice as long as the previous one,
+    up to MAX_POLL_BACKOFF. A work list which failed goes back to the to do folder, see manifestForS3WorkList.
+    A broken worker pool is replaced.
+    :param list_client: S3 client
+    :param args: parsed command line
+    :param stop_polling: set to stop after the current work list
+    """
+    global shell_logger
+    repo_settings: Optional[dict] = Common.repository_settings(args) if args.jobs > 1 else None
+    pool: Optional[ProcessPoolExecutor] = worker_pool(repo_settings, args.jobs) if args.jobs > 1 else None
+    # polls in a row which failed
+    failures: int = 0
+    try:
+        while not stop_polling.is_set():
+            failed: bool = False
+            try:
+                work_list_names: [str] = Common.buildWorkListFromS3(list_client)
+            except Exception as inst:
+                shell_logger.error(f"Polling the work lists failed {exception_summary(inst)}")
+                work_list_names, failed = [], True
+            for work_list_name in work_list_names:
+                try:
+                    manifestForS3WorkList(list_client, work_list_name, pool, args.parallel_works)
+                except BrokenProcessPool as inst:
+                    shell_logger.error(f"{work_list_name}: worker pool broken, replacing it {exception_summary(inst)}")
+                    pool.shutdown(wait=False)
+                    pool = worker_pool(repo_settings, args.jobs)
+                    failed = True
+                except Exception as inst:
+                    shell_logger.error(f"{work_list_name} failed {exception_summary(inst)}")
+                    failed = True
+                Common.write_metrics(args)
+                if stop_polling.is_set():
+                    break
+            failures = failures + 1 if failed else 0
+            if failed:
+                stop_polling.wait(min(args.poll_interval * 2 ** failures, max(MAX_POLL_BACKOFF, args.poll_interval)))
+            elif len(work_list_names) == 0:
+                stop_polling.wait(args.poll_interval)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+
+def manifestForS3WorkList(client, work_list_name: str, pool: Optional[ProcessPoolExecutor],
+                          by_work: bool = False) -> bool:
+    """
+    Builds the manifests of the works in one claimed work list file, then marks it done. When a build
+    fails, or the list cannot be processed, the list goes back to the to do folder instead, for another
+    poll, by any instance, to retry. A list whose process dies stays in the in process folder.
+    :param client: S3 client
+    :param work_list_name: file name in the in process folder
+    :param pool: worker_pool(), or None to build in this process
+    :param by_work: give each worker whole works, rather than image groups
+    :return: True if every image group succeeded
+    """
+    global shell_logger
+
+    try:
+        work_list_object = client.get_object(Bucket=Common.S3_MANIFEST_WORK_LIST_BUCKET,
+                                             Key=f"{Common.processing_prefix}{work_list_name}")
+        work_rids: [str] = [x.strip() for x in work_list_object['Body'].read().decode().splitlines() if x.strip()]
+        shell_logger.info(f"{work_list_name}: {len(work_rids)} works")
+
+        if pool is not None:
+            all_well = manifestInPool(pool, [(work_rid, None) for work_rid in work_rids], by_work)
+        else:
+            all_well = True
+            for work_rid, image_groups in with_volume_infos([(work_rid, None) for work_rid in work_rids]):
+                all_well &= doOneManifest(work_rid, image_groups)
+    except Exception:
+        Common.work_manager().mark_failed([work_list_name])
+        raise
+
+    if all_well:
+        Common.work_manager().mark_done([work_list_name], [work_list_name])
+    else:
+        shell_logger.error(f"Some builds in {work_list_name} failed, returning it to the to do folder. "
+                           f"See log file {shell_logger.log_file_name}")
+        Common.work_manager().mark_failed([work_list_name])
+    return all_well
+
+
 def manifestForList(sourceFile) -> bool:
     """
     reads a file containing a list of work RIDs and iterate the manifestForWork function on each.
@@ -77,20 +359,289 @@ def manifestForList(sourceFile) -> bool:
                          "See manifestforwork -h")
 
     all_well: bool = True
+    for work_rid, image_groups in with_volume_infos([(work_rid, None) for work_rid in read_work_list(sourceFile)]):
+        all_well &= doOneManifest(work_rid, image_groups)
+    return all_well
+
+
+def with_volume_infos(works: [(str, [str])], lookahead: int = VOLUME_INFO_LOOKAHEAD):
+    """
+    Pipelines image group lookups with builds: while the caller builds one work, threads look up
+    the image groups of the next lookahead works, so BUDA's latency overlaps with image reads.
+    :param works: works, each with the image groups to process, or None for all
+    :param lookahead: number of lookups in flight
+    :return: generator of each work, in order, with its image groups. These are None when the lookup
+    failed: doOneManifest then looks them up again, and reports the failure.
+    """
+    global image_repo
+
+    def lookup(work: (str, [str])) -> []:
+        work_rid, named_image_groups = work
+        return named_image_groups if named_image_groups is not None else Common.getVolumeInfos(work_rid, image_repo)
+
+    for (work_rid, named_image_groups), vol_infos in pipelined(works, lookup, lookahead):
+        yield work_rid, None if isinstance(vol_infos, Exception) else vol_infos
+
+
+def pipelined(items: Iterable, fn: Callable, lookahead: int) -> Iterator:
+    """
+    Runs fn on the next lookahead items in threads, while the caller handles the current one
+    :param items: any iterable, which is consumed lookahead items ahead of the caller
+    :param fn: function of one item
+    :param lookahead: number of calls in flight
+    :return: generator of (item, fn(item)), in items order. When fn raises, its exception takes the place of its result
+    """
+    item_iter = iter(items)
+    no_more = object()
+    with ThreadPoolExecutor(max_workers=lookahead) as calls:
+        in_flight: deque = deque()
+        for item in item_iter:
+            in_flight.append((item, calls.submit(fn, item)))
+            if len(in_flight) == lookahead:
+                break
+        while len(in_flight) > 0:
+            item, future = in_flight.popleft()
+            next_item = next(item_iter, no_more)
+            if next_item is not no_more:
+                in_flight.append((next_item, calls.submit(fn, next_item)))
+            yield item, future.exception() or future.result()
+
+
+def read_work_list(sourceFile) -> [str]:
+    """
+    :param sourceFile: Openable object of input text, one work RID per line
+    :return: the work RIDs
+    """
     with sourceFile as f:
-        for work_rid in f.readlines():
-            work_rid = work_rid.strip()
-            all_well &= doOneManifest(work_rid)
+        return [work_rid.strip() for work_rid in f.readlines()]
+
+
+def shard_works(work_rids: [str], named_image_groups: [str], shard: (int, int), by_image_group: bool = False,
+                balance: bool = False) -> [(str, [str])]:
+    """
+    Selects this node's share of a work list. Every node given the same work list, and seeing the same
+    repository, selects a disjoint share, and together they cover the list.
+    :param work_rids: the whole work list
+    :param named_image_groups: image groups to process. When None, all the work's image groups.
+    :param shard: (i, N): this node's share, and the number of shares
+    :param by_image_group: share out image groups, rather than whole works
+    :param balance: balance the shares' image counts, which a listing pass of every image group gives,
+    rather than hash the works or image groups to shares
+    :return: this node's works, each with the image groups to process, or None for all
+    :raises Exception: in the image group and balance modes, when an image group lookup or listing fails.
+    Another node could have succeeded, and computed different shares, so that some image groups would be
+    built twice and others never. A work without image groups, or an empty image group, is the same on
+    every node: it weighs nothing, goes to a share like any other, and its build reports it.
+    """
+    global image_repo
+
+    shard_index, shard_count = shard
+    if not by_image_group and not balance:
+        return [(work_rid, named_image_groups) for work_rid in work_rids
+                if stable_shard(work_rid, shard_count) == shard_index]
+
+    if named_image_groups is None:
+        Common.prefetchVolumeInfos(work_rids, image_repo)
+    # unit key to its work and image groups
+    units: {str: (str, [str])} = {}
+    for work_rid in work_rids:
+        try:
+            vol_infos: [] = named_image_groups if named_image_groups is not None \
+                else Common.getVolumeInfos(work_rid, image_repo)
+        except Exception as inst:
+            raise Exception(f"--shard: image groups of {work_rid} not found, so shares cannot be computed. "
+                            f"{exception_summary(inst)}") from inst
+        if by_image_group and len(vol_infos) > 0:
+            for vi in vol_infos:
+                units[f"{work_rid}-{vi}"] = (work_rid, [vi])
+        else:
+            units[work_rid] = (work_rid, vol_infos)
+
+    if balance:
+        weights: {str: int} = {key: sum(listed_image_count(work_rid, vi) for vi in image_groups)
+                               for key, (work_rid, image_groups) in units.items()}
+        unit_shards: {str: int} = balanced_shards(weights, shard_count)
+    else:
+        unit_shards: {str: int} = {key: stable_shard(key, shard_count) for key in units}
+
+    # regroup this shard's image groups by work, in work list order
+    works: {str: [str]} = {}
+    for key, (work_rid, image_groups) in units.items():
+        if unit_shards[key] == shard_index:
+            works.setdefault(work_rid, []).extend(image_groups)
+    return list(works.items())
+
+
+def listed_image_count(work_rid: str, image_group: str) -> int:
+    """
+    :return: the image group's image count, for --shard-balance
+    :raises Exception: when the image group cannot be listed
+    """
+    global image_repo
+    try:
+        image_count: int = image_repo.image_group_stats(work_rid, image_group)[0]
+    except Exception as inst:
+        raise Exception(f"--shard-balance: {work_rid}-{image_group} cannot be listed, so shares cannot be "
+                        f"balanced. {exception_summary(inst)}") from inst
+    return image_count
+
+
+def manifestInParallel(works: [(str, [str])], repo_settings: dict, jobs: int, by_work: bool = False) -> bool:
+    """
+    Spreads the image groups of a list of works across a pool of worker processes.
+    boto3 clients cannot cross a fork, so each worker builds its own repository from repo_settings.
+    :param works: works to process, each with the image groups to process, or None for all
+    :param repo_settings: see manifestCommons.repository_settings
+    :param jobs: number of worker processes
+    :param by_work: give each worker whole works, rather than image groups
+    :return: True if every image group succeeded
+    """
+    with worker_pool(repo_settings, jobs) as pool:
+        return manifestInPool(pool, works, by_work)
+
+
+def worker_pool(repo_settings: dict, jobs: int) -> ProcessPoolExecutor:
+    """
+    :param repo_settings: see manifestCommons.repository_settings
+    :param jobs: number of worker processes
+    :return: a pool of worker processes, each with its own repository
+    """
+    return ProcessPoolExecutor(max_workers=jobs, initializer=init_worker,
+                               initargs=(repo_settings, skip_current, compress_level))
+
+
+def manifestInPool(pool: ProcessPoolExecutor, works: [(str, [str])], by_work: bool = False) -> bool:
+    """
+    Submits a list of works to a worker_pool, and waits for all of them.
+    Image groups are listed first, in this process, and then submitted largest first, so that no large
+    image group starts last. Listing here, rather than in the workers, lists each work of an S3 repository
+    once, in one work index, where the workers' indexes would each list it again. Whole works (by_work)
+    are submitted in list order.
+    :param pool: from worker_pool()
+    :param works: works to process, each with the image groups to process, or None for all
+    :param by_work: give each worker whole works, rather than image groups
+    :return: True if every image group succeeded
+    """
+    global image_repo, shell_logger
+
+    all_well: bool = True
+    futures = []
+    image_groups: [(str, str)] = []
+    if not by_work:
+        Common.prefetchVolumeInfos([work_rid for work_rid, named_image_groups in works if named_image_groups is None],
+                                   image_repo)
+    for work_rid, named_image_groups in works:
+        if by_work:
+            futures.append(pool.submit(work_job, work_rid, named_image_groups))
+            continue
+        try:
+            vol_infos: [] = named_image_groups if named_image_groups is not None \
+                else Common.getVolumeInfos(work_rid, image_repo)
+        except Exception as inst:
+            shell_logger.error(f"{work_rid} failed to build manifest {exception_summary(inst)}")
+            all_well = False
+            continue
+        if len(vol_infos) == 0:
+            shell_logger.error(f"Could not find image groups for {work_rid}")
+            all_well = False
+        image_groups.extend((work_rid, vi) for vi in vol_infos)
+
+    if len(image_groups) > 0:
+        # listing pass
+        stats: [(int, int)] = [image_group_weight(work_rid, vi) for work_rid, vi in image_groups]
+        for work_rid, vi in largest_first(dict(zip(image_groups, stats))):
+            futures.append(pool.submit(volume_job, work_rid, vi))
+
+    for future in as_completed(futures):
+        for result in future.result():
+            metrics.merge(result.metrics)
+            if not result.success:
+                shell_logger.error(f"{result.work_rid} failed to build manifest {result.message}")
+            all_well &= result.success
     return all_well
 
 
+def init_worker(repo_settings: dict, skip: bool = False, gzip_level: int = Common.DEFAULT_COMPRESS_LEVEL):
+    """
+    Worker process setup: its own repository, and plain logging in place of the parent's
+    AOLogger, whose SNS client belongs to the parent. The repository serves all the worker's
+    image groups, and is closed when the pool shuts the worker down.
+    :param repo_settings: see manifestCommons.repository_settings
+    :param skip: incremental mode, see skip_current
+    :param gzip_level: see compress_level
+    """
+    global image_repo, shell_logger, skip_current, compress_level
+    Common.configure_volume_infos(repo_settings)
+    image_repo = Common.build_repository(repo_settings)
+    # workers leave through os._exit, which skips atexit. multiprocessing runs its finalizers first
+    Finalize(image_repo, image_repo.close, exitpriority=10)
+    skip_current = skip
+    compress_level = gzip_level
+    shell_logger = logging.getLogger('local_v_m_b')
+
+
+def image_group_weight(work_rid: str, image_group: str) -> (int, int):
+    """
+    Lists one image group, for manifestInPool's largest first order
+    :return: the image group's image count and bytes, or zeros if it cannot be listed.
+    volume_job reports the error
+    """
+    global image_repo
+    try:
+        return image_repo.image_group_stats(work_rid, image_group)
+    except Exception:
+        return 0, 0
+
+
+def volume_job(work_rid: str, image_group: str) -> [VolumeResult]:
+    """
+    Worker process task: one image group
+    """
+    global image_repo, shell_logger, skip_current, compress_level
+    try:
+        upload_volume(work_rid, image_group, image_repo, shell_logger, skip_current, compress_level)
+        return [VolumeResult(work_rid, image_group, True, metrics=metrics.drain())]
+    except Exception as inst:
+        return [VolumeResult(work_rid, image_group, False, exception_summary(inst), metrics.drain())]
+
+
+def work_job(work_rid: str, named_image_groups: [str] = None) -> [VolumeResult]:
+    """
+    Worker process task: all the image groups of a work
+    """
+    global image_repo
+    try:
+        vol_infos: [] = named_image_groups if named_image_groups is not None \
+            else Common.getVolumeInfos(work_rid, image_repo)
+    except Exception as inst:
+        return [VolumeResult(work_rid, None, False, exception_summary(inst), metrics.drain())]
+    if len(vol_infos) == 0:
+        return [VolumeResult(work_rid, None, False, "Could not find image groups", metrics.drain())]
+    results: [VolumeResult] = []
+    for vi in vol_infos:
+        results.extend(volume_job(work_rid, vi))
+    return results
+
+
+def exception_summary(inst: Exception) -> str:
+    """
+    :param inst: exception being handled
+    :return: its type, message and the top of its stack
+    """
+    eek = sys.exc_info()
+    stack: str = ""
+    for tb in traceback.format_tb(eek[2], 5):
+        stack += tb
+    return f"{type(inst)} {inst}\n{stack} "
+
+
 def doOneManifest(work_rid: str, named_image_groups:[str] = None) -> bool:
     """
     this function generates the manifests for each volume of a work RID (example W22084)
     :type work_rid: object
     """
 
-    global image_repo, shell_logger
+    global image_repo, shell_logger, skip_current, compress_level
 
     is_success: bool = False
 
@@ -101,43 +652,45 @@ def doOneManifest(work_rid: str, named_image_groups:[str] = None) -> bool:
             return is_success
 
         for vi in vol_infos:
-            upload_volume(work_rid, vi, image_repo, shell_logger)
+            upload_volume(work_rid, vi, image_repo, shell_logger, skip_current, compress_level)
 
         is_success = True
     except Exception as inst:
-        eek = sys.exc_info()
-        stack: str = ""
-        for tb in traceback.format_tb(eek[2], 5):
-            stack += tb
-        shell_logger.error(f"{work_rid} failed to build manifest {type(inst)} {inst}\n{stack} ")
+        shell_logger.error(f"{work_rid} failed to build manifest {exception_summary(inst)}")
         is_success = False
 
     return is_success
 
 
-def upload_volume(work_rid: str, image_group: str, repo: ImageRepositoryBase, logger: AOLogger) -> bool:
+def upload_volume(work_rid: str, image_group: str, repo: ImageRepositoryBase, logger: 'AOLogger',
+                  skip_if_current: bool = False, gzip_level: int = Common.DEFAULT_COMPRESS_LEVEL) -> bool:
+    if skip_if_current and repo.manifest_is_current(work_rid, image_group):
+        logger.info(f"Manifest for {work_rid}-{image_group} is newer than its images, skipping")
+        return True
     _tick = time.monotonic()
     manifest = repo.generateManifest(work_rid, image_group)
     if len(manifest) > 0:
-        upload(work_rid, image_group, manifest, repo)
+        upload(work_rid, image_group, manifest, repo, gzip_level)
         _et = time.monotonic() - _tick
         logger.info(f"Volume {work_rid}-{image_group} processing: {_et:05.3} sec ")
     else:
         _et = time.monotonic() - _tick
         logger.info(f"No manifest created for {work_rid}-{image_group} ")
+    metrics.record('volume', _et)
 
     return True
 
 
-def upload(work_rid: str, image_group_name: str, manifest_object: object, image_repo: ImageRepositoryBase):
+def upload(work_rid: str, image_group_name: str, manifest_object: object, image_repo: ImageRepositoryBase,
+           gzip_level: int = Common.DEFAULT_COMPRESS_LEVEL):
 
-    # for adict in manifest_object:
-    #     print(f" dict: {adict} json: d{json.dumps(adict)}")
-    manifest_str = json.dumps(manifest_object)
-    # Even for debug, this is a little excessive
-    # shell_logger.debug(manifest_str)
-    manifest_gzip: bytes = Common.gzip_str(manifest_str)
-    image_repo.uploadManifest(work_rid, image_group_name, Common.VMT_DIM, manifest_gzip)
+    # The JSON streams through gzip into the repository, one entry at a time
+    with image_repo.manifest_writer(work_rid, image_group_name, Common.VMT_DIM) as manifest_out:
+        Common.gzip_json_stream(manifest_object, manifest_out, gzip_level)
+        manifest_bytes: int = manifest_out.tell()
+        _tick = time.perf_counter()
+    # serialize and compress are their own stages: this is the time the repository takes to store the manifest
+    metrics.record('upload', time.perf_counter() - _tick, manifest_bytes)
 
 
 if __name__ == '__main__':
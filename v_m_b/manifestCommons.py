@@ -3,15 +3,22 @@ import io
 import os
 import traceback
 from argparse import ArgumentParser
-from typing import Tuple
+from typing import BinaryIO, Tuple, TYPE_CHECKING
 
-import boto3
+# boto3, and util_lib.AOLogger which imports it, are imported where they are needed, so that
+# importing this module stays cheap, and fs mode never loads them
 # from PIL import Image
 
-from util_lib.AOLogger import AOLogger
 from v_m_b.ImageRepository import ImageRepositoryBase
 from v_m_b.ImageRepository import ImageRepositoryFactory
+from v_m_b.DimensionCache import DimensionCache, DEFAULT_MAX_ENTRIES
 from v_m_b.S3WorkFileManager import S3WorkFileManager
+from v_m_b.VolumeInfo.VolumeInfoCache import VolumeInfoCache, DEFAULT_TTL_SECONDS
+from v_m_b.workScheduling import parse_shard
+from v_m_b.stageMetrics import metrics
+
+if TYPE_CHECKING:
+    from util_lib.AOLogger import AOLogger
 
 # for writing and GetVolumeInfos
 S3_DEST_BUCKET: str = "archive.tbrc.org"
@@ -21,6 +28,7 @@ LOG_FILE_ROOT: str = "/var/log/VolumeManifestTool"
 todo_prefix: str = "processing/todo/"
 processing_prefix: str = "processing/inprocess/"
 done_prefix: str = "processing/done/"
+lease_prefix: str = "processing/leases/"
 
 VMT_BUDABOM: str = 'fileList.json'
 VMT_BUDABOM_JSON_KEY: str = 'filename'
@@ -28,12 +36,30 @@ VMT_DIM: str = 'dimensions.json'
 VMT_WORK_PARENT: str = "Works"
 VMT_IMAGES: str = "images"
 
-s3_work_manager: S3WorkFileManager = S3WorkFileManager(S3_MANIFEST_WORK_LIST_BUCKET, todo_prefix, processing_prefix,
-                                                       done_prefix)
-shell_logger: AOLogger
+# gzip's own default
+DEFAULT_COMPRESS_LEVEL: int = 9
+
+# see work_manager()
+s3_work_manager: S3WorkFileManager = None
+shell_logger: 'AOLogger' = None
+# work to image groups lookups. See configure_volume_infos
+volume_info_cache: VolumeInfoCache = None
+
+
+def work_manager() -> S3WorkFileManager:
+    """
+    The work list file manager is only built when first needed: it creates a boto3 resource,
+    and looks up the EC2 instance it runs on, which takes seconds elsewhere
+    :return: this process's s3_work_manager
+    """
+    global s3_work_manager
+    if s3_work_manager is None:
+        s3_work_manager = S3WorkFileManager(S3_MANIFEST_WORK_LIST_BUCKET, todo_prefix, processing_prefix, done_prefix,
+                                            lease_prefix)
+    return s3_work_manager
 
 
-def getVolumeInfos(work_rid: str, image_repo: ImageRepositoryBase) -> []:
+def getVolumeInfos(work_rid: str, image_repo: ImageRepositoryBase, cache: VolumeInfoCache = None) -> []:
     """
     Tries data sources for image group info. If BUDA_IMAGE_GROUP global is set, prefers
     BUDA source, tries eXist on BUDA fail.
@@ -41,16 +67,46 @@ def getVolumeInfos(work_rid: str, image_repo: ImageRepositoryBase) -> []:
     :type work_rid: str
     :param image_repo: Image repository object
     :type image_repo: ImageRepositoryBase
+    :param cache: earlier lookups. Defaults to volume_info_cache
     :return: [imagegroup1..imagegroupn]
     """
     from v_m_b.VolumeInfo.VolumeInfoBuda import VolumeInfoBUDA
 
     vol_infos: []
     _dir, _work = image_repo.resolve_work(work_rid)
-    vol_infos = (VolumeInfoBUDA(image_repo)).get_image_group_disk_paths(_work)
+    with metrics.timed('volume_info'):
+        vol_infos = (VolumeInfoBUDA(image_repo, cache if cache is not None else volume_info_cache)
+                     .get_image_group_disk_paths(_work))
     return vol_infos
 
 
+def prefetchVolumeInfos(work_rids: [str], image_repo: ImageRepositoryBase):
+    """
+    Looks up the image groups of many works at once, so that getVolumeInfos finds them in volume_info_cache.
+    Failures are left for getVolumeInfos to report. Without volume_info_cache, there is nowhere to keep
+    the results, and nothing is looked up.
+    :param work_rids: Work identifiers
+    :param image_repo: Image repository object
+    """
+    from v_m_b.VolumeInfo.VolumeInfoBuda import VolumeInfoBUDA
+
+    if volume_info_cache is None:
+        return
+
+    VolumeInfoBUDA(image_repo, volume_info_cache).get_image_group_disk_paths_bulk(
+        [image_repo.resolve_work(work_rid)[1] for work_rid in work_rids])
+
+
+def configure_volume_infos(settings: dict):
+    """
+    Sets up this process's volume_info_cache
+    :param settings: from repository_settings()
+    """
+    global volume_info_cache
+    volume_info_cache = VolumeInfoCache(settings.get('volume_info_cache') or ":memory:",
+                                        settings.get('volume_info_ttl', DEFAULT_TTL_SECONDS))
+
+
 def mustExistDirectory(path: str):
     """
     Argparse type specifying a string which represents
@@ -112,6 +168,118 @@ def parse_args(arg_namespace: object) -> bool:
                          action='store',
                          help="comma separated disk path of one or more image groups to process.")
 
+    _parser.add_argument('--concurrency',
+                         dest='concurrency',
+                         action='store',
+                         type=int,
+                         default=ImageRepositoryBase.DEFAULT_CONCURRENCY,
+                         help="How many images of one image group to process at the same time")
+
+    _parser.add_argument("-j",
+                         '--jobs',
+                         dest='jobs',
+                         action='store',
+                         type=int,
+                         default=1,
+                         help="Number of worker processes. Each one builds the manifests of one image group at a time.")
+
+    _parser.add_argument('--parallel-works',
+                         dest='parallel_works',
+                         action='store_true',
+                         help="With -j/--jobs, give each worker process whole works, instead of image groups")
+
+    _parser.add_argument('--incremental',
+                         dest='incremental',
+                         action='store_true',
+                         help="Skip image groups whose dimensions.json is newer than all their images")
+
+    _parser.add_argument('--force',
+                         dest='force',
+                         action='store_true',
+                         help="Rebuild every manifest, even in --incremental mode")
+
+    _parser.add_argument('--dimension-cache',
+                         dest='dimension_cache',
+                         action='store',
+                         help="SQLite file caching each image's dimensions, to skip unchanged images on rebuilds")
+
+    _parser.add_argument('--dimension-cache-entries',
+                         dest='dimension_cache_entries',
+                         action='store',
+                         type=int,
+                         default=DEFAULT_MAX_ENTRIES,
+                         help="Size of the --dimension-cache, in images. Least recently used images are evicted.")
+
+    _parser.add_argument('--volume-info-cache',
+                         dest='volume_info_cache',
+                         action='store',
+                         help="SQLite file caching each work's image group list from BUDA, across runs")
+
+    _parser.add_argument('--volume-info-ttl',
+                         dest='volume_info_ttl',
+                         action='store',
+                         type=int,
+                         default=DEFAULT_TTL_SECONDS,
+                         help="Seconds before a cached image group list is looked up again")
+
+    _parser.add_argument('--colorclass',
+                         dest='colorclass',
+                         action='store_true',
+                         help="Add each image's \"colorclass\": color, grayscale or blackandwhite. "
+                              "Reads whole images. Requires numpy")
+
+    _parser.add_argument('--compress-level',
+                         dest='compress_level',
+                         action='store',
+                         type=int,
+                         choices=range(1, 10),
+                         default=DEFAULT_COMPRESS_LEVEL,
+                         help="gzip compression level of dimensions.json: 1 is fastest, 9 is smallest")
+
+    _parser.add_argument('--metrics-json',
+                         dest='metrics_json',
+                         action='store',
+                         help="Write per stage counts, bytes and latency histograms to this JSON file at the end")
+
+    _parser.add_argument('--prometheus-textfile',
+                         dest='prometheus_textfile',
+                         action='store',
+                         help="Also write them in Prometheus text format, for the node_exporter textfile collector")
+
+    _parser.add_argument('--profile',
+                         dest='profile',
+                         action='store_true',
+                         help="Build one work (-w, optionally -i) under a sampling profiler. Logs the wall and "
+                              "CPU time of the hot path's sections, and writes flame graph stacks next to the log")
+
+    _parser.add_argument("-p",
+                         '--poll-interval',
+                         dest='poll_interval',
+                         action='store',
+                         type=int,
+                         default=600,
+                         help="manifestFromS3 only: seconds to wait between polls of an empty todo folder")
+
+    _parser.add_argument('--shard',
+                         dest='shard',
+                         action='store',
+                         type=parse_shard,
+                         help="i/N: build only the i-th (from 0) of N disjoint shares of the works. "
+                              "Run one node per share, with the same work list.")
+
+    _parser.add_argument('--shard-by',
+                         dest='shard_by',
+                         action='store',
+                         choices=['work', 'image-group'],
+                         default='work',
+                         help="--shard unit: whole works, or image groups")
+
+    _parser.add_argument('--shard-balance',
+                         dest='shard_balance',
+                         action='store_true',
+                         help="Balance --shard shares by image count, from a listing pass of every image group, "
+                              "instead of by hash")
+
     # but the work rid need not exist, it is qualified by the --container arg
     # if in fs mode, or the --bucket mode if in S3
     src_group = _parser.add_mutually_exclusive_group(required=False)
@@ -135,6 +303,11 @@ def parse_args(arg_namespace: object) -> bool:
                            required=False,
                            default=S3_DEST_BUCKET,
                            help='Bucket - source and destination')
+    s3_parser.add_argument('--async-io',
+                           dest='async_io',
+                           action='store_true',
+                           help='Use one event loop and pooled connections for all S3 requests. '
+                                'Requires aiobotocore')
 
     fs_parser: ArgumentParser = child_parsers.add_parser("fs")
 
@@ -189,15 +362,18 @@ def buildWorkListFromS3(client: object) -> (str, []):
     page_iterator = client.get_paginator('list_objects_v2').paginate(Bucket=S3_MANIFEST_WORK_LIST_BUCKET,
                                                                      Prefix=todo_prefix)
     file_list = []
+    etag_list = []
     # Get the object list from the first value
     for page in page_iterator:
-        object_list = [x for x in page["Contents"]]
-        file_list.extend([x['Key'].replace(todo_prefix, '') for x in object_list if x['Key'] != todo_prefix])
+        object_list = [x for x in page.get("Contents", []) if x['Key'] != todo_prefix]
+        file_list.extend([x['Key'].replace(todo_prefix, '') for x in object_list])
+        etag_list.extend([x['ETag'] for x in object_list])
 
-    # We've ingested the contents of the to do list, move the files into processing
-    new_names = [s3_work_manager.local_name_work_file(x) for x in file_list]
+    # We've ingested the contents of the to do list, claim the files into processing.
+    # Other instances may claim some of them first.
+    new_names = [work_manager().local_name_work_file(x) for x in file_list]
 
-    s3_work_manager.mark_underway(file_list, new_names)
+    new_names = work_manager().mark_underway(file_list, new_names, etag_list)
 
     # mon
     if len(file_list) == 0:
@@ -220,6 +396,50 @@ def gzip_str(string_):
     return bytes_obj
 
 
+def gzip_json_stream(manifest: [dict], out: BinaryIO, compress_level: int = DEFAULT_COMPRESS_LEVEL):
+    """
+    Writes the JSON of a manifest, one entry at a time, through gzip into a stream, so that neither
+    the whole JSON string nor the whole zipped bytes are ever in memory. The JSON is the same
+    as json.dumps(manifest)
+    :param manifest: list of image data dicts
+    :param out: binary stream, which stays open
+    :param compress_level: gzip compression level, 1 (fastest) to 9 (smallest)
+    """
+    import gzip
+    import json
+    import time
+    serialize_seconds: float = 0.0
+    json_bytes: int = 2
+    tick = time.perf_counter()
+    with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=compress_level) as fo:
+        fo.write(b'[')
+        for i, entry in enumerate(manifest):
+            if i > 0:
+                fo.write(b', ')
+                json_bytes += 2
+            encode_tick = time.perf_counter()
+            entry_json: bytes = json.dumps(entry).encode()
+            serialize_seconds += time.perf_counter() - encode_tick
+            json_bytes += len(entry_json)
+            fo.write(entry_json)
+        fo.write(b']')
+    metrics.record('serialize', serialize_seconds, json_bytes)
+    metrics.record('compress', time.perf_counter() - tick - serialize_seconds, json_bytes)
+
+
+def write_metrics(args: object):
+    """
+    Logs this process's stage metrics, and writes the files the command line asks for
+    :param args: parsed command line
+    """
+    global shell_logger
+    shell_logger.info(f"stages: {metrics.one_line()}")
+    if args.metrics_json:
+        metrics.write_json(args.metrics_json)
+    if args.prometheus_textfile:
+        metrics.write_prometheus(args.prometheus_textfile)
+
+
 def exception_handler(exception_type, exception, tb: traceback):
     """
     All your trace are belong to us!
@@ -249,14 +469,97 @@ class VMBArgs:
     pass
 
 
-def prolog() -> Tuple[VMBArgs, ImageRepositoryBase.ImageRepositoryBase, AOLogger]:
+def skips_current(args: VMBArgs) -> bool:
+    """
+    :param args: parsed command line
+    :return: True if image groups whose manifest is newer than all their images are skipped:
+    --incremental, unless --force
+    """
+    return args.incremental and not args.force
+
+
+def repository_settings(args: VMBArgs) -> dict:
+    """
+    Extracts what build_repository needs from the command line. Unlike the args, the
+    result can be pickled, so that worker processes can build their own repository.
+    :param args: parsed command line
+    :return: repository settings
+    """
+    channel = str(args.REPO_CHOICE).lower()
+    settings: dict = {'channel': channel,
+                      'image_folder_name': args.image_folder_name,
+                      'concurrency': args.concurrency,
+                      'dimension_cache': args.dimension_cache,
+                      'dimension_cache_entries': args.dimension_cache_entries,
+                      'volume_info_cache': args.volume_info_cache,
+                      'volume_info_ttl': args.volume_info_ttl,
+                      'colorclass': args.colorclass}
+    if channel == 's3':
+        settings['bucket'] = args.bucket
+        settings['async_io'] = args.async_io
+    if channel == 'fs':
+        settings['container'] = args.container
+    return settings
+
+
+def build_repository(settings: dict) -> ImageRepositoryBase.ImageRepositoryBase:
+    """
+    Creates an image repository, with its own clients
+    :param settings: from repository_settings()
+    :return: the repository
+    """
+    image_repository: ImageRepositoryBase = None
+
+    dimension_cache: DimensionCache = None
+    if settings.get('dimension_cache'):
+        dimension_cache = DimensionCache(settings['dimension_cache'], settings['dimension_cache_entries'])
+
+    channel = settings['channel']
+    if channel == 's3' and settings.get('async_io'):
+        image_repository = (ImageRepositoryFactory.ImageRepositoryFactory().
+                            repository('s3async',
+                                       bucket_name=settings['bucket'],
+                                       image_classifier=settings['image_folder_name'],
+                                       max_concurrency=settings['concurrency'],
+                                       dimension_cache=dimension_cache,
+            colorclass=settings.get('colorclass', False)))
+    elif channel == 's3':
+        import boto3
+        from botocore.config import Config
+        session = boto3.session.Session(region_name='us-east-1')
+        # one pooled connection for each image in flight
+        client = session.client('s3', config=Config(max_pool_connections=settings['concurrency']))
+        dest_bucket = session.resource('s3').Bucket(settings['bucket'])
+        image_repository = (ImageRepositoryFactory.ImageRepositoryFactory().
+                            repository(channel,
+                                       client=client,
+                                       bucket=dest_bucket,
+                                       image_classifier=settings['image_folder_name'],
+                                       max_concurrency=settings['concurrency'],
+                                       dimension_cache=dimension_cache,
+            colorclass=settings.get('colorclass', False)))
+    if channel == 'fs':
+        image_repository = (ImageRepositoryFactory.ImageRepositoryFactory()
+        .repository(
+            channel,
+            source_container=settings['container'],
+            image_classifier=settings['image_folder_name'],
+            max_concurrency=settings['concurrency'],
+            dimension_cache=dimension_cache,
+            colorclass=settings.get('colorclass', False)))
+    return image_repository
+
+
+def prolog() -> Tuple[VMBArgs, ImageRepositoryBase.ImageRepositoryBase, 'AOLogger']:
     """
     Program setup. Exception, logging, and repository
     :return:
     """
     # Skip noisy exceptions
+    import atexit
     import sys
     from pathlib import Path
+    from util_lib.AOLogger import AOLogger
     global shell_logger
 
     args = VMBArgs()
@@ -271,24 +574,11 @@ def prolog() -> Tuple[VMBArgs, ImageRepositoryBase.ImageRepositoryBase, AOLogger
     shell_logger.hush = True
     sys.excepthook = exception_handler
 
-    image_repository: ImageRepositoryBase = None
-
-    channel = str(args.REPO_CHOICE).lower()
-    if channel == 's3':
-        session = boto3.session.Session(region_name='us-east-1')
-        client = session.client('s3')
-        dest_bucket = session.resource('s3').Bucket(args.bucket)
-        image_repository = (ImageRepositoryFactory.ImageRepositoryFactory().
-                            repository(channel,
-                                       client=client,
-                                       bucket=dest_bucket,
-                                       image_classifier=args.image_folder_name))
-    if channel == 'fs':
-        image_repository = (ImageRepositoryFactory.ImageRepositoryFactory()
-        .repository(
-            channel,
-            source_container=args.container,
-            image_classifier=args.image_folder_name))
+    settings: dict = repository_settings(args)
+    configure_volume_infos(settings)
+    image_repository: ImageRepositoryBase = build_repository(settings)
+    # callers close it when done. This is for the ones which exit early
+    atexit.register(image_repository.close)
 
     shell_logger.hush = False
 
@@ -98,12 +98,21 @@ class S3CustomTransfer(object):
         else:
             self._manager = create_transfer_manager(client, config, osutil)
 
+    def submit_download(self, bucket, key, fileobj, extra_args=None,
+                        callback=None):
+        """
+        Queues a download and returns its future without waiting on it,
+        so that many downloads can be in flight together.
+        """
+        subscribers = self._get_subscribers(callback)
+        return self._manager.download(
+            bucket, key, fileobj, extra_args, subscribers)
+
     def download_file(self, bucket, key, filename, extra_args=None,
                       callback=None):
 
-        subscribers = self._get_subscribers(callback)
-        future = self._manager.download(
-            bucket, key, filename, extra_args, subscribers)
+        future = self.submit_download(bucket, key, filename, extra_args,
+                                      callback)
         try:
             future.result()
         # This is for backwards compatibility where when retries are
@@ -122,6 +131,12 @@ class S3CustomTransfer(object):
     def wait(self):
         self._manager._coordinator_controller.wait()
 
+    def shutdown(self):
+        """
+        Waits for the transfers in progress, then stops the manager's threads
+        """
+        self._manager.shutdown()
+
     def __enter__(self):
         return self
 
@@ -133,5 +148,5 @@ class DoneCallbackInvoker(BaseSubscriber):
     def __init__(self, callback):
         self._callback = callback
 
-    def on_done(self, **kwargs):
-        self._callback()
+    def on_done(self, future, **kwargs):
+        self._callback(future)
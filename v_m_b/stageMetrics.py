@@ -0,0 +1,155 @@
+"""
+Per stage counts, bytes and latency histograms of manifest building, so that a slow run can be
+blamed on BUDA, on storage or on PIL. Each process records into its own module level `metrics`.
+Worker processes send theirs to the parent, which merges them.
+
+Stages:
+    volume_info:  image group lookups of a work (BUDA)
+    listing:      listing an image group or a work in the repository
+    fetch:        reading image bytes from the repository, header probes or whole images
+    parse:        PIL parsing, not counting the fetches it triggers
+    serialize:    JSON encoding of a manifest
+    compress:     gzip of a manifest
+    upload:       storing a manifest in the repository
+    volume:       one image group, end to end
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds, in seconds, of the latency histogram buckets. The last bucket is unbounded.
+LATENCY_BUCKETS: [float] = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60]
+
+PROMETHEUS_PREFIX: str = "vmb"
+
+
+class StageMetrics:
+    """
+    Thread safe accumulator of per stage counts, bytes and latencies
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: {str: dict} = {}
+
+    def record(self, stage: str, seconds: float, nbytes: int = 0, count: int = 1):
+        """
+        :param stage: stage name
+        :param seconds: time the stage took
+        :param nbytes: bytes the stage moved
+        :param count: number of operations seconds covers. The histogram gets one sample of seconds / count
+        """
+        bucket: int = next((i for i, bound in enumerate(LATENCY_BUCKETS) if seconds / max(count, 1) <= bound),
+                           len(LATENCY_BUCKETS))
+        with self._lock:
+            totals = self._stages.get(stage)
+            if totals is None:
+                totals = self._stages[stage] = {'count': 0, 'bytes': 0, 'seconds': 0.0,
+                                                'buckets': [0] * (len(LATENCY_BUCKETS) + 1)}
+            totals['count'] += count
+            totals['bytes'] += nbytes
+            totals['seconds'] += seconds
+            totals['buckets'][bucket] += 1
+
+    @contextmanager
+    def timed(self, stage: str, nbytes: int = 0):
+        """
+        Records the time the block takes. The block can add to the returned dict's 'bytes'.
+        :param stage: stage name
+        :param nbytes: bytes the stage moves, if known beforehand
+        """
+        sample: dict = {'bytes': nbytes}
+        tick = time.perf_counter()
+        try:
+            yield sample
+        finally:
+            self.record(stage, time.perf_counter() - tick, sample['bytes'])
+
+    def summary(self) -> dict:
+        """
+        :return: JSON serializable copy of the metrics, which merge() accepts
+        """
+        with self._lock:
+            return {'latency_buckets': LATENCY_BUCKETS,
+                    'stages': {stage: {'count': x['count'], 'bytes': x['bytes'], 'seconds': round(x['seconds'], 6),
+                                       'buckets': list(x['buckets'])}
+                               for stage, x in self._stages.items()}}
+
+    def drain(self) -> dict:
+        """
+        :return: summary(), after which the metrics restart from zero
+        """
+        with self._lock:
+            stages, self._stages = self._stages, {}
+        return {'latency_buckets': LATENCY_BUCKETS, 'stages': stages}
+
+    def merge(self, summary: dict):
+        """
+        Adds another process's metrics to these
+        :param summary: from summary() or drain()
+        """
+        if not summary:
+            return
+        with self._lock:
+            for stage, other in summary['stages'].items():
+                totals = self._stages.setdefault(stage, {'count': 0, 'bytes': 0, 'seconds': 0.0,
+                                                         'buckets': [0] * (len(LATENCY_BUCKETS) + 1)})
+                totals['count'] += other['count']
+                totals['bytes'] += other['bytes']
+                totals['seconds'] += other['seconds']
+                totals['buckets'] = [a + b for a, b in zip(totals['buckets'], other['buckets'])]
+
+    def one_line(self) -> str:
+        """
+        :return: human readable summary, for the log
+        """
+        with self._lock:
+            return ", ".join(f"{stage}: {x['count']} in {x['seconds']:.2f}s"
+                             + (f" {x['bytes'] / 1e6:.1f}MB" if x['bytes'] else "")
+                             for stage, x in sorted(self._stages.items()))
+
+    def write_json(self, path: str):
+        """
+        :param path: JSON summary file
+        """
+        write_atomically(path, json.dumps(self.summary(), indent=2))
+
+    def write_prometheus(self, path: str):
+        """
+        Writes the metrics in the Prometheus text format, for the node_exporter textfile collector
+        :param path: file, which should end in .prom
+        """
+        name: str = f"{PROMETHEUS_PREFIX}_stage"
+        lines: [str] = [f"# HELP {name}_seconds Time spent in each manifest building stage",
+                        f"# TYPE {name}_seconds histogram"]
+        stages: dict = self.summary()['stages']
+        for stage, x in sorted(stages.items()):
+            cumulative = 0
+            for bound, in_bucket in zip(LATENCY_BUCKETS + ['+Inf'], x['buckets']):
+                cumulative += in_bucket
+                lines.append(f'{name}_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_seconds_sum{{stage="{stage}"}} {x["seconds"]}')
+            lines.append(f'{name}_seconds_count{{stage="{stage}"}} {cumulative}')
+        lines += [f"# HELP {name}_operations_total Operations in each manifest building stage",
+                  f"# TYPE {name}_operations_total counter"]
+        lines += [f'{name}_operations_total{{stage="{stage}"}} {x["count"]}' for stage, x in sorted(stages.items())]
+        lines += [f"# HELP {name}_bytes_total Bytes moved by each manifest building stage",
+                  f"# TYPE {name}_bytes_total counter"]
+        lines += [f'{name}_bytes_total{{stage="{stage}"}} {x["bytes"]}' for stage, x in sorted(stages.items())]
+        write_atomically(path, "\n".join(lines) + "\n")
+
+
+def write_atomically(path: str, text: str):
+    """
+    Readers, such as the node_exporter, never see a partial file
+    """
+    tmp_path: str = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as out:
+        out.write(text)
+    os.replace(tmp_path, path)
+
+
+# this process's metrics
+metrics: StageMetrics = StageMetrics()
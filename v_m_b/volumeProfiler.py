@@ -0,0 +1,158 @@
+"""
+Sampling profiler for finding out where one slow volume spends its time. Image groups are read by
+thread pools, which cProfile, bound to one thread, does not see: this samples the stacks of every thread.
+It writes them in the collapsed ("folded") stack format, which flamegraph.pl, speedscope and
+inferno read, and sums the wall and CPU time of a few sections of the hot path.
+"""
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+# seconds between stack samples
+DEFAULT_SAMPLE_INTERVAL: float = 0.005
+
+# Sections of the hot path: a sample belongs to a section when one of its frames matches one of the
+# section's (file path fragment, function name) rules. None matches any function in the file.
+PROFILE_SECTIONS: {str: [(str, str)]} = {
+    'fillDataWithBlobImage': [('generateManifest.py', 'fillDataWithBlobImage')],
+    'plugin_loading': [(os.path.join('PIL', 'Image.py'), 'preinit'),
+                       (os.path.join('PIL', 'Image.py'), 'init'),
+                       (os.path.join('PIL', ''), '<module>')],
+    'repository_io': [('headerProbe.py', '_load_blocks'),
+                      ('S3ImageRepository.py', 'work_index'),
+                      ('AsyncS3ImageRepository.py', '_list'),
+                      ('s3customtransfer.py', None),
+                      (os.path.join('', 'aiofiles', ''), None),
+                      (os.path.join('', 'botocore', ''), None),
+                      (os.path.join('', 's3transfer', ''), None),
+                      (os.path.join('', 'aiobotocore', ''), None)],
+    'volume_info': [('VolumeInfoBuda.py', None)]
+}
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of all the process's threads, from a thread of its own, while started.
+    Section wall time is the time during which at least one thread was in the section, and section
+    CPU time the CPU time of the threads in it. CPU time needs per thread CPU clocks (Linux): elsewhere
+    it is None.
+    """
+
+    def __init__(self, interval: float = DEFAULT_SAMPLE_INTERVAL, sections: {str: [(str, str)]} = None):
+        """
+        :param interval: seconds between samples
+        :param sections: see PROFILE_SECTIONS
+        """
+        self.interval = interval
+        self.sections = PROFILE_SECTIONS if sections is None else sections
+        self.stacks: Counter = Counter()
+        self.wall_seconds: float = 0.0
+        self.cpu_seconds: float = 0.0
+        self.section_wall: {str: float} = {section: 0.0 for section in self.sections}
+        self.section_cpu: {str: float} = {section: 0.0 for section in self.sections}
+        self._thread_cpu: {int: float} = {}
+        self._has_cpu_clocks: bool = hasattr(time, 'pthread_getcpuclockid')
+        self._stop = threading.Event()
+        self._sampler: threading.Thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        self._stop.clear()
+        # CPU time before the start is not the profile's
+        for thread_id in sys._current_frames():
+            self._cpu_since_last_sample(thread_id)
+        self._sampler = threading.Thread(target=self._run, name='vmb-profiler', daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        self._stop.set()
+        self._sampler.join()
+
+    def _run(self):
+        last_sample = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            self.sample(now - last_sample)
+            last_sample = now
+
+    def sample(self, elapsed: float):
+        """
+        Records the stack of every other thread
+        :param elapsed: seconds since the previous sample, which this one stands for
+        """
+        me: int = threading.get_ident()
+        thread_names: {int: str} = {t.ident: re.sub(r'[_-]\d+$', '', t.name) for t in threading.enumerate()}
+        in_section: set = set()
+        self.wall_seconds += elapsed
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == me:
+                continue
+            frames: [(str, str)] = []
+            while frame is not None:
+                frames.append((frame.f_code.co_filename, frame.f_code.co_name))
+                frame = frame.f_back
+            frames.reverse()
+            self.stacks[";".join([thread_names.get(thread_id, 'thread')]
+                                 + [f"{name} ({os.path.basename(path)})" for path, name in frames])] += 1
+
+            cpu_seconds: float = self._cpu_since_last_sample(thread_id)
+            self.cpu_seconds += cpu_seconds
+            for section, rules in self.sections.items():
+                if any(fragment in path and rule_name in (None, name)
+                       for path, name in frames for fragment, rule_name in rules):
+                    in_section.add(section)
+                    self.section_cpu[section] += cpu_seconds
+        for section in in_section:
+            self.section_wall[section] += elapsed
+
+    def _cpu_since_last_sample(self, thread_id: int) -> float:
+        if not self._has_cpu_clocks:
+            return 0.0
+        try:
+            cpu_now = time.clock_gettime(time.pthread_getcpuclockid(thread_id))
+        except OSError:
+            # the thread ended since it was listed
+            return 0.0
+        cpu_then = self._thread_cpu.get(thread_id, cpu_now)
+        self._thread_cpu[thread_id] = cpu_now
+        return cpu_now - cpu_then
+
+    def summary(self) -> dict:
+        """
+        :return: {section: {'wall': seconds, 'cpu': seconds or None}}, and the sampled wall time as 'total'
+        """
+        result: dict = {section: {'wall': round(self.section_wall[section], 3),
+                                  'cpu': round(self.section_cpu[section], 3) if self._has_cpu_clocks else None}
+                        for section in self.sections}
+        result['total'] = {'wall': round(self.wall_seconds, 3),
+                           'cpu': round(self.cpu_seconds, 3) if self._has_cpu_clocks else None}
+        return result
+
+    def one_line(self) -> str:
+        """
+        :return: human readable summary, for the log
+        """
+        return ", ".join(f"{section}: {x['wall']:.2f}s wall" + (f" {x['cpu']:.2f}s cpu" if x['cpu'] is not None else "")
+                         for section, x in self.summary().items())
+
+    def write_folded(self, path: Path) -> Path:
+        """
+        Writes the samples as collapsed stacks: one line per distinct stack, outermost frame first, then
+        its sample count. The first frame is the thread's name.
+        :param path: output file
+        :return: path
+        """
+        with open(path, "w") as out:
+            for stack, count in self.stacks.most_common():
+                out.write(f"{stack} {count}\n")
+        return path
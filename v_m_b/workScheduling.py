@@ -0,0 +1,59 @@
+"""
+Splitting manifest work across nodes: which node builds which works or image groups.
+Every node computes the same split from the same work list, without talking to the others.
+Ordering work within a node: which image groups its workers start first.
+"""
+import argparse
+import hashlib
+import heapq
+
+
+def parse_shard(shard: str) -> (int, int):
+    """
+    Argparse type of --shard
+    :param shard: "i/N", with 0 <= i < N
+    :return: (i, N)
+    """
+    try:
+        index, count = (int(x) for x in shard.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{shard} is not of the form i/N")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"{shard}: i must be in 0..N-1")
+    return index, count
+
+
+def stable_shard(key: str, shard_count: int) -> int:
+    """
+    :param key: work RID, or work and image group
+    :param shard_count: number of shards
+    :return: the key's shard. Unlike hash(), the same in every process and on every node
+    """
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big') % shard_count
+
+
+def balanced_shards(weights: {str: int}, shard_count: int) -> {str: int}:
+    """
+    Greedy balancing: the heaviest key goes to the lightest shard, then the next heaviest, and so on.
+    Ties are broken by key and by shard number, so nodes given the same weights agree.
+    :param weights: key to weight, such as its image count
+    :param shard_count: number of shards
+    :return: key to shard
+    """
+    loads: [(int, int)] = [(0, shard) for shard in range(shard_count)]
+    assignment: {str: int} = {}
+    for key in sorted(weights, key=lambda k: (-weights[k], k)):
+        load, shard = heapq.heappop(loads)
+        assignment[key] = shard
+        heapq.heappush(loads, (load + weights[key], shard))
+    return assignment
+
+
+def largest_first(weights: {object: tuple}) -> [object]:
+    """
+    Longest processing time first order: when many workers share a queue, starting the largest
+    tasks first keeps one large task from starting last and running alone at the end.
+    :param weights: task to weight, such as its (image count, bytes)
+    :return: the tasks, heaviest first. Equal tasks keep their order.
+    """
+    return sorted(weights, key=lambda task: weights[task], reverse=True)